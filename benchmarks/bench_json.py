@@ -0,0 +1,105 @@
+# Сравнение реализаций JSON (stdlib и orjson) на реалистичных result_json.
+# Запуск из корня проекта: python -m benchmarks.bench_json [--rows 1000] [--repeat 20] [--output result.json]
+import argparse
+import json
+import random
+import time
+
+from src.app.serialization import JsonSerializer, StdlibJsonSerializer, OrjsonSerializer, orjson
+
+
+def make_result_json(rnd: random.Random) -> dict:
+    """
+    Функция формирует результат детекции в формате мобильного клиента
+    (materials - вложенная JSON-строка, coords - строка со списком)
+    """
+    materials = [
+        {
+            "mlCode": rnd.randint(0, 1),
+            "coords": str([round(rnd.random(), 8) for _ in range(4)]),
+            "conf": round(rnd.random(), 7),
+        }
+        for _ in range(rnd.randint(1, 6))
+    ]
+    timestamp = 1715278839073 + rnd.randint(0, 10 ** 8)
+    return {
+        "image_file": {
+            "timestamp": str(timestamp),
+            "name": f"/storage/emulated/0/Android/media/com.example.detectorproj/Detector App/{timestamp}.jpg",
+        },
+        "isComplete": rnd.random() > 0.5,
+        "confidence": round(rnd.random(), 7),
+        "speedMs": rnd.randint(800, 2500),
+        "materials": json.dumps(materials),
+        "username": rnd.choice(["Иванов", "Гончаров", "Unknown"]),
+    }
+
+
+def make_get_results_payload(results: list[dict]) -> dict:
+    # Ответ /get_results: строки cv_activity с result_json в виде строки
+    rows = [
+        {
+            "id": i,
+            "class_id": 0,
+            "scrs_timestamp": "2024-05-09T21:20:40.205622",
+            "scrs_path": f"{i}.jpg",
+            "is_complete": int(r["isComplete"]),
+            "result_conf": r["confidence"],
+            "result_json": json.dumps(r),
+            "speed_ms": r["speedMs"],
+        }
+        for i, r in enumerate(results)
+    ]
+    return {"data": rows, "errorCode": 0, "ok": True}
+
+
+def timed(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(serializer: JsonSerializer, results: list[dict], repeat: int) -> dict:
+    texts = [serializer.dumps(r) for r in results]
+    response = make_get_results_payload(results)
+    return {
+        # Ответ websocket на каждое сохранение
+        "dumps_result_us": timed(lambda: [serializer.dumps(r) for r in results], repeat) / len(results) * 1e6,
+        # Разбор сообщения с результатом и вложенных materials
+        "loads_result_us": timed(
+            lambda: [serializer.loads(serializer.loads(t)["materials"]) for t in texts], repeat
+        ) / len(results) * 1e6,
+        # Сериализация ответа /get_results целиком
+        "dumps_get_results_ms": timed(lambda: serializer.dumps_bytes(response), repeat) * 1e3,
+        "get_results_bytes": len(serializer.dumps_bytes(response)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000, help='number of result_json payloads')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions, best time is reported')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', required=False, help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    results = [make_result_json(rnd) for _ in range(args.rows)]
+
+    serializers: list[JsonSerializer] = [StdlibJsonSerializer()]
+    if orjson is not None:
+        serializers.append(OrjsonSerializer())
+
+    report = {s.name: bench(s, results, args.repeat) for s in serializers}
+    for name, metrics in report.items():
+        print(f"{name:8s} " + "  ".join(f"{key}={value:.2f}" for key, value in metrics.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "repeat": args.repeat, "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Замер SQL-запросов маршрутов на растущем объёме данных (10k/100k/1M/10M activity).
+# Данные генерируются benchmarks.gen_dataset и дописываются от шага к шагу в одну БД.
+# Запросы - те же, что выполняют маршруты (src/app/queries.py).
+# Запуск из корня проекта: python -m benchmarks.bench_queries --scales 10000 100000 1000000 --output queries.json
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import TextClause
+
+import src.app.json_compression as json_compression
+import src.app.queries as app_queries
+import src.app.utils as utils
+from src.app.db_migrations import apply_migrations
+from benchmarks.bench_utils import clone_schema, project_root, write_report
+from benchmarks.gen_dataset import _user_name, generate_activities, generate_users, open_for_bulk_load
+
+
+def _read_result_json(row) -> None:
+    # /get_results распаковывает result_json каждой записи
+    json_compression.read_result_json(row[6], row[7], row[8])
+
+
+def route_queries(users: int, rnd: random.Random) -> dict[str, tuple[TextClause, dict, Callable | None]]:
+    """
+    Функция возвращает запросы маршрутов (src/app/queries.py) с параметрами
+    и обработкой строк, которую выполняет маршрут
+    """
+    name = _user_name(rnd.randint(1, max(users, 1)))
+    # Пачка /create_users: примерно половина имён уже занята
+    names = [_user_name(rnd.randint(1, max(users, 1) * 2)) for _ in range(100)]
+    return {
+        "get_results": (app_queries.results_sql(), {}, _read_result_json),
+        "get_results_materials": (app_queries.results_materials_sql(), {}, None),
+        "get_agr_results": (app_queries.agr_results_sql(), {}, None),
+        "verify_user": (app_queries.verify_user_sql, {"data": name, "password": "x"}, None),
+        "create_users_name_check": (app_queries.existing_values_sql("name"), {"values": names}, None),
+        "create_users_email_check": (
+            app_queries.existing_values_sql("email"), {"values": [f"{n}@plant.example" for n in names]}, None
+        ),
+    }
+
+
+def compress_result_json(engine) -> int:
+    """
+    Функция сжимает result_json новых записей так же, как приложение (db.compressResultJson)
+    """
+    with utils.Session(bind=engine) as session:
+        json_compression.ensure_dictionary(session)
+    return json_compression.migrate_result_json(batch_size=10_000, batch_pause_ms=0, engine=engine)
+
+
+def time_query(connection: Connection, sql: TextClause, params: dict, repeat: int,
+               handle_row: Callable | None = None) -> dict:
+    """
+    Функция выполняет запрос `repeat` раз, полностью вычитывая (и обрабатывая) результат,
+    и возвращает медиану и минимум
+    """
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = connection.execute(sql, params)
+        rows = 0
+        while True:
+            chunk = result.fetchmany(10_000)
+            if not chunk:
+                break
+            if handle_row is not None:
+                for row in chunk:
+                    handle_row(row)
+            rows += len(chunk)
+        timings.append(time.perf_counter() - start)
+    return {
+        "rows": rows,
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000],
+                        help='cv_activity sizes to measure, ascending')
+    parser.add_argument('--users-ratio', type=float, default=0.01, help='cv_user rows per activity')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', required=False, help='reuse/keep this database instead of a temporary one')
+    parser.add_argument('--source-db', default=os.path.join(project_root, 'db', 'data.db'), help='schema source')
+    parser.add_argument('--compress-json', action=argparse.BooleanOptionalAction, default=None,
+                        help='store result_json compressed (default: db.compressResultJson from config.yaml)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', required=False, help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        workdir = tempfile.mkdtemp(prefix="det-bench-")
+        db_path = os.path.join(workdir, "data.db")
+    if not os.path.exists(db_path):
+        clone_schema(args.source_db, db_path)
+
+    if args.compress_json is None:
+        args.compress_json = bool(utils.prop('db.compressResultJson', False, utils.config))
+
+    rnd = random.Random(args.seed)
+    engine = create_engine(f"sqlite:///{db_path}")
+    # Схема - как у работающего приложения (колонки и индексы, добавляемые при старте)
+    apply_migrations(engine)
+    results = []
+    try:
+        for scale in sorted(args.scales):
+            users = max(1, int(scale * args.users_ratio))
+            connection = open_for_bulk_load(db_path)
+            generate_users(connection, users, rnd)
+            generate_activities(connection, scale, users, 365, rnd, progress=False)
+            connection.close()
+
+            if args.compress_json:
+                compress_result_json(engine)
+
+            # Замеры - через SQLAlchemy, как в приложении
+            with engine.connect() as connection:
+                timings = {
+                    name: time_query(connection, sql, params, args.repeat, handle_row)
+                    for name, (sql, params, handle_row) in route_queries(users, rnd).items()
+                }
+            results.append({"activities": scale, "users": users, "queries": timings})
+            print(f"{scale:>10} " + "  ".join(f"{name}={t['median_ms']}ms" for name, t in timings.items()),
+                  flush=True)
+    finally:
+        engine.dispose()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report({"benchmark": "queries", "params": vars(args), "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Общие функции бенчмарков: подготовка временной БД, статистика, отчёты
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+# Справочные таблицы, данные которых копируются в тестовую БД
+reference_tables = ("cv_activity_class", "cv_material_class", "cv_json_dict")
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def clone_schema(source_db: str, target_db: str, copy_tables: tuple = reference_tables) -> None:
+    """
+    Функция создаёт пустую БД со схемой `source_db` (таблицы и индексы)
+    и копирует в неё данные справочных таблиц
+
+    Args:
+        source_db (str): исходная БД
+        target_db (str): создаваемая БД
+        copy_tables (tuple, optional): таблицы, данные которых копируются
+    """
+    if os.path.exists(target_db):
+        os.remove(target_db)
+    source = sqlite3.connect(source_db)
+    target = sqlite3.connect(target_db)
+    target.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    objects = source.execute("""
+        select type, name, sql
+        from sqlite_master
+        where sql is not null and name not like 'sqlite_%'
+        order by case type when 'table' then 0 else 1 end
+    """).fetchall()
+    for _, _, sql in objects:
+        target.execute(sql)
+    tables = {name for object_type, name, _ in objects if object_type == 'table'}
+    for table in copy_tables:
+        if table not in tables:
+            continue
+        rows = source.execute(f"select * from {table}").fetchall()
+        if rows:
+            placeholders = ", ".join("?" * len(rows[0]))
+            target.executemany(f"insert into {table} values ({placeholders})", rows)
+    target.commit()
+    target.close()
+    source.close()
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    """
+    Функция возвращает перцентиль `p` (0..100) отсортированного списка (метод ближайшего ранга)
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies_s: list[float], duration_s: float, errors: int = 0) -> dict:
+    """
+    Функция сводит список задержек (в секундах) в пропускную способность и перцентили (в мс)
+    """
+    values = sorted(latencies_s)
+    to_ms = (lambda v: round(v * 1000, 3) if v is not None else None)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_per_s": round(len(values) / duration_s, 3) if duration_s > 0 else None,
+        "p50_ms": to_ms(percentile(values, 50)),
+        "p95_ms": to_ms(percentile(values, 95)),
+        "p99_ms": to_ms(percentile(values, 99)),
+        "max_ms": to_ms(values[-1] if values else None),
+    }
+
+
+def rss_mb(pid: int) -> float | None:
+    """
+    Функция возвращает резидентный объём памяти процесса в МБ (Linux, /proc)
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=project_root, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(report: dict, output: str | None) -> None:
+    """
+    Функция печатает отчёт и, если задан `output`, сохраняет его в JSON для сравнения между коммитами
+    """
+    report = {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), **report}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,220 @@
+# Нагрузочный тест: локальный сервер на временной БД, N имитированных камер на /ws/save_result
+# и читатели /get_results, /get_agr_results.
+# Запуск из корня проекта: python -m benchmarks.bench_ws_load --clients 20 --rate 1 --duration 60 --output load.json
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+import yaml
+
+from benchmarks.bench_utils import clone_schema, latency_summary, project_root, rss_mb, write_report
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def add(self, name: str, latency: float):
+        self.latencies.setdefault(name, []).append(latency)
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def prepare_workdir(workdir: str, source_db: str, rate_limit: bool = False) -> None:
+    """
+    Функция готовит рабочий каталог сервера: конфиг с путями во временный каталог и пустую БД.
+    Ограничение частоты запросов по умолчанию отключается, иначе измеряется работа ограничителя
+    """
+    with open(os.path.join(project_root, "resources", "config", "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    config["db"]["path"] = os.path.join(workdir, "data.db")
+    config["images"]["runsFolder"] = os.path.join(workdir, "runs")
+    config["log"] = {"level": "WARN"}
+    if "retention" in config:
+        config["retention"]["enabled"] = False
+    config.setdefault("rateLimit", {})["enabled"] = rate_limit
+
+    os.makedirs(os.path.join(workdir, "resources", "config"))
+    os.makedirs(os.path.join(workdir, "runs"))
+    with open(os.path.join(workdir, "resources", "config", "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    clone_schema(source_db, config["db"]["path"])
+
+
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=project_root)
+    env.pop("SYSTEMLEVEL", None)
+    return subprocess.Popen(
+        [sys.executable, os.path.join(project_root, "run.py"), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_for_server(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def make_result(rnd: random.Random, client_id: int, seq: int) -> dict:
+    materials = [
+        {"mlCode": rnd.randint(0, 1), "coords": str([round(rnd.random(), 8) for _ in range(4)]),
+         "conf": round(rnd.random(), 7)}
+        for _ in range(rnd.randint(1, 4))
+    ]
+    return {
+        "image_file": {"timestamp": str(int(time.time() * 1000)), "name": f"/bench/c{client_id}_{seq}.jpg"},
+        "isComplete": rnd.random() > 0.5,
+        "confidence": round(rnd.random(), 7),
+        "speedMs": rnd.randint(800, 2500),
+        "materials": json.dumps(materials),
+        "username": f"camera_{client_id}",
+    }
+
+
+async def camera_client(args, client_id: int, stats: Stats, deadline: float) -> None:
+    """
+    Имитация камеры: с частотой `rate` - подключение, реквизиты, конфиг, изображение частями и EOF.
+    Сервер обрабатывает одно изображение на подключение, поэтому рукопожатие входит в каждую итерацию
+    """
+    rnd = random.Random(args.seed + client_id)
+    uri = f"ws://127.0.0.1:{args.port}/ws/save_result"
+    seq = 0
+    next_send = time.monotonic()
+    while time.monotonic() < deadline:
+        # Размер изображения - логнормальное распределение вокруг image_kb
+        size = max(1024, int(rnd.lognormvariate(0, 0.35) * args.image_kb * 1024))
+        image = rnd.randbytes(size)
+        start = time.monotonic()
+        try:
+            async with websockets.connect(uri, max_size=None) as ws:
+                await ws.send(json.dumps({"username": args.login, "password": args.password}))
+                await ws.send(json.dumps(make_result(rnd, client_id, seq)))
+                for offset in range(0, size, args.chunk_kb * 1024):
+                    await ws.send(image[offset:offset + args.chunk_kb * 1024])
+                await ws.send(b"")
+                reply = json.loads(await ws.recv())
+            if reply.get("ok"):
+                stats.add("save_result", time.monotonic() - start)
+            else:
+                stats.error("save_result")
+        except (OSError, websockets.WebSocketException):
+            stats.error("save_result")
+        seq += 1
+        next_send += 1 / args.rate
+        await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+
+
+def http_get(url: str, login: str, password: str) -> int:
+    request = urllib.request.Request(url)
+    token = base64.b64encode(f"{login}:{password}".encode()).decode()
+    request.add_header("Authorization", f"Basic {token}")
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+        return response.status
+
+
+async def reader_client(args, path: str, stats: Stats, deadline: float) -> None:
+    url = f"http://127.0.0.1:{args.port}{path}"
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            await asyncio.to_thread(http_get, url, args.login, args.password)
+            stats.add(path, time.monotonic() - start)
+        except OSError:
+            stats.error(path)
+        await asyncio.sleep(max(0.0, 1 / args.reader_rate - (time.monotonic() - start)))
+
+
+async def sample_rss(pid: int, samples: list[float], deadline: float) -> None:
+    while time.monotonic() < deadline:
+        value = rss_mb(pid)
+        if value is not None:
+            samples.append(value)
+        await asyncio.sleep(0.5)
+
+
+async def run_load(args, pid: int) -> dict:
+    stats = Stats()
+    rss_samples: list[float] = []
+    start = time.monotonic()
+    deadline = start + args.duration
+    tasks = [camera_client(args, i, stats, deadline) for i in range(args.clients)]
+    for i in range(args.readers):
+        tasks.append(reader_client(args, "/get_results" if i % 2 == 0 else "/get_agr_results", stats, deadline))
+    tasks.append(sample_rss(pid, rss_samples, deadline))
+    await asyncio.gather(*tasks)
+    duration = time.monotonic() - start
+
+    operations = {
+        name: latency_summary(stats.latencies.get(name, []), duration, stats.errors.get(name, 0))
+        for name in sorted(set(stats.latencies) | set(stats.errors))
+    }
+    return {
+        "duration_s": round(duration, 3),
+        "operations": operations,
+        "rss_mb": {
+            "start": round(rss_samples[0], 1) if rss_samples else None,
+            "max": round(max(rss_samples), 1) if rss_samples else None,
+            "end": round(rss_samples[-1], 1) if rss_samples else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=10, help='simulated cameras')
+    parser.add_argument('--rate', type=float, default=1.0, help='images per second per camera')
+    parser.add_argument('--readers', type=int, default=2, help='concurrent /get_results and /get_agr_results pollers')
+    parser.add_argument('--reader-rate', type=float, default=0.5, help='requests per second per reader')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--image-kb', type=int, default=300, help='median image size')
+    parser.add_argument('--chunk-kb', type=int, default=64, help='websocket chunk size')
+    parser.add_argument('--port', type=int, default=18050)
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--source-db', default=os.path.join(project_root, 'db', 'data.db'), help='schema source')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate-limit', action='store_true', help='keep rateLimit from config.yaml enabled')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory')
+    parser.add_argument('--output', required=False, help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="det-bench-")
+    server = None
+    try:
+        prepare_workdir(workdir, args.source_db, args.rate_limit)
+        server = start_server(workdir, args.port)
+        wait_for_server(f"http://127.0.0.1:{args.port}")
+        result = asyncio.run(run_load(args, server.pid))
+        write_report({"benchmark": "ws_load", "params": vars(args), **result}, args.output)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if args.keep:
+            print(f"Working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
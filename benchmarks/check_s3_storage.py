@@ -0,0 +1,107 @@
+# Проверка S3-хранилища изображений (src/app/image_storage.py) на локальной замене S3:
+# moto (по умолчанию, в памяти процесса) или MinIO (--endpoint-url).
+# Проверяются сохранение (в т.ч. multipart), head/exists/size, чтение, перенос в архив и удаление.
+# Запуск из корня проекта: python -m benchmarks.check_s3_storage
+#   или на MinIO: python -m benchmarks.check_s3_storage --endpoint-url http://127.0.0.1:9000 --bucket images
+import argparse
+import contextlib
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import boto3
+
+from src.app.image_storage import S3ImageStorage
+
+# Минимальный размер части multipart upload в S3
+_min_part_mb = 5
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+    print(f"ok   {message}", flush=True)
+
+
+def run_checks(storage: S3ImageStorage, client, image_mb: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    small = rnd.randbytes(100 * 1024)
+    large = rnd.randbytes(image_mb * 1024 * 1024)
+
+    # Небольшое изображение - одним запросом
+    location = storage.save("small.jpg", small)
+    check(location == storage.location("small.jpg"), f"save returns location {location}")
+    check(storage.exists("small.jpg") and storage.size("small.jpg") == len(small), "head: exists and size")
+    with storage.open("small.jpg") as source:
+        check(source.read() == small, "open: content matches")
+
+    # Крупное изображение из файлового объекта - частями
+    with tempfile.TemporaryFile() as fileobj:
+        fileobj.write(large)
+        fileobj.seek(0)
+        storage.save("large.jpg", fileobj)
+    etag = client.head_object(Bucket=storage.bucket, Key=storage.key("large.jpg"))["ETag"].strip('"')
+    parts = int(etag.rsplit("-", 1)[1]) if "-" in etag else 1
+    check(parts == -(-image_mb // _min_part_mb), f"multipart upload: {parts} parts")
+    check(storage.size("large.jpg") == len(large), "multipart: size")
+
+    # Отсутствующее изображение
+    check(not storage.exists("missing.jpg") and storage.size("missing.jpg") is None, "head: missing image")
+
+    # Перенос в архив (политика хранения, src/app/retention.py)
+    archive_dir = tempfile.mkdtemp(prefix="det-s3-archive-")
+    try:
+        target = os.path.join(archive_dir, "large.jpg")
+        storage.move_to("large.jpg", target)
+        with open(target, "rb") as f:
+            check(hashlib.sha256(f.read()).digest() == hashlib.sha256(large).digest(), "move_to: archive file matches")
+        check(not storage.exists("large.jpg"), "move_to: object removed from bucket")
+    finally:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+
+    storage.delete("small.jpg")
+    check(not storage.exists("small.jpg"), "delete")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint-url', required=False, help='S3-compatible endpoint (MinIO); moto if omitted')
+    parser.add_argument('--bucket', default='det-images-check')
+    parser.add_argument('--prefix', default='check/')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--access-key', default=os.getenv('AWS_ACCESS_KEY_ID', 'testing'))
+    parser.add_argument('--secret-key', default=os.getenv('AWS_SECRET_ACCESS_KEY', 'testing'))
+    parser.add_argument('--image-mb', type=int, default=12, help='size of the multipart image')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.endpoint_url is None:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit("moto is required without --endpoint-url (pip install moto)")
+        mock = mock_aws()
+    else:
+        mock = contextlib.nullcontext()
+
+    with mock:
+        client = boto3.client(
+            "s3", endpoint_url=args.endpoint_url, region_name=args.region,
+            aws_access_key_id=args.access_key, aws_secret_access_key=args.secret_key
+        )
+        with contextlib.suppress(client.exceptions.BucketAlreadyOwnedByYou):
+            client.create_bucket(Bucket=args.bucket)
+        storage = S3ImageStorage(
+            bucket=args.bucket, prefix=args.prefix, endpoint_url=args.endpoint_url, region=args.region,
+            access_key=args.access_key, secret_key=args.secret_key,
+            multipart_threshold_mb=_min_part_mb, multipart_chunk_mb=_min_part_mb
+        )
+        run_checks(storage, client, args.image_mb, args.seed)
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Генератор синтетических данных большого объёма: cv_activity, cv_activity_mat, cv_user.
+# В отличие от create_db_demo.py работает без диалога и дописывает данные пачками.
+# Запуск из корня проекта: python -m benchmarks.gen_dataset --db /tmp/big.db --activities 1000000 --users 10000
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import time
+
+from benchmarks.bench_utils import clone_schema, project_root
+
+# Размер пачки (одна транзакция)
+batch_size: int = 50_000
+
+
+def _columns(connection: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in connection.execute(f"pragma table_info({table})")}
+
+
+def _max_id(connection: sqlite3.Connection, table: str) -> int:
+    return connection.execute(f"select ifnull(max(id), 0) from {table}").fetchone()[0]
+
+
+def _user_name(user_id: int) -> str:
+    return f"operator_{user_id:07d}"
+
+
+def generate_users(connection: sqlite3.Connection, count: int, rnd: random.Random) -> None:
+    """
+    Функция дописывает пользователей до общего количества `count`
+    """
+    first_id = _max_id(connection, "cv_user") + 1
+    rows = (
+        (user_id, _user_name(user_id), f"{_user_name(user_id)}@plant.example", f"{rnd.getrandbits(64):016x}")
+        for user_id in range(first_id, count + 1)
+    )
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        connection.executemany("insert into cv_user (id, name, email, password) values (?, ?, ?, ?)", batch)
+        connection.commit()
+
+
+def generate_activities(connection: sqlite3.Connection, count: int, users: int, days: int,
+                        rnd: random.Random, progress: bool = True) -> None:
+    """
+    Функция дописывает activity (и их материалы) до общего количества `count`.
+    Распределения: время - рабочие смены за последние `days` дней, пользователи - по закону Ципфа,
+    1-4 материала на activity, speed_ms - логнормальное, ~60% завершённых проверок
+    """
+    has_coords = "x1" in _columns(connection, "cv_activity_mat")
+    mat_columns = "id, act_id, mat_class_id, coords, conf" + (", x1, y1, x2, y2" if has_coords else "")
+    mat_sql = f"insert into cv_activity_mat ({mat_columns}) values ({', '.join('?' * len(mat_columns.split(',')))})"
+    act_sql = """
+        insert into cv_activity (id, class_id, scrs_timestamp, scrs_path, is_complete,
+            result_conf, result_json, speed_ms, username)
+        values (?, 0, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    act_id = _max_id(connection, "cv_activity")
+    mat_id = _max_id(connection, "cv_activity_mat")
+    start_time = datetime.datetime.now() - datetime.timedelta(days=days)
+    # Веса пользователей по закону Ципфа: немногие операторы делают большую часть проверок
+    user_weights = [1 / rank for rank in range(1, max(users, 1) + 1)]
+    started = time.monotonic()
+
+    while act_id < count:
+        activities = []
+        materials = []
+        user_ids = rnd.choices(range(1, max(users, 1) + 1), weights=user_weights, k=min(batch_size, count - act_id))
+        for user_id in user_ids:
+            act_id += 1
+            # Смены 8:00-20:00
+            timestamp = start_time + datetime.timedelta(
+                days=rnd.randrange(days), hours=8 + rnd.random() * 12
+            )
+            mats = []
+            for _ in range(rnd.randint(1, 4)):
+                mat_id += 1
+                x1, y1 = rnd.random() * 0.8, rnd.random() * 0.8
+                box = [round(v, 8) for v in (x1, y1, x1 + rnd.uniform(0.05, 0.2), y1 + rnd.uniform(0.02, 0.1))]
+                mat = {"mlCode": rnd.randint(0, 1), "coords": str(box), "conf": round(rnd.betavariate(8, 2), 7)}
+                mats.append(mat)
+                row = (mat_id, act_id, mat["mlCode"], mat["coords"], mat["conf"])
+                materials.append(row + tuple(box) if has_coords else row)
+            is_complete = rnd.random() < 0.6
+            speed_ms = int(rnd.lognormvariate(7.2, 0.3))
+            username = _user_name(user_id)
+            scrs_name = f"{timestamp.strftime('%Y-%m-%d-%H-%M-%S')}-{act_id % 1000:03d}.jpg"
+            result_json = json.dumps({
+                "image_file": {"timestamp": str(int(timestamp.timestamp() * 1000)),
+                               "name": f"/storage/emulated/0/Android/media/com.example.detectorproj/"
+                                       f"Detector App/{scrs_name}"},
+                "isComplete": is_complete,
+                "confidence": mats[0]["conf"],
+                "speedMs": speed_ms,
+                "materials": json.dumps(mats),
+                "username": username,
+            })
+            activities.append((act_id, timestamp.isoformat(), scrs_name, is_complete, mats[0]["conf"],
+                               result_json, speed_ms, username))
+        connection.executemany(act_sql, activities)
+        connection.executemany(mat_sql, materials)
+        connection.commit()
+        if progress:
+            elapsed = time.monotonic() - started
+            print(f"cv_activity: {act_id} rows ({len(activities) / max(elapsed, 1e-9):.0f} rows/s)", flush=True)
+            started = time.monotonic()
+
+
+def open_for_bulk_load(db_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path)
+    # Генератор - единственный писатель, надёжность записи не нужна
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA cache_size = -262144")
+    return connection
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', required=True, help='target database (created from --source-db if missing)')
+    parser.add_argument('--activities', type=int, required=True, help='total cv_activity rows')
+    parser.add_argument('--users', type=int, default=1000, help='total cv_user rows')
+    parser.add_argument('--days', type=int, default=365, help='time span of generated activities')
+    parser.add_argument('--source-db', default=os.path.join(project_root, 'db', 'data.db'), help='schema source')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        clone_schema(args.source_db, args.db)
+    rnd = random.Random(args.seed)
+    connection = open_for_bulk_load(args.db)
+    try:
+        generate_users(connection, args.users, rnd)
+        generate_activities(connection, args.activities, args.users, args.days, rnd)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -53,9 +53,18 @@ cursor.execute('drop table if exists cv_material_class')
 cursor.execute('drop table if exists cv_activity_class')
 cursor.execute('drop table if exists cv_activity')
 cursor.execute('drop table if exists cv_activity_mat')
+cursor.execute('drop table if exists cv_json_dict')
+cursor.execute('drop table if exists cv_stat_sketch')
+cursor.execute('drop table if exists cv_stat_backfill')
+cursor.execute('drop table if exists cv_reference_version')
 
 print('Все таблицы и данные удалены\n')
 
+# Режим INCREMENTAL позволяет политике хранения (src/app/retention.py) возвращать место ОС по частям.
+# Для уже существующего файла БД новый режим вступает в силу только после VACUUM
+cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+cursor.execute('VACUUM')
+
 # ------------------------------------------------------
 # Системные таблицы
 # ------------------------------------------------------
@@ -84,6 +93,38 @@ CREATE TABLE IF NOT EXISTS cv_activity_class (
 ''')
 print('Таблица cv_activity_class создана')
 
+# Таблица cv_json_dict (словари сжатия result_json, заполняется при старте приложения)
+cursor.execute('''
+CREATE TABLE IF NOT EXISTS cv_json_dict (
+    id integer not null primary key,
+	data blob not null,
+	created text
+)
+''')
+print('Таблица cv_json_dict создана')
+
+# Таблица cv_stat_sketch (квантильные скетчи speed_ms / ingest_ms по дням и пользователям)
+cursor.execute('''
+CREATE TABLE IF NOT EXISTS cv_stat_sketch (
+    d text not null,
+	username text not null,
+	metric text not null,
+	sketch blob not null,
+	primary key (d, username, metric)
+)
+''')
+print('Таблица cv_stat_sketch создана')
+
+# Таблица cv_stat_backfill (позиция построения скетчей по уже сохранённым activity)
+cursor.execute('''
+CREATE TABLE IF NOT EXISTS cv_stat_backfill (
+    metric text not null primary key,
+	position text not null,
+	until text not null
+)
+''')
+print('Таблица cv_stat_backfill создана')
+
 
 # ------------------------------------------------------
 # Activity
@@ -99,7 +140,12 @@ CREATE TABLE IF NOT EXISTS cv_activity (
 	is_complete boolean,
 	result_conf float,
 	result_json text,
+	result_json_z blob,
+	result_json_dict integer,
 	speed_ms integer,
+	image_size_orig integer,
+	image_size integer,
+	idempotency_key text,
 	comment text,
 	constraint cvact_class_fk foreign key (class_id) references cv_activity_class(id)
 )
@@ -117,6 +163,10 @@ CREATE TABLE IF NOT EXISTS cv_activity_mat (
     act_id integer not null,
     mat_class_id integer not null,
 	coords text not null,
+	x1 float,
+	y1 float,
+	x2 float,
+	y2 float,
 	conf float,
 	comment text,
 	constraint cvactmat_act_fk foreign key (act_id) references cv_activity(id),
@@ -141,7 +191,12 @@ print()
 # ------------------------------------------------------
 # Создание индексов
 # ------------------------------------------------------
-# TODO
+
+cursor.execute('create index if not exists cvact_ts_idx on cv_activity (scrs_timestamp)')
+cursor.execute('create index if not exists cvactmat_act_idx on cv_activity_mat (act_id)')
+cursor.execute('create unique index if not exists cvact_idem_uidx on cv_activity (idempotency_key)')
+print('Индексы созданы')
+print()
 
 # ------------------------------------------------------
 # Сохраняем изменения и закрываем соединение
@@ -0,0 +1,107 @@
+# Трансляция новых activity подписчикам (/ws/activity_feed).
+# Запись публикуется после фиксации транзакции save_result. Каждая запись сериализуется один раз,
+# готовый текст разделяется всеми подписчиками. У каждого подписчика ограниченная очередь:
+# медленный клиент теряет (drop) или схлопывает (coalesce) сообщения и не задерживает приём результатов.
+import asyncio
+from collections import deque
+
+import src.app.serialization as serialization
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_subscribers: set["Subscriber"] = set()
+
+
+class Subscriber:
+    """
+    Подписчик ленты с фильтром и ограниченной очередью сообщений
+
+    Args:
+        username (str, optional): только activity пользователя
+        is_complete (bool, optional): только activity с заданным признаком завершённости
+        policy (str, optional): поведение при переполнении очереди:
+            drop - отбрасываются самые старые сообщения,
+            coalesce - очередь заменяется одним сообщением о пропуске и последней записью
+        max_queue (int, optional): размер очереди
+    """
+
+    def __init__(self, username: str = None, is_complete: bool = None, policy: str = "drop", max_queue: int = None):
+        if policy not in ("drop", "coalesce"):
+            raise ValueError(f"Unknown policy: {policy}")
+        if max_queue is None:
+            max_queue = int(utils.prop('feed.maxQueue', 256, utils.config))
+        self.username = username
+        self.is_complete = is_complete
+        self.policy = policy
+        self.max_queue = max(max_queue, 2)
+        self.dropped = 0
+        self._queue: deque[str] = deque()
+        self._ready = asyncio.Event()
+
+    def matches(self, row: dict) -> bool:
+        if self.username is not None and row.get("username") != self.username:
+            return False
+        if self.is_complete is not None and bool(row.get("is_complete")) != self.is_complete:
+            return False
+        return True
+
+    def put(self, message: str, row: dict) -> None:
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "coalesce":
+                skipped = len(self._queue)
+                self._queue.clear()
+                self._queue.append(serialization.dumps({"type": "gap", "skipped": skipped, "last_id": row["id"]}))
+                self.dropped += skipped
+            else:
+                self._queue.popleft()
+                self.dropped += 1
+        self._queue.append(message)
+        self._ready.set()
+
+    async def get(self) -> str:
+        while not self._queue:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+
+def subscribe(subscriber: Subscriber) -> None:
+    global _loop
+    _loop = asyncio.get_running_loop()
+    _subscribers.add(subscriber)
+
+
+def unsubscribe(subscriber: Subscriber) -> None:
+    _subscribers.discard(subscriber)
+
+
+def subscribers_count() -> int:
+    return len(_subscribers)
+
+
+def _dispatch(rows: list[dict]) -> None:
+    for row in rows:
+        message = None
+        for subscriber in list(_subscribers):
+            if not subscriber.matches(row):
+                continue
+            if message is None:
+                message = serialization.dumps({"type": "activity", "data": row})
+            subscriber.put(message, row)
+
+
+def publish(rows: list[dict]) -> None:
+    """
+    Функция передаёт подписчикам зафиксированные activity.
+    Может вызываться из любого потока: рассылка выполняется в цикле событий
+    """
+    if not _subscribers or _loop is None or _loop.is_closed():
+        return
+    try:
+        _loop.call_soon_threadsafe(_dispatch, rows)
+    except RuntimeError as e:
+        logger.debug(f'Error: {e}')
@@ -0,0 +1,56 @@
+# Версия данных activity для условных запросов (ETag) к /get_results и /get_agr_results.
+# Версия увеличивается при каждой записи или удалении activity этим процессом.
+# ETag = идентификатор запуска, версия и хэш маршрута с параметрами запроса: у каждого варианта ответа
+# (since_id, with_json, период и т.д.) свой ETag. После перезапуска клиенты получают данные заново.
+# Last-Modified не используется: секундная точность даёт ложные 304 при записи в ту же секунду.
+import hashlib
+import secrets
+import threading
+from urllib.parse import urlencode
+
+from starlette.requests import Request
+
+_boot_id: str = secrets.token_hex(4)
+_version: int = 0
+_lock = threading.Lock()
+
+
+def mark_changed() -> None:
+    """
+    Отмечает изменение данных activity
+    """
+    global _version
+    with _lock:
+        _version += 1
+
+
+def _variant(request: Request) -> str:
+    # Маршрут и параметры запроса без учёта их порядка
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return hashlib.sha1(f"{request.url.path}?{query}".encode("utf-8")).hexdigest()[:16]
+
+
+def etag(request: Request) -> str:
+    return f'"{_boot_id}-{_version}-{_variant(request)}"'
+
+
+def cache_headers(request: Request) -> dict:
+    """
+    Заголовки ответа, по которым клиент сможет выполнить условный запрос.
+    Должны формироваться до чтения данных: изменение во время чтения не должно попасть в ETag
+    """
+    return {
+        "ETag": etag(request),
+        "Cache-Control": "no-cache",
+    }
+
+
+def not_modified(request: Request) -> bool:
+    """
+    Проверяет, что данные ответа на этот запрос не менялись с версии, известной клиенту (If-None-Match)
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    current = etag(request)
+    return any(tag.strip().removeprefix("W/") in (current, "*") for tag in if_none_match.split(","))
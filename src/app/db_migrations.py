@@ -0,0 +1,203 @@
+# Доводка схемы существующей БД до актуального состояния при старте приложения.
+# Все шаги идемпотентны: create_db_demo.py создаёт схему сразу в актуальном виде.
+from sqlalchemy import text
+
+import src.app.shards as shards
+import src.app.utils as utils
+from src.app.json_compression import ensure_dictionary
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+
+def _add_column(session, table: str, column: str, column_type: str) -> bool:
+    """
+    Функция добавляет колонку в таблицу, если её ещё нет
+
+    Returns:
+        (bool): True, если колонка была добавлена
+    """
+    columns = [row[1] for row in session.execute(text(f"pragma table_info({table})"))]
+    if column in columns:
+        return False
+    session.execute(text(f"alter table {table} add column {column} {column_type}"))
+    logger.info("Column %s.%s added", table, column)
+    return True
+
+
+def _migrate_coords(session, batch_size: int = 10_000) -> None:
+    """
+    Функция заполняет числовые колонки x1, y1, x2, y2 материалов
+    разбором текстовой колонки coords, пачками по `batch_size` строк
+    """
+    select_sql = text("""
+        select id, coords
+        from cv_activity_mat
+        where id > :last_id and x1 is null
+        order by id
+        limit :batch_size
+    """)
+    update_sql = text("update cv_activity_mat set x1 = :x1, y1 = :y1, x2 = :x2, y2 = :y2 where id = :id")
+    last_id = -1
+    migrated = 0
+    while True:
+        rows = list(session.execute(select_sql, {"last_id": last_id, "batch_size": batch_size}))
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = []
+        for mat_id, coords in rows:
+            values = utils.parse_coords(coords)
+            if values is not None:
+                params.append({"id": mat_id, "x1": values[0], "y1": values[1], "x2": values[2], "y2": values[3]})
+        if params:
+            session.execute(update_sql, params)
+        session.commit()
+        migrated += len(params)
+    if migrated:
+        logger.info("Coordinates migrated for %d materials", migrated)
+
+
+def _prepare_result_json_compression(session) -> None:
+    """
+    Функция создаёт таблицу словарей сжатия result_json и загружает (обучает) словарь.
+    Сами данные сжимаются в фоне (json_compression.start_result_json_migration)
+    """
+    session.execute(text("""
+        create table if not exists cv_json_dict (
+            id integer not null primary key,
+            data blob not null,
+            created text
+        )
+    """))
+    session.commit()
+    ensure_dictionary(session)
+
+
+def _create_indexes(session) -> None:
+    # Выборка по времени (политика хранения, отчёты) и материалы по activity
+    session.execute(text("create index if not exists cvact_ts_idx on cv_activity (scrs_timestamp)"))
+    session.execute(text("create index if not exists cvactmat_act_idx on cv_activity_mat (act_id)"))
+    # Ключ идемпотентности результата (null у результатов без ключа)
+    session.execute(text("create unique index if not exists cvact_idem_uidx on cv_activity (idempotency_key)"))
+
+
+def _create_user_indexes(session) -> None:
+    """
+    Функция создаёт уникальные индексы cv_user по имени и e-mail
+    (проверка уникальности при создании пользователей)
+    """
+    for index_name, column in (("cvuser_name_uidx", "name"), ("cvuser_email_uidx", "email")):
+        try:
+            session.execute(text(f"create unique index if not exists {index_name} on cv_user ({column})"))
+        except Exception as e:
+            # В БД уже есть дубликаты - индекс не создаётся, уникальность проверяется только запросом
+            session.rollback()
+            logger.warning(f"Unique index {index_name} is not created: {e}")
+    session.commit()
+
+
+def _create_stat_tables(session) -> None:
+    # Квантильные скетчи speed_ms / ingest_ms по дням и пользователям (src/app/latency_stats.py)
+    session.execute(text("""
+        create table if not exists cv_stat_sketch (
+            d text not null,
+            username text not null,
+            metric text not null,
+            sketch blob not null,
+            primary key (d, username, metric)
+        )
+    """))
+    # Позиция построения скетчей по уже сохранённым activity
+    session.execute(text("""
+        create table if not exists cv_stat_backfill (
+            metric text not null primary key,
+            position text not null,
+            until text not null
+        )
+    """))
+    session.commit()
+
+
+def _create_reference_version(session) -> None:
+    """
+    Функция создаёт счётчик версии справочников и триггеры, увеличивающие его при любом изменении
+    cv_material_class и cv_activity_class (src/app/reference_cache.py)
+    """
+    session.execute(text("""
+        create table if not exists cv_reference_version (
+            id integer not null primary key,
+            version integer not null
+        )
+    """))
+    session.execute(text("insert or ignore into cv_reference_version (id, version) values (1, 0)"))
+    for table in ("cv_material_class", "cv_activity_class"):
+        for operation in ("insert", "update", "delete"):
+            session.execute(text(f"""
+                create trigger if not exists {table}_{operation}_ver after {operation} on {table}
+                begin
+                    update cv_reference_version set version = version + 1 where id = 1;
+                end
+            """))
+    session.commit()
+
+
+def _migrate_activity_tables(session) -> None:
+    """
+    Функция добавляет колонки и индексы таблиц activity.
+    Применяется к основной БД и ко всем шардам (src/app/shards.py)
+    """
+    for column in ("x1", "y1", "x2", "y2"):
+        _add_column(session, "cv_activity_mat", column, "float")
+    _add_column(session, "cv_activity", "result_json_z", "blob")
+    _add_column(session, "cv_activity", "result_json_dict", "integer")
+    _add_column(session, "cv_activity", "image_size_orig", "integer")
+    _add_column(session, "cv_activity", "image_size", "integer")
+    _add_column(session, "cv_activity", "idempotency_key", "text")
+    _create_indexes(session)
+    session.commit()
+
+
+def _enable_incremental_vacuum() -> None:
+    """
+    Функция однократно переводит основную БД в режим auto_vacuum = INCREMENTAL, необходимый
+    для возврата места политикой хранения (retention.vacuumPages). Смена режима требует полного VACUUM,
+    который перестраивает файл БД и на большой БД занимает заметное время, поэтому выполняется
+    только при включённой политике хранения
+    """
+    if not utils.prop('retention.enabled', False, utils.config) or \
+            int(utils.prop('retention.vacuumPages', 1000, utils.config)) <= 0:
+        return
+    with utils.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        logger.info("Switching database to incremental auto_vacuum (full VACUUM), this may take a while")
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+    logger.info("Database switched to incremental auto_vacuum")
+
+
+def apply_migrations(engine=None) -> None:
+    """
+    Функция применяет к БД недостающие изменения схемы.
+    `engine` - БД для миграции (по умолчанию основная БД и все шарды)
+    """
+    with (utils.Session() if engine is None else utils.Session(bind=engine)) as session:
+        _migrate_activity_tables(session)
+        _migrate_coords(session)
+        _prepare_result_json_compression(session)
+        _create_user_indexes(session)
+        _create_stat_tables(session)
+        _create_reference_version(session)
+    if engine is not None:
+        return
+    _enable_incremental_vacuum()
+
+    # Шарды прошлых месяцев открываются на запись только на время миграции
+    for key in shards.list_shard_keys():
+        with utils.Session(bind=shards.get_shard_engine(key, read_only=False)) as session:
+            _migrate_activity_tables(session)
+        shards.copy_json_dictionaries(shards.get_shard_engine(key, read_only=False))
+        shards.release_shard(key)
+    logger.info("Database migrations applied")
@@ -0,0 +1,109 @@
+# Статистика детекций по классам материалов: тепловые карты положения рамок,
+# гистограммы уверенности и размеров рамок. Расчёт векторизован и выполняется пачками.
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import src.app.utils as utils
+from src.app.detections import iter_detection_chunks
+
+# Кэш результатов: ключ (date_from, date_to, mat_class_id, bins) -> (время расчёта, результат)
+_stats_cache: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+_stats_cache_size: int = 128
+# Расчёт выполняется в потоках asyncio.to_thread - обращения к кэшу синхронизируются
+_stats_cache_lock = threading.Lock()
+
+
+def _empty_class_stats(bins: int) -> dict:
+    return {
+        "count": 0,
+        "conf_sum": 0.0,
+        "heatmap": np.zeros(bins * bins, dtype=np.int64),
+        "conf_hist": np.zeros(bins, dtype=np.int64),
+        "width_hist": np.zeros(bins, dtype=np.int64),
+        "height_hist": np.zeros(bins, dtype=np.int64),
+    }
+
+
+def _bin_index(values: np.ndarray, bins: int) -> np.ndarray:
+    # Координаты, уверенность и размеры нормированы на [0, 1]
+    return np.clip((values * bins).astype(np.int64), 0, bins - 1)
+
+
+def _accumulate(stats: dict, conf: np.ndarray, boxes: np.ndarray, bins: int) -> None:
+    cx = (boxes[:, 0] + boxes[:, 2]) * 0.5
+    cy = (boxes[:, 1] + boxes[:, 3]) * 0.5
+    width = np.abs(boxes[:, 2] - boxes[:, 0])
+    height = np.abs(boxes[:, 3] - boxes[:, 1])
+
+    stats["count"] += len(conf)
+    stats["heatmap"] += np.bincount(
+        _bin_index(cy, bins) * bins + _bin_index(cx, bins), minlength=bins * bins
+    )
+    valid_conf = conf[conf >= 0]
+    stats["conf_sum"] += float(valid_conf.sum(dtype=np.float64))
+    stats["conf_hist"] += np.bincount(_bin_index(valid_conf, bins), minlength=bins)
+    stats["width_hist"] += np.bincount(_bin_index(width, bins), minlength=bins)
+    stats["height_hist"] += np.bincount(_bin_index(height, bins), minlength=bins)
+
+
+def compute_detection_stats(date_from: str = None, date_to: str = None,
+                            mat_class_id: int = None, bins: int = 20) -> dict:
+    """
+    Функция рассчитывает статистику детекций за период по каждому классу материала
+
+    Args:
+        date_from (str, optional): начало периода (ISO, включительно)
+        date_to (str, optional): конец периода (ISO, не включительно)
+        mat_class_id (int, optional): класс материала; по умолчанию - все классы
+        bins (int, optional): число интервалов гистограмм и сторона тепловой карты
+
+    Returns:
+        (dict): статистика по классам: количество, средняя уверенность, тепловая карта центров рамок
+            (bins x bins, строки - ось y), гистограммы уверенности, ширины и высоты рамок на [0, 1]
+    """
+    per_class: dict[int, dict] = {}
+    for chunk in iter_detection_chunks(date_from, date_to, mat_class_id):
+        class_ids = chunk["mat_class_id"]
+        for class_id in np.unique(class_ids):
+            mask = class_ids == class_id
+            stats = per_class.setdefault(int(class_id), _empty_class_stats(bins))
+            _accumulate(stats, chunk["conf"][mask], chunk["boxes"][mask], bins)
+
+    result = {}
+    for class_id, stats in sorted(per_class.items()):
+        conf_count = int(stats["conf_hist"].sum())
+        result[str(class_id)] = {
+            "count": stats["count"],
+            "conf_mean": stats["conf_sum"] / conf_count if conf_count else None,
+            "heatmap": stats["heatmap"].reshape(bins, bins).tolist(),
+            "conf_hist": stats["conf_hist"].tolist(),
+            "width_hist": stats["width_hist"].tolist(),
+            "height_hist": stats["height_hist"].tolist(),
+        }
+    return {"bins": bins, "classes": result}
+
+
+def get_detection_stats(date_from: str = None, date_to: str = None,
+                        mat_class_id: int = None, bins: int = 20) -> dict:
+    """
+    Функция возвращает статистику детекций (см. `compute_detection_stats`) с кэшированием
+    по ключу (период, класс, bins) на время `stats.cacheSeconds` из конфига
+    """
+    cache_seconds = float(utils.prop('stats.cacheSeconds', 300, utils.config))
+    key = (date_from, date_to, mat_class_id, bins)
+    with _stats_cache_lock:
+        cached = _stats_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < cache_seconds:
+            _stats_cache.move_to_end(key)
+            return cached[1]
+
+    result = compute_detection_stats(date_from, date_to, mat_class_id, bins)
+    with _stats_cache_lock:
+        _stats_cache[key] = (time.monotonic(), result)
+        _stats_cache.move_to_end(key)
+        while len(_stats_cache) > _stats_cache_size:
+            _stats_cache.popitem(last=False)
+    return result
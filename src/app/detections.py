@@ -0,0 +1,115 @@
+# Загрузка детекций (материалов activity) в виде непрерывных массивов NumPy для аналитики
+from typing import Iterator
+
+import numpy as np
+
+import src.app.shards as shards
+
+# Поля одной детекции в порядке колонок запроса
+detection_dtype = np.dtype([
+    ("act_id", np.int64),
+    ("mat_class_id", np.int32),
+    ("conf", np.float32),
+    ("x1", np.float32),
+    ("y1", np.float32),
+    ("x2", np.float32),
+    ("y2", np.float32),
+])
+
+
+def _detections_sql(date_from: str | None, date_to: str | None,
+                    mat_class_id: int | None, username: str | None) -> tuple[str, dict]:
+    conditions = ["m.x1 is not null"]
+    params = {}
+    if date_from:
+        conditions.append("a.scrs_timestamp >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append("a.scrs_timestamp < :date_to")
+        params["date_to"] = date_to
+    if mat_class_id is not None:
+        conditions.append("m.mat_class_id = :mat_class_id")
+        params["mat_class_id"] = mat_class_id
+    if username:
+        conditions.append("a.username = :username")
+        params["username"] = username
+    # Отсутствующая уверенность возвращается как -1
+    sql = f"""
+        select m.act_id,
+            m.mat_class_id,
+            ifnull(m.conf, -1.0),
+            m.x1,
+            m.y1,
+            m.x2,
+            m.y2
+        from cv_activity_mat m
+        join cv_activity a on a.id = m.act_id
+        where {" and ".join(conditions)}
+        order by m.act_id, m.id
+    """
+    return sql, params
+
+
+def _to_arrays(records: np.ndarray) -> dict[str, np.ndarray]:
+    return {
+        "act_id": np.ascontiguousarray(records["act_id"]),
+        "mat_class_id": np.ascontiguousarray(records["mat_class_id"]),
+        "conf": np.ascontiguousarray(records["conf"]),
+        "boxes": np.ascontiguousarray(
+            np.stack([records["x1"], records["y1"], records["x2"], records["y2"]], axis=1)
+        ),
+    }
+
+
+def iter_detection_chunks(
+        date_from: str = None,
+        date_to: str = None,
+        mat_class_id: int = None,
+        username: str = None,
+        chunk_size: int = 100_000
+) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Функция последовательно возвращает детекции, удовлетворяющие фильтру, пачками по `chunk_size`
+
+    Args:
+        date_from (str, optional): начало периода (ISO, включительно)
+        date_to (str, optional): конец периода (ISO, не включительно)
+        mat_class_id (int, optional): класс материала
+        username (str, optional): пользователь
+        chunk_size (int, optional): размер пачки
+
+    Returns:
+        (Iterator[dict[str, np.ndarray]]): пачки с массивами act_id (N,), mat_class_id (N,),
+            conf (N,) и boxes (N, 4) с координатами x1, y1, x2, y2
+    """
+    sql, params = _detections_sql(date_from, date_to, mat_class_id, username)
+    # Основная БД и шарды, попадающие в период
+    for engine in shards.read_engines(date_from, date_to):
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield _to_arrays(np.array(rows, dtype=detection_dtype))
+            cursor.close()
+        finally:
+            connection.close()
+
+
+def load_detections(
+        date_from: str = None,
+        date_to: str = None,
+        mat_class_id: int = None,
+        username: str = None
+) -> dict[str, np.ndarray]:
+    """
+    Функция возвращает все детекции, удовлетворяющие фильтру, в виде непрерывных массивов NumPy.
+    Параметры и состав массивов - как у `iter_detection_chunks`
+    """
+    chunks = list(iter_detection_chunks(date_from, date_to, mat_class_id, username))
+    if not chunks:
+        return _to_arrays(np.empty(0, dtype=detection_dtype))
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
@@ -0,0 +1,269 @@
+# Выгрузка activity за период (для аудита) потоковым архивом tar или zip:
+# манифест строк cv_activity и cv_activity_mat (JSON Lines, по файлу на пачку) и изображения.
+# Архив формируется на лету в отдельном потоке и передаётся клиенту частями через ограниченную очередь:
+# очередь одновременно ограничивает память и задаёт упреждающее чтение файлов.
+import asyncio
+import io
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from typing import AsyncIterator
+
+from sqlalchemy import text
+
+import src.app.image_storage as image_storage
+import src.app.serialization as serialization
+import src.app.shards as shards
+import src.app.utils as utils
+from src.app.json_compression import read_result_json
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+export_formats = {
+    "tar": ("application/x-tar", ".tar"),
+    "zip": ("application/zip", ".zip"),
+}
+
+
+class ExportCancelled(Exception):
+    """
+    Клиент прервал получение архива
+    """
+
+
+class _QueueWriter:
+    """
+    Файловый объект для записи архива: накапливает данные до `chunk_size` и передаёт их в очередь.
+    Если очередь заполнена (клиент читает медленнее), запись ждёт
+    """
+
+    def __init__(self, chunks: queue.Queue, chunk_size: int, cancelled: threading.Event):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def _put(self, chunk: bytes | None) -> None:
+        while True:
+            if self._cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self._chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self._put(bytes(self._buffer[:self._chunk_size]))
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(None)
+
+
+def get_export_config() -> dict:
+    export_config: dict = utils.prop('export', {}, utils.config)
+    return {
+        "chunk_size": int(export_config.get("chunkKb", 1024)) * 1024,
+        "read_ahead_chunks": int(export_config.get("readAheadChunks", 8)),
+        "batch_size": int(export_config.get("batchSize", 500)),
+    }
+
+
+def _select_activities(session, where: str, params: dict, last_id: int, batch_size: int) -> list[dict]:
+    sql = text(f"""
+        select id,
+            class_id,
+            scrs_timestamp,
+            scrs_path,
+            is_complete,
+            result_conf,
+            result_json,
+            result_json_z,
+            result_json_dict,
+            speed_ms,
+            comment,
+            username
+        from cv_activity
+        where id > :last_id {where}
+        order by id
+        limit :batch_size
+    """)
+    activities = []
+    for row in session.execute(sql, {**params, "last_id": last_id, "batch_size": batch_size}):
+        activity = dict(row._mapping)
+        activity["result_json"] = read_result_json(
+            activity.pop("result_json"), activity.pop("result_json_z"), activity.pop("result_json_dict")
+        )
+        activities.append(activity)
+    return activities
+
+
+def _select_materials(session, act_ids: list[int]) -> dict[int, list[dict]]:
+    params = {f"id{i}": act_id for i, act_id in enumerate(act_ids)}
+    sql = text(f"""
+        select id, act_id, mat_class_id, coords, x1, y1, x2, y2, conf, comment
+        from cv_activity_mat
+        where act_id in ({", ".join(":" + key for key in params)})
+        order by act_id, id
+    """)
+    materials: dict[int, list[dict]] = {}
+    for row in session.execute(sql, params):
+        materials.setdefault(row.act_id, []).append(dict(row._mapping))
+    return materials
+
+
+def iter_batches(date_from: str = None, date_to: str = None, username: str = None, batch_size: int = 500):
+    """
+    Функция последовательно возвращает пачки activity (с материалами), удовлетворяющие фильтру.
+    Каждая пачка читается отдельной короткой транзакцией, чтобы не задерживать запись результатов
+    """
+    where, params = utils.date_range_condition(date_from, date_to)
+    where = where.replace("where ", "and ", 1)
+    if username:
+        where += " and username = :username"
+        params["username"] = username
+    for engine in shards.read_engines(date_from, date_to):
+        last_id = -1
+        while True:
+            with utils.Session(bind=engine) as session:
+                activities = _select_activities(session, where, params, last_id, batch_size)
+                if not activities:
+                    break
+                materials = _select_materials(session, [activity["id"] for activity in activities])
+            last_id = activities[-1]["id"]
+            yield activities, materials
+
+
+class _ArchiveWriter:
+    """
+    Запись элементов архива выбранного формата в поток
+    """
+
+    def __init__(self, fileobj, export_format: str):
+        self._format = export_format
+        if export_format == "tar":
+            self._archive = tarfile.open(fileobj=fileobj, mode="w|")
+        else:
+            # Поток без произвольного доступа: zipfile пишет размеры после данных (data descriptor)
+            self._archive = zipfile.ZipFile(fileobj, mode="w", compression=zipfile.ZIP_STORED)
+
+    def add(self, name: str, source, size: int) -> None:
+        mtime = time.time()
+        if self._format == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(mtime)
+            self._archive.addfile(info, source)
+        else:
+            info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+            info.file_size = size
+            with self._archive.open(info, mode="w", force_zip64=size > 0x7FFFFFFF) as target:
+                while True:
+                    data = source.read(1024 * 1024)
+                    if not data:
+                        break
+                    target.write(data)
+
+    def close(self) -> None:
+        self._archive.close()
+
+
+def write_export(fileobj, export_format: str, date_from: str = None, date_to: str = None,
+                 username: str = None, batch_size: int = 500) -> dict:
+    """
+    Функция записывает архив выгрузки в поток `fileobj`: для каждой пачки activity -
+    файл манифеста manifest/NNNNNN.jsonl (строка = activity, материалы и имя файла изображения)
+    и изображения images/<scrs_path>
+
+    Returns:
+        (dict): статистика выгрузки
+    """
+    storage = image_storage.get_image_storage()
+    archive = _ArchiveWriter(fileobj, export_format)
+    stats = {"activities": 0, "images": 0, "missing_images": 0, "image_bytes": 0}
+    for batch_number, (activities, materials) in enumerate(
+            iter_batches(date_from, date_to, username, batch_size), start=1
+    ):
+        images = []
+        lines = []
+        for activity in activities:
+            image_name = None
+            if activity["scrs_path"]:
+                size = storage.size(activity["scrs_path"])
+                if size is not None:
+                    image_name = f"images/{activity['scrs_path']}"
+                    images.append((image_name, activity["scrs_path"], size))
+                else:
+                    stats["missing_images"] += 1
+            lines.append(serialization.dumps({
+                "activity": activity,
+                "materials": materials.get(activity["id"], []),
+                "image": image_name
+            }))
+        manifest = ("\n".join(lines) + "\n").encode("utf-8")
+        archive.add(f"manifest/{batch_number:06d}.jsonl", io.BytesIO(manifest), len(manifest))
+        for image_name, scrs_path, size in images:
+            with storage.open(scrs_path) as source:
+                archive.add(image_name, source, size)
+            stats["images"] += 1
+            stats["image_bytes"] += size
+        stats["activities"] += len(activities)
+    archive.close()
+    return stats
+
+
+async def stream_export(export_format: str, date_from: str = None, date_to: str = None,
+                        username: str = None) -> AsyncIterator[bytes]:
+    """
+    Асинхронный генератор частей архива выгрузки. Архив формируется в отдельном потоке;
+    в памяти находится не более readAheadChunks частей по chunkKb.
+    При отключении клиента формирование архива прекращается
+    """
+    export_config = get_export_config()
+    chunks: queue.Queue = queue.Queue(maxsize=export_config["read_ahead_chunks"])
+    cancelled = threading.Event()
+    errors: list[Exception] = []
+
+    def produce():
+        writer = _QueueWriter(chunks, export_config["chunk_size"], cancelled)
+        try:
+            stats = write_export(writer, export_format, date_from, date_to, username, export_config["batch_size"])
+            writer.close()
+            logger.info("Export finished: %s", stats)
+        except ExportCancelled:
+            logger.info("Export cancelled by client")
+        except Exception as e:
+            logger.error(f"Export error: {str(e)}")
+            errors.append(e)
+            cancelled.set()
+
+    producer = threading.Thread(target=produce, name="export", daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.to_thread(chunks.get, True, 1)
+            except queue.Empty:
+                if not producer.is_alive() and chunks.empty():
+                    # Формирование архива прервано ошибкой - обрываем ответ, архив неполный
+                    raise RuntimeError(f"Export failed: {errors[0] if errors else 'unknown error'}")
+                continue
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        cancelled.set()
@@ -0,0 +1,74 @@
+# Ключи идемпотентности результатов: клиент передаёт "idempotencyKey" вместе с результатом,
+# повторная отправка (например, после обрыва соединения до получения ответа) возвращает
+# исходный ответ без записи в БД и хранилище изображений.
+# Уникальность обеспечивает индекс cv_activity (idempotency_key), недавние ключи кэшируются в памяти.
+import datetime
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+import src.app.image_storage as image_storage
+import src.app.shards as shards
+import src.app.utils as utils
+
+_recent: OrderedDict[str, dict] = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_key(json_result: dict) -> str | None:
+    key = json_result.get("idempotencyKey") if isinstance(json_result, dict) else None
+    return str(key) if key else None
+
+
+def remember(key: str, result: dict) -> None:
+    """
+    Запоминает ответ на результат с ключом `key`
+    """
+    cache_size = int(utils.prop('ingest.idempotency.cacheSize', 10000, utils.config))
+    with _lock:
+        _recent[key] = result
+        _recent.move_to_end(key)
+        while len(_recent) > cache_size:
+            _recent.popitem(last=False)
+
+
+def _stored_result(scrs_path: str) -> dict:
+    # Ответ save_result для уже сохранённого результата
+    location = image_storage.get_image_storage().location(scrs_path)
+    return {"ok": True, "file_name": utils.result_ok({"filename": location})}
+
+
+def find(key: str | None) -> dict | None:
+    """
+    Функция ищет ответ на ранее сохранённый результат с ключом `key`: сначала в кэше,
+    затем в основной БД и в шардах текущего и предыдущего месяца (уникальный индекс действует
+    в пределах одного файла БД, а повтор результата, сохранённого перед сменой месяца,
+    записывался бы уже в новый шард)
+
+    Returns:
+        (dict | None): исходный ответ или None, если результат с таким ключом не сохранялся
+    """
+    if key is None:
+        return None
+    with _lock:
+        result = _recent.get(key)
+    if result is not None:
+        return result
+    engines = [utils.engine]
+    if shards.partitioning_enabled():
+        now = datetime.datetime.now()
+        previous_month = now.replace(day=1) - datetime.timedelta(days=1)
+        engines.append(shards.get_shard_engine(shards.shard_key(now), read_only=False))
+        engines.append(shards.get_shard_engine(shards.shard_key(previous_month)))
+    sql = text("select scrs_path from cv_activity where idempotency_key = :key")
+    for engine in engines:
+        if engine is None:
+            continue
+        with utils.Session(bind=engine) as session:
+            scrs_path = session.execute(sql, {"key": key}).scalar()
+        if scrs_path is not None:
+            result = _stored_result(scrs_path)
+            remember(key, result)
+            return result
+    return None
@@ -0,0 +1,212 @@
+# Хранилище изображений (скриншотов): локальный каталог или S3-совместимое объектное хранилище.
+# Реализация выбирается параметром images.storage конфига.
+import io
+import os
+import shutil
+import threading
+from typing import BinaryIO
+
+import src.app.utils as utils
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover
+    boto3 = None
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+class ImageStorage:
+    """
+    Базовый класс хранилища изображений. Изображения адресуются кратким именем файла (scrs_path)
+    """
+
+    def save(self, name: str, data: bytes | BinaryIO) -> str:
+        """
+        Сохраняет изображение и возвращает его расположение (путь или URI)
+        """
+        raise NotImplementedError
+
+    def location(self, name: str) -> str:
+        """
+        Возвращает расположение изображения (путь или URI), как его возвращает save
+        """
+        raise NotImplementedError
+
+    def open(self, name: str) -> BinaryIO:
+        """
+        Открывает изображение на чтение
+        """
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, name: str) -> int | None:
+        """
+        Возвращает размер изображения в байтах или None, если изображения нет
+        """
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def move_to(self, name: str, target_path: str) -> None:
+        """
+        Переносит изображение в локальный файл `target_path` (архив) и удаляет его из хранилища
+        """
+        with self.open(name) as source, open(target_path, "wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        self.delete(name)
+
+
+class LocalImageStorage(ImageStorage):
+    """
+    Изображения в локальном каталоге (images.runsFolder)
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def location(self, name: str) -> str:
+        return self.path(name)
+
+    def save(self, name: str, data: bytes | BinaryIO) -> str:
+        file_path = self.path(name)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            result = utils.create_file(data, file_path)
+            if not result.get("ok"):
+                raise OSError(result.get("error"))
+        else:
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(data, f, 1024 * 1024)
+        return file_path
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self.path(name), "rb")
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def size(self, name: str) -> int | None:
+        try:
+            return os.path.getsize(self.path(name))
+        except OSError:
+            return None
+
+    def delete(self, name: str) -> None:
+        utils.delete_file(self.path(name))
+
+    def move_to(self, name: str, target_path: str) -> None:
+        shutil.move(self.path(name), target_path)
+
+
+class S3ImageStorage(ImageStorage):
+    """
+    Изображения в S3-совместимом хранилище (AWS S3, MinIO и т.п.).
+    Крупные изображения загружаются потоково частями (multipart upload),
+    число одновременных соединений ограничено пулом клиента.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region: str = None,
+                 access_key: str = None, secret_key: str = None, max_pool_connections: int = 10,
+                 multipart_threshold_mb: int = 8, multipart_chunk_mb: int = 8):
+        if boto3 is None:
+            raise ImportError("boto3 is required for the s3 image storage")
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None,
+            config=BotoConfig(max_pool_connections=max_pool_connections, retries={"max_attempts": 3}),
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=multipart_chunk_mb * 1024 * 1024,
+            max_concurrency=max_pool_connections,
+        )
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def save(self, name: str, data: bytes | BinaryIO) -> str:
+        fileobj = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        self._client.upload_fileobj(fileobj, self.bucket, self.key(name), Config=self._transfer_config)
+        return self.location(name)
+
+    def location(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def open(self, name: str) -> BinaryIO:
+        return self._client.get_object(Bucket=self.bucket, Key=self.key(name))["Body"]
+
+    def exists(self, name: str) -> bool:
+        return self.size(name) is not None
+
+    def size(self, name: str) -> int | None:
+        try:
+            return self._client.head_object(Bucket=self.bucket, Key=self.key(name))["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def delete(self, name: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+
+def create_image_storage() -> ImageStorage:
+    """
+    Функция создаёт хранилище изображений по конфигу (images.storage: local | s3)
+    """
+    storage_type = utils.prop('images.storage', 'local', utils.config)
+    if storage_type == 'local':
+        return LocalImageStorage(utils.g_runs)
+    if storage_type == 's3':
+        s3_config: dict = utils.prop('images.s3', {}, utils.config)
+        return S3ImageStorage(
+            bucket=s3_config.get("bucket"),
+            prefix=s3_config.get("prefix", ""),
+            endpoint_url=s3_config.get("endpointUrl"),
+            region=s3_config.get("region"),
+            access_key=s3_config.get("accessKey"),
+            secret_key=s3_config.get("secretKey"),
+            max_pool_connections=int(s3_config.get("maxPoolConnections", 10)),
+            multipart_threshold_mb=int(s3_config.get("multipartThresholdMb", 8)),
+            multipart_chunk_mb=int(s3_config.get("multipartChunkMb", 8)),
+        )
+    raise ValueError(f"Unknown image storage: {storage_type}")
+
+
+def get_image_storage() -> ImageStorage:
+    """
+    Функция возвращает хранилище изображений приложения (создаётся при первом обращении)
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_image_storage()
+    return _storage
+
+
+def set_image_storage(storage: ImageStorage) -> None:
+    """
+    Устанавливает хранилище изображений приложения (например, для тестов)
+    """
+    global _storage
+    _storage = storage
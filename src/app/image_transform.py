@@ -0,0 +1,147 @@
+# Перекодирование изображений при приёме (images.transform): целевой формат и качество
+# (например, WebP или JPEG с ограничением качества) и необязательное уменьшение до максимального разрешения.
+# Перекодирование выполняется в пуле процессов, чтобы не занимать цикл событий и GIL.
+# Процессы пула запускаются методом spawn: fork процесса с работающими потоками (пулы БД, фоновые задачи)
+# может унаследовать захваченные блокировки.
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import src.app.utils as utils
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+# Расширение файла для формата Pillow
+format_extensions = {"WEBP": ".webp", "JPEG": ".jpg", "PNG": ".png"}
+
+_pool: ProcessPoolExecutor | None = None
+# Настройки, проверенные при старте приложения (start_transform_pool)
+_transform_config: dict | None = None
+_config_loaded: bool = False
+
+
+def load_transform_config() -> dict | None:
+    """
+    Функция читает и проверяет настройки перекодирования из конфига
+
+    Returns:
+        (dict | None): настройки или None, если перекодирование выключено
+
+    Raises:
+        ValueError: неподдерживаемый формат или некорректные числовые параметры
+    """
+    transform_config: dict = utils.prop('images.transform', {}, utils.config)
+    if not transform_config.get("enabled"):
+        return None
+    image_format = str(transform_config.get("format", "webp")).upper()
+    if image_format not in format_extensions:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return {
+        "format": image_format,
+        "quality": int(transform_config.get("quality", 80)),
+        "max_width": int(transform_config.get("maxWidth", 0)),
+        "max_height": int(transform_config.get("maxHeight", 0)),
+        "workers": int(transform_config.get("workers", 2)),
+    }
+
+
+def get_transform_config() -> dict | None:
+    """
+    Функция возвращает настройки перекодирования (читаются один раз) или None, если оно выключено
+    """
+    global _transform_config, _config_loaded
+    if not _config_loaded:
+        _transform_config = load_transform_config()
+        _config_loaded = True
+    return _transform_config
+
+
+def reencode(data: bytes, image_format: str, quality: int, max_width: int = 0, max_height: int = 0) -> bytes | None:
+    """
+    Функция перекодирует изображение (выполняется в процессе пула)
+
+    Args:
+        data (bytes): исходное изображение
+        image_format (str): формат Pillow (WEBP, JPEG, PNG)
+        quality (int): качество сжатия
+        max_width (int, optional): максимальная ширина (0 - без ограничения)
+        max_height (int, optional): максимальная высота (0 - без ограничения)
+
+    Returns:
+        (bytes | None): перекодированное изображение или None, если оно не меньше исходного
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if max_width > 0 or max_height > 0:
+            # thumbnail сохраняет пропорции и только уменьшает изображение
+            image.thumbnail((max_width or image.width, max_height or image.height), Image.LANCZOS)
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=image_format == "JPEG")
+    result = output.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def transform_image(data: bytes) -> tuple[bytes, dict]:
+    """
+    Функция перекодирует изображение по настройкам images.transform
+
+    Returns:
+        (tuple[bytes, dict]): изображение для сохранения и сведения о нём:
+            original_size, size и ext (новое расширение файла или None, если изображение не менялось)
+    """
+    image_info = {"original_size": len(data), "size": len(data), "ext": None}
+    transform_config = get_transform_config()
+    if transform_config is None or Image is None or len(data) == 0:
+        return data, image_info
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            _get_pool(transform_config["workers"]),
+            reencode,
+            data,
+            transform_config["format"],
+            transform_config["quality"],
+            transform_config["max_width"],
+            transform_config["max_height"],
+        )
+    except Exception as e:
+        # Не удалось разобрать изображение - сохраняем как есть
+        logger.warning(f"Image transform error: {str(e)}")
+        return data, image_info
+    if result is None:
+        return data, image_info
+    image_info["size"] = len(result)
+    image_info["ext"] = format_extensions[transform_config["format"]]
+    return result, image_info
+
+
+async def start_transform_pool() -> None:
+    """
+    Проверяет настройки перекодирования при старте приложения: ошибка в конфиге останавливает запуск,
+    а не проявляется при каждом приёме изображения
+    """
+    transform_config = get_transform_config()
+    if transform_config is not None and Image is None:
+        logger.warning("images.transform is enabled, but Pillow is not installed: images are stored as is")
+
+
+async def stop_transform_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
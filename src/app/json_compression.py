@@ -0,0 +1,207 @@
+# Сжатое хранение cv_activity.result_json: zlib с предустановленным словарём,
+# обученным на образцах сохранённых результатов. Словари хранятся в таблице cv_json_dict
+# основной БД; в шарды копируются (shards.copy_json_dictionaries).
+import asyncio
+import datetime
+import json
+import time
+import zlib
+
+from sqlalchemy import text
+
+import src.app.shards as shards
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+# Максимальный размер словаря, который использует zlib (размер окна)
+_max_dict_size: int = 32768
+# Загруженные словари: id -> данные
+_dictionaries: dict[int, bytes] = {}
+# Словарь, которым сжимаются новые записи
+_current_dict_id: int | None = None
+
+_migration_task: asyncio.Task | None = None
+
+
+def train_dictionary(samples: list[str]) -> bytes:
+    """
+    Функция строит словарь zlib по образцам JSON: последние `_max_dict_size` байт
+    объединения уникальных образцов (анализа частоты фрагментов нет).
+    Чем ближе к концу словаря подстрока, тем дешевле ссылка на неё, поэтому образцы
+    передаются от старых к новым - в конце оказываются самые свежие.
+
+    Args:
+        samples (list[str]): образцы result_json
+
+    Returns:
+        (bytes): словарь
+    """
+    unique_samples = list(dict.fromkeys(s for s in samples if s))
+    data = "".join(unique_samples).encode("utf-8")
+    return data[-_max_dict_size:]
+
+
+def _load_dictionaries(session) -> None:
+    global _current_dict_id
+    for dict_id, data in session.execute(text("select id, data from cv_json_dict order by id")):
+        _dictionaries[dict_id] = data
+        _current_dict_id = dict_id
+
+
+def ensure_dictionary(session, sample_size: int = 200) -> None:
+    """
+    Функция загружает словари из БД, а при их отсутствии обучает словарь на последних result_json
+    """
+    _load_dictionaries(session)
+    if _current_dict_id is not None:
+        return
+    sql = text("""
+        select result_json
+        from cv_activity
+        where result_json is not null
+        order by id desc
+        limit :sample_size
+    """)
+    samples = [row[0] for row in session.execute(sql, {"sample_size": sample_size})]
+    if not samples:
+        # Пустая БД: обучаем на типовой структуре результата
+        samples = [json.dumps({
+            "image_file": {"timestamp": "", "name": ""}, "isComplete": False, "confidence": 0.0,
+            "speedMs": 0, "materials": "[{\"mlCode\":0,\"coords\":\"[]\",\"conf\":0.0}]", "username": ""
+        })]
+    # Самые свежие образцы - в конце словаря
+    data = train_dictionary(samples[::-1])
+    session.execute(
+        text("insert into cv_json_dict (id, data, created) values (1, :data, :created)"),
+        {"data": data, "created": datetime.datetime.now().isoformat()}
+    )
+    session.commit()
+    _load_dictionaries(session)
+    logger.info("result_json dictionary trained on %d samples, %d bytes", len(samples), len(data))
+
+
+def compress_json(value: str) -> tuple[bytes, int | None]:
+    """
+    Функция сжимает JSON текущим словарём
+
+    Args:
+        value (str): JSON
+
+    Returns:
+        (tuple[bytes, int | None]): сжатые данные и id словаря
+    """
+    dict_id = _current_dict_id
+    if dict_id is None:
+        return zlib.compress(value.encode("utf-8"), 9), None
+    compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY,
+                                  _dictionaries[dict_id])
+    return compressor.compress(value.encode("utf-8")) + compressor.flush(), dict_id
+
+
+def decompress_json(data: bytes, dict_id: int | None) -> str:
+    """
+    Функция восстанавливает JSON, сжатый `compress_json`
+
+    Args:
+        data (bytes): сжатые данные
+        dict_id (int | None): id словаря
+
+    Returns:
+        (str): JSON
+    """
+    if dict_id is None:
+        return zlib.decompress(data).decode("utf-8")
+    if dict_id not in _dictionaries:
+        with utils.Session() as session:
+            _load_dictionaries(session)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, _dictionaries[dict_id])
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+def read_result_json(result_json: str | None, result_json_z: bytes | None, result_json_dict: int | None) -> str | None:
+    """
+    Функция возвращает result_json activity независимо от формата хранения
+    """
+    if result_json_z is not None:
+        return decompress_json(result_json_z, result_json_dict)
+    return result_json
+
+
+def migrate_result_json(batch_size: int = 500, batch_pause_ms: float = 50, engine=None) -> int:
+    """
+    Функция пачками переводит несжатые result_json в сжатый формат.
+    Каждая пачка - отдельная короткая транзакция, между пачками - пауза.
+    `engine` - БД для преобразования (по умолчанию основная)
+
+    Returns:
+        (int): количество преобразованных записей
+    """
+    select_sql = text("""
+        select id, result_json
+        from cv_activity
+        where id > :last_id and result_json is not null and result_json_z is null
+        order by id
+        limit :batch_size
+    """)
+    update_sql = text("""
+        update cv_activity
+        set result_json_z = :result_json_z, result_json_dict = :result_json_dict, result_json = null
+        where id = :id
+    """)
+    last_id = -1
+    migrated = 0
+    start = time.monotonic()
+    with (utils.Session() if engine is None else utils.Session(bind=engine)) as session:
+        while True:
+            rows = list(session.execute(select_sql, {"last_id": last_id, "batch_size": batch_size}))
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            params = []
+            for act_id, result_json in rows:
+                result_json_z, result_json_dict = compress_json(result_json)
+                params.append({"id": act_id, "result_json_z": result_json_z, "result_json_dict": result_json_dict})
+            session.execute(update_sql, params)
+            session.commit()
+            migrated += len(params)
+            logger.info("result_json compression: %d rows converted (%.1f rows/s)",
+                        migrated, migrated / max(time.monotonic() - start, 1e-9))
+            time.sleep(batch_pause_ms / 1000)
+    return migrated
+
+
+def migrate_all_result_json() -> int:
+    """
+    Функция сжимает ранее сохранённые result_json основной БД и всех шардов.
+    Шарды прошлых месяцев открываются на запись только на время преобразования
+
+    Returns:
+        (int): количество преобразованных записей
+    """
+    migrated = migrate_result_json()
+    current_key = shards.shard_key(datetime.datetime.now())
+    for key in shards.list_shard_keys():
+        migrated += migrate_result_json(engine=shards.get_shard_engine(key, read_only=False))
+        if key != current_key:
+            shards.release_shard(key)
+    return migrated
+
+
+async def _migration_job() -> None:
+    try:
+        await asyncio.to_thread(migrate_all_result_json)
+    except Exception as e:
+        logger.error(f"result_json compression error: {str(e)}")
+
+
+async def start_result_json_migration() -> None:
+    """
+    Запускает фоновое сжатие ранее сохранённых result_json, если сжатие включено в конфиге
+    """
+    global _migration_task
+    if not utils.prop('db.compressResultJson', False, utils.config) or _migration_task is not None:
+        return
+    _migration_task = asyncio.create_task(_migration_job())
@@ -0,0 +1,322 @@
+# Перцентили времени распознавания клиента (speed_ms) и времени приёма результата сервером (ingest_ms)
+# по дням и пользователям. Для каждой пары день/пользователь хранится квантильный скетч (cv_stat_sketch).
+# Скетчи пополняются в памяти при сохранении результатов и периодически объединяются с сохранёнными;
+# перцентили за любой период получаются объединением скетчей, без сортировки исходных записей.
+import asyncio
+import datetime
+import threading
+
+from sqlalchemy import text
+
+import src.app.shards as shards
+import src.app.utils as utils
+from src.app.quantile_sketch import DDSketch
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+metrics = ("speed_ms", "ingest_ms")
+quantiles = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+_pending: dict[tuple[str, str, str], DDSketch] = {}
+_lock = threading.Lock()
+# Сохранение скетчей (чтение и перезапись строк cv_stat_sketch) выполняется последовательно
+_merge_lock = threading.Lock()
+_flush_task: asyncio.Task | None = None
+_backfill_task: asyncio.Task | None = None
+_backfill_stop = threading.Event()
+
+
+def _new_sketch() -> DDSketch:
+    return DDSketch(float(utils.prop('stats.sketchAccuracy', 0.01, utils.config)))
+
+
+def _add(sketches: dict, day: str, username: str | None, metric: str, value: float | None) -> None:
+    if value is None:
+        return
+    key = (day, username or "", metric)
+    sketch = sketches.get(key)
+    if sketch is None:
+        sketch = sketches[key] = _new_sketch()
+    sketch.add(value)
+
+
+def record(scrs_timestamp: str, username: str | None, speed_ms: float | None, ingest_ms: float | None) -> None:
+    """
+    Функция учитывает сохранённый результат в скетчах его дня и пользователя
+    """
+    day = scrs_timestamp[:10]
+    with _lock:
+        _add(_pending, day, username, "speed_ms", speed_ms)
+        _add(_pending, day, username, "ingest_ms", ingest_ms)
+
+
+def _merge_stored(session, sketches: dict[tuple[str, str, str], DDSketch]) -> None:
+    # Объединение скетчей с сохранёнными в БД (без фиксации транзакции)
+    select_sql = text("select sketch from cv_stat_sketch where d = :d and username = :username and metric = :metric")
+    upsert_sql = text("""
+        insert into cv_stat_sketch (d, username, metric, sketch)
+        values (:d, :username, :metric, :sketch)
+        on conflict (d, username, metric) do update set sketch = excluded.sketch
+    """)
+    for (day, username, metric), sketch in sketches.items():
+        params = {"d": day, "username": username, "metric": metric}
+        stored = session.execute(select_sql, params).scalar()
+        if stored is not None:
+            sketch.merge(DDSketch.from_bytes(stored))
+        session.execute(upsert_sql, {**params, "sketch": sketch.to_bytes()})
+
+
+def flush() -> int:
+    """
+    Функция объединяет накопленные в памяти скетчи с сохранёнными в БД (одной транзакцией)
+
+    Returns:
+        (int): количество обновлённых скетчей
+    """
+    global _pending
+    # Чтение перцентилей ждёт фиксации (_merge_lock): скетчи, уже изъятые из памяти,
+    # но ещё не сохранённые, не должны выпадать из результата
+    with _merge_lock:
+        with _lock:
+            pending, _pending = _pending, {}
+        if not pending:
+            return 0
+        try:
+            with utils.Session() as session:
+                _merge_stored(session, pending)
+                session.commit()
+        except Exception:
+            # Не удалось сохранить - возвращаем скетчи в память до следующей попытки
+            with _lock:
+                for key, sketch in pending.items():
+                    if key in _pending:
+                        sketch.merge(_pending[key])
+                    _pending[key] = sketch
+            raise
+    return len(pending)
+
+
+def _group_key(day: str, username: str, group_by: str) -> tuple:
+    if group_by == "day":
+        return (day, None)
+    if group_by == "user":
+        return (None, username)
+    if group_by == "total":
+        return (None, None)
+    return (day, username)
+
+
+def get_percentiles(date_from: str = None, date_to: str = None, username: str = None,
+                    group_by: str = "day_user") -> list[dict]:
+    """
+    Функция возвращает перцентили speed_ms и ingest_ms за период (с точностью до дня)
+
+    Args:
+        date_from (str, optional): начало периода (ISO, включительно)
+        date_to (str, optional): конец периода (ISO, не включительно)
+        username (str, optional): пользователь
+        group_by (str, optional): группировка: day_user, day, user или total
+
+    Returns:
+        (list[dict]): строки d, username и для каждой метрики count, p50, p90, p99, max
+    """
+    if group_by not in ("day_user", "day", "user", "total"):
+        raise ValueError(f"Unknown group_by: {group_by}")
+    conditions = []
+    params = {}
+    if date_from:
+        conditions.append("d >= :date_from")
+        params["date_from"] = date_from[:10]
+    if date_to:
+        conditions.append("d < :date_to")
+        params["date_to"] = date_to[:10]
+    if username is not None:
+        conditions.append("username = :username")
+        params["username"] = username
+    where = ("where " + " and ".join(conditions)) if conditions else ""
+
+    # Сохранённые и накопленные в памяти скетчи читаются согласованно с сохранением (см. flush)
+    with _merge_lock:
+        with utils.Session() as session:
+            stored = [
+                (day, user, metric, DDSketch.from_bytes(sketch))
+                for day, user, metric, sketch in session.execute(
+                    text(f"select d, username, metric, sketch from cv_stat_sketch {where}"), params
+                )
+            ]
+        with _lock:
+            pending = [
+                (day, user, metric, sketch) for (day, user, metric), sketch in _pending.items()
+                if (not date_from or day >= params["date_from"])
+                and (not date_to or day < params["date_to"])
+                and (username is None or user == username)
+            ]
+
+    groups: dict[tuple, dict[str, DDSketch]] = {}
+    for day, user, metric, sketch in stored + pending:
+        group = groups.setdefault(_group_key(day, user, group_by), {})
+        if metric in group:
+            group[metric].merge(sketch)
+        else:
+            merged = _new_sketch()
+            merged.merge(sketch)
+            group[metric] = merged
+
+    result = list()
+    for (day, user) in sorted(groups, key=lambda k: tuple((v is not None, v) for v in k)):
+        obj = {"d": day, "username": user}
+        for metric in metrics:
+            sketch = groups[(day, user)].get(metric)
+            if sketch is None or sketch.count == 0:
+                obj[metric] = None
+                continue
+            obj[metric] = {"count": sketch.count, "max": sketch.max}
+            for name, q in quantiles.items():
+                obj[metric][name] = sketch.quantile(q)
+        result.append(obj)
+    return result
+
+
+def _backfill_state() -> tuple[str, str]:
+    """
+    Функция возвращает позицию построения скетчей по имеющимся activity и его границу.
+    Граница фиксируется при первом запуске: более поздние результаты учитываются при сохранении
+    """
+    with utils.Session() as session:
+        row = session.execute(
+            text("select position, until from cv_stat_backfill where metric = 'speed_ms'")
+        ).first()
+        if row is not None:
+            return row.position, row.until
+        until = datetime.datetime.now().isoformat()
+        # Скетчи без записи о позиции построены прежней версией, строившей их целиком за один запуск
+        built = session.execute(text("select 1 from cv_stat_sketch limit 1")).first() is not None
+        position = until if built else ""
+        session.execute(
+            text("insert into cv_stat_backfill (metric, position, until) values ('speed_ms', :position, :until)"),
+            {"position": position, "until": until}
+        )
+        session.commit()
+    return position, until
+
+
+def _next_day(position: str, until: str) -> str | None:
+    # Ближайший день с activity начиная с позиции
+    days = []
+    for engine in shards.read_engines(position or None, until):
+        with utils.Session(bind=engine) as session:
+            first = session.execute(
+                text("select min(scrs_timestamp) from cv_activity where scrs_timestamp >= :position and scrs_timestamp < :until"),
+                {"position": position, "until": until}
+            ).scalar()
+        if first is not None:
+            days.append(str(first)[:10])
+    return min(days) if days else None
+
+
+def _backfill_day(day_start: str, day_end: str) -> dict | None:
+    # Скетчи speed_ms за день или None, если построение остановлено
+    sketches = {}
+    for engine in shards.read_engines(day_start, day_end):
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "select scrs_timestamp, username, speed_ms from cv_activity "
+                "where scrs_timestamp >= ? and scrs_timestamp < ?",
+                (day_start, day_end)
+            )
+            while True:
+                if _backfill_stop.is_set():
+                    return None
+                rows = cursor.fetchmany(10_000)
+                if not rows:
+                    break
+                for scrs_timestamp, username, speed_ms in rows:
+                    _add(sketches, str(scrs_timestamp)[:10], username, "speed_ms", speed_ms)
+            cursor.close()
+        finally:
+            connection.close()
+    return sketches
+
+
+def backfill() -> int:
+    """
+    Функция строит скетчи speed_ms по уже сохранённым activity (время приёма для старых записей неизвестно).
+    Activity обрабатываются по дням: скетчи дня сохраняются вместе с позицией одной транзакцией,
+    поэтому прерванное построение продолжается со следующего дня без повторного учёта
+
+    Returns:
+        (int): количество учтённых activity
+    """
+    position, until = _backfill_state()
+    processed = 0
+    while position < until and not _backfill_stop.is_set():
+        day = _next_day(position, until)
+        if day is None:
+            day_end = until
+            sketches = {}
+        else:
+            day_end = min((datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat(), until)
+            sketches = _backfill_day(max(position, day), day_end)
+            if sketches is None:
+                break
+        with _merge_lock, utils.Session() as session:
+            _merge_stored(session, sketches)
+            session.execute(
+                text("update cv_stat_backfill set position = :position where metric = 'speed_ms'"),
+                {"position": day_end}
+            )
+            session.commit()
+        processed += sum(sketch.count for sketch in sketches.values())
+        position = day_end
+    if processed:
+        logger.info("Latency sketches built for %d activities", processed)
+    return processed
+
+
+async def _run_backfill() -> None:
+    try:
+        await asyncio.to_thread(backfill)
+    except Exception as e:
+        logger.error(f"Latency sketches backfill error: {str(e)}")
+
+
+async def _flush_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            logger.error(f"Latency sketches flush error: {str(e)}")
+
+
+async def start_latency_stats() -> None:
+    """
+    Запускает в фоне построение скетчей по имеющимся данным и периодическое сохранение скетчей
+    """
+    global _flush_task, _backfill_task
+    if _flush_task is not None:
+        return
+    _backfill_stop.clear()
+    _backfill_task = asyncio.create_task(_run_backfill())
+    interval = float(utils.prop('stats.sketchFlushSeconds', 10, utils.config))
+    _flush_task = asyncio.create_task(_flush_loop(interval))
+
+
+async def stop_latency_stats() -> None:
+    global _flush_task, _backfill_task
+    if _backfill_task is not None:
+        # Построение останавливается на границе пачки; обработанные дни уже сохранены
+        _backfill_stop.set()
+        await _backfill_task
+        _backfill_task = None
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    try:
+        await asyncio.to_thread(flush)
+    except Exception as e:
+        logger.error(f"Latency sketches flush error: {str(e)}")
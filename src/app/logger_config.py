@@ -1,6 +1,5 @@
 import gzip
 import shutil
-import json
 import logging
 import os
 from datetime import datetime
@@ -8,6 +7,7 @@ from logging import LogRecord
 from logging.handlers import TimedRotatingFileHandler
 from typing import BinaryIO, Iterable
 
+import src.app.serialization as serialization
 from src.app.containers import prop
 from src.app.utils import thread_local
 
@@ -110,7 +110,7 @@ class LogFileFormatter(logging.Formatter):
                 }
             })
 
-        return json.dumps(log_record, ensure_ascii=False)
+        return serialization.dumps(log_record)
 
 
 def get_log_filename() -> str:
@@ -0,0 +1,155 @@
+# Контроль задержки цикла событий (event loop lag). Перегрузка (работа с БД и файлами в цикле событий)
+# сначала проявляется в росте задержки, а уже потом - в массовых обрывах websocket по таймауту ping.
+# Фоновая задача периодически засыпает на заданный интервал и измеряет, насколько позже она проснулась.
+# При превышении порогов низкоприоритетные чтения, а затем и все новые подключения (в т.ч. приём результатов)
+# отклоняются с повторяемой ошибкой. Уже открытые websocket-сессии станций продолжают работать:
+# ограничение действует только при подключении.
+import asyncio
+import time
+
+import src.app.serialization as serialization
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+# Состояния: ok - норма, degraded - отклоняются низкоприоритетные чтения,
+# overloaded - все новые запросы и подключения
+STATE_OK = "ok"
+STATE_DEGRADED = "degraded"
+STATE_OVERLOADED = "overloaded"
+
+_lag_ms: float = 0.0
+_max_lag_ms: float = 0.0
+_rejected = {"reads": 0, "connections": 0}
+_monitor_task: asyncio.Task | None = None
+_config: dict | None = None
+
+
+def get_config() -> dict:
+    global _config
+    if _config is not None:
+        return _config
+    lag_config: dict = utils.prop('health.loopLag', {}, utils.config)
+    _config = {
+        "interval": float(lag_config.get("intervalMs", 100)) / 1000,
+        "reads_threshold_ms": float(lag_config.get("readsThresholdMs", 200)),
+        "connections_threshold_ms": float(lag_config.get("connectionsThresholdMs", 500)),
+        "retry_after": int(lag_config.get("retryAfterSeconds", 5)),
+        "low_priority_routes": set(lag_config.get("lowPriorityRoutes", [])),
+        # Маршруты, не ограничиваемые никогда (по умолчанию таких нет)
+        "exempt_routes": set(lag_config.get("exemptRoutes", [])),
+    }
+    return _config
+
+
+def get_lag_ms() -> float:
+    """
+    Текущая задержка цикла событий: последний замер с затухающим пиком
+    """
+    return _lag_ms
+
+
+def get_state(lag_config: dict = None) -> str:
+    if lag_config is None:
+        lag_config = get_config()
+    if _lag_ms >= lag_config["connections_threshold_ms"]:
+        return STATE_OVERLOADED
+    if _lag_ms >= lag_config["reads_threshold_ms"]:
+        return STATE_DEGRADED
+    return STATE_OK
+
+
+def get_status() -> dict:
+    lag_config = get_config()
+    return {
+        "state": get_state(lag_config),
+        "loop_lag_ms": round(_lag_ms, 1),
+        "max_loop_lag_ms": round(_max_lag_ms, 1),
+        "rejected": dict(_rejected),
+    }
+
+
+async def _monitor_loop(interval: float) -> None:
+    global _lag_ms, _max_lag_ms
+    previous_state = STATE_OK
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, (time.perf_counter() - expected) * 1000)
+        # Пик задержки затухает постепенно, чтобы единичный удачный замер не снимал ограничение
+        _lag_ms = max(lag, _lag_ms * 0.8)
+        _max_lag_ms = max(_max_lag_ms, lag)
+        state = get_state()
+        if state != previous_state:
+            logger.warning("Event loop lag %.1f ms: state %s -> %s", _lag_ms, previous_state, state)
+            previous_state = state
+
+
+async def start_loop_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is not None:
+        return
+    _monitor_task = asyncio.create_task(_monitor_loop(get_config()["interval"]))
+
+
+async def stop_loop_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        _monitor_task = None
+
+
+class LoopLagMiddleware:
+    """
+    ASGI middleware, отклоняющее запросы при перегрузке цикла событий:
+    в состоянии degraded - низкоприоритетные чтения (health.loopLag.lowPriorityRoutes),
+    в состоянии overloaded - все новые запросы и websocket-подключения.
+    /health и маршруты health.loopLag.exemptRoutes не ограничиваются; открытые сессии не затрагиваются
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or scope["path"] == "/health":
+            await self.app(scope, receive, send)
+            return
+        lag_config = get_config()
+        if scope["path"] in lag_config["exempt_routes"]:
+            await self.app(scope, receive, send)
+            return
+        state = get_state(lag_config)
+        if state == STATE_OK:
+            await self.app(scope, receive, send)
+            return
+        if state == STATE_DEGRADED and scope["path"] not in lag_config["low_priority_routes"]:
+            await self.app(scope, receive, send)
+            return
+
+        _rejected["reads" if scope["path"] in lag_config["low_priority_routes"] else "connections"] += 1
+        if scope["type"] == "websocket":
+            # Закрытие до принятия сервер превращает в HTTP 403, поэтому соединение сначала принимается,
+            # а затем закрывается с кодом 1013 (Try Again Later)
+            message = await receive()
+            if message["type"] != "websocket.connect":
+                return
+            await send({"type": "websocket.accept"})
+            await send({"type": "websocket.close", "code": 1013, "reason": "Server is overloaded, retry later"})
+            return
+        body = serialization.dumps_bytes(utils.result_error(
+            data={"retry_after": lag_config["retry_after"]},
+            error="Server is overloaded, retry later",
+            error_code=-503
+        ))
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(lag_config["retry_after"]).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
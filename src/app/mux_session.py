@@ -0,0 +1,99 @@
+# Сборка изображений мультиплексированной сессии /ws/save_result_mux:
+# в одном websocket-соединении одновременно передаётся несколько изображений (потоков).
+# Бинарный кадр = 4 байта id потока (big-endian) + часть изображения; кадр без данных - конец потока.
+import struct
+from io import BytesIO
+
+import src.app.utils as utils
+
+# Заголовок бинарного кадра
+frame_header = struct.Struct(">I")
+
+
+class MuxLimitError(Exception):
+    """
+    Превышено ограничение сессии (число потоков или объём буферизованных данных)
+    """
+
+
+class MuxSession:
+    """
+    Буферы потоков одной сессии с общим ограничением памяти
+    """
+
+    def __init__(self, max_streams: int = None, max_session_bytes: int = None):
+        if max_streams is None:
+            max_streams = int(utils.prop('ingest.mux.maxStreams', 64, utils.config))
+        if max_session_bytes is None:
+            max_session_bytes = int(utils.prop('ingest.mux.maxSessionMb', 256, utils.config)) * 1024 * 1024
+        self.max_streams = max_streams
+        self.max_session_bytes = max_session_bytes
+        self.buffered_bytes = 0
+        self._streams: dict[int, tuple[dict, BytesIO]] = {}
+        # Отклонённые потоки: клиент ещё досылает их кадры, они пропускаются до кадра конца потока
+        self._rejected: set[int] = set()
+
+    def open(self, stream_id: int, json_result: dict) -> None:
+        """
+        Регистрирует поток с результатом `json_result`
+        """
+        if stream_id in self._streams:
+            self.discard(stream_id)
+        self._rejected.discard(stream_id)
+        if len(self._streams) >= self.max_streams:
+            raise MuxLimitError(f"Too many open streams (max {self.max_streams})")
+        self._streams[stream_id] = (json_result, BytesIO())
+
+    def feed(self, frame: bytes) -> int | None:
+        """
+        Принимает бинарный кадр. Кадры отклонённого потока пропускаются без ошибки
+
+        Returns:
+            (int | None): id потока, если кадр завершил поток, иначе None
+        """
+        if len(frame) < frame_header.size:
+            raise ValueError("Frame is too short")
+        (stream_id,) = frame_header.unpack_from(frame)
+        payload = memoryview(frame)[frame_header.size:]
+        if stream_id in self._rejected:
+            if len(payload) == 0:
+                self._rejected.discard(stream_id)
+            return None
+        if stream_id not in self._streams:
+            raise KeyError(stream_id)
+        if len(payload) == 0:
+            return stream_id
+        if self.buffered_bytes + len(payload) > self.max_session_bytes:
+            self.reject(stream_id)
+            raise MuxLimitError(f"Session memory limit exceeded (max {self.max_session_bytes} bytes)")
+        self._streams[stream_id][1].write(payload)
+        self.buffered_bytes += len(payload)
+        return None
+
+    def finish(self, stream_id: int) -> tuple[dict, bytes]:
+        """
+        Закрывает поток и возвращает его результат и изображение
+        """
+        json_result, content = self._streams.pop(stream_id)
+        data = content.getvalue()
+        self.buffered_bytes -= len(data)
+        return json_result, data
+
+    def discard(self, stream_id: int) -> None:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            self.buffered_bytes -= stream[1].getbuffer().nbytes
+
+    def reject(self, stream_id: int) -> None:
+        """
+        Отклоняет поток: буфер освобождается, а оставшиеся кадры потока пропускаются до кадра конца.
+        Ошибку по потоку клиент получает один раз - при отклонении
+        """
+        self.discard(stream_id)
+        self._rejected.add(stream_id)
+
+    @staticmethod
+    def stream_id_of(frame: bytes) -> int | None:
+        if len(frame) < frame_header.size:
+            return None
+        return frame_header.unpack_from(frame)[0]
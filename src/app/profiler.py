@@ -0,0 +1,174 @@
+# Сэмплирующий профилировщик для диагностики задержек в работающем сервере.
+# Включается администратором на заданное время (/profiler/start): отдельный поток с заданным интервалом
+# снимает стеки всех потоков процесса и агрегирует их. Можно ограничить профилирование маршрутами
+# и долей запросов: тогда учитываются только стеки, выполняющие выбранный запрос в данный момент -
+# в стеке есть кадр middleware этого запроса (кадры выполняемой корутины связаны через f_back с задачей,
+# которая её выполняет). Ожидающие запросы (например, простаивающий websocket) стеков не дают; работа,
+# вынесенная в другие потоки (asyncio.to_thread), в отфильтрованном сеансе не учитывается.
+# Результат - файл свёрнутых стеков (collapsed stacks) для flamegraph.pl, speedscope и т.п.
+# Пока сеанс не запущен, поток не работает, а middleware выполняет одну проверку.
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_session: "ProfilerSession | None" = None
+_last_stacks: Counter = Counter()
+_lock = threading.Lock()
+
+
+class ProfilerSession:
+    """
+    Сеанс профилирования
+
+    Args:
+        duration (float): длительность сеанса в секундах
+        interval (float): интервал между снятиями стеков в секундах
+        routes (set[str], optional): профилируемые маршруты (None - все)
+        fraction (float, optional): доля профилируемых запросов выбранных маршрутов
+    """
+
+    def __init__(self, duration: float, interval: float, routes: set[str] = None, fraction: float = 1.0):
+        self.duration = duration
+        self.interval = interval
+        self.routes = routes
+        self.fraction = fraction
+        self.started = time.time()
+        self.deadline = time.monotonic() + duration
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        # Без фильтров снимаются стеки всех потоков (в том числе фоновых задач)
+        self.always = routes is None and fraction >= 1
+        # Кадры middleware выбранных запросов -> маршрут
+        self.request_frames: dict = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def selects(self, path: str) -> bool:
+        """
+        Проверяет, профилируется ли запрос к маршруту `path`
+        """
+        if self.routes is not None and path not in self.routes:
+            return False
+        return self.fraction >= 1 or random.random() < self.fraction
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        request_frames = dict(self.request_frames)
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            root = None
+            while frame is not None:
+                if not self.always and frame in request_frames:
+                    # Стек выбранного запроса - от кадра middleware, корень - маршрут
+                    root = request_frames[frame]
+                    break
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if root is None:
+                if not self.always:
+                    continue
+                root = names.get(thread_id, str(thread_id))
+            stack.append(root.replace(" ", "_"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set() and time.monotonic() < self.deadline:
+            if self.always or self.request_frames:
+                self._sample()
+            self._stop.wait(self.interval)
+        _finish(self)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def status(self) -> dict:
+        return {
+            "started": self.started,
+            "duration": self.duration,
+            "interval_ms": self.interval * 1000,
+            "routes": sorted(self.routes) if self.routes is not None else None,
+            "fraction": self.fraction,
+            "samples": self.samples,
+            "running": self._thread.is_alive(),
+        }
+
+
+def _finish(session: ProfilerSession) -> None:
+    global _session, _last_stacks
+    with _lock:
+        if _session is session:
+            _session = None
+        _last_stacks = session.stacks
+    logger.info("Profiler finished: %d samples, %d unique stacks", session.samples, len(session.stacks))
+
+
+def start(duration: float, interval_ms: float = 10, routes: set[str] = None, fraction: float = 1.0) -> ProfilerSession:
+    """
+    Функция запускает сеанс профилирования (не более одного одновременно)
+    """
+    global _session
+    if duration <= 0 or interval_ms <= 0 or not 0 < fraction <= 1:
+        raise ValueError("duration and interval_ms must be positive, fraction must be in (0, 1]")
+    with _lock:
+        if _session is not None:
+            raise RuntimeError("Profiler is already running")
+        _session = ProfilerSession(duration, interval_ms / 1000, routes, fraction)
+        _session.start()
+        return _session
+
+
+def stop() -> None:
+    session = _session
+    if session is not None:
+        session.stop()
+
+
+def get_session() -> ProfilerSession | None:
+    return _session
+
+
+def collapsed_stacks() -> str:
+    """
+    Функция возвращает стеки последнего завершённого сеанса в формате collapsed stacks:
+    строка "кадр;кадр;... число_попаданий" на каждый уникальный стек
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in _last_stacks.most_common())
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware, отмечающее запросы, выбранные для профилирования:
+    кадр вызова middleware запоминается, и стеки, проходящие через него, относятся к запросу
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = _session
+        if session is None or scope["type"] not in ("http", "websocket") or not session.selects(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        frame = sys._getframe()
+        session.request_frames[frame] = scope["path"]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.request_frames.pop(frame, None)
+            del frame
@@ -0,0 +1,129 @@
+# Квантильный скетч DDSketch (Masson et al., 2019): значения раскладываются по логарифмическим корзинам,
+# поэтому любой квантиль оценивается с заданной относительной точностью, а скетчи объединяются
+# простым сложением счётчиков корзин. Используется для перцентилей speed_ms и времени приёма.
+import math
+import struct
+from array import array
+
+_header = struct.Struct("<dqqdddI")
+
+
+class DDSketch:
+    """
+    Скетч неотрицательных значений
+
+    Args:
+        relative_accuracy (float, optional): относительная погрешность оценки квантилей
+        max_bins (int, optional): максимальное число корзин (при превышении объединяются младшие корзины)
+    """
+
+    # Значения меньше этого порога учитываются как нулевые
+    min_value = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.bins: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Середина корзины (gamma^(key-1), gamma^key] с относительной погрешностью не более relative_accuracy
+        return 2 * self._gamma ** key / (1 + self._gamma)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value is None or count <= 0:
+            return
+        value = max(float(value), 0.0)
+        if value < self.min_value:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self) -> None:
+        # Младшие корзины объединяются: теряется точность только для малых квантилей
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.max_bins + 1]
+        target = keys[len(keys) - self.max_bins + 1]
+        self.bins[target] += sum(self.bins.pop(key) for key in excess)
+
+    def merge(self, other: "DDSketch") -> None:
+        """
+        Добавляет значения скетча `other`. Скетч с другой точностью (например, после изменения
+        stats.sketchAccuracy) переносится по корзинам этого скетча: погрешность таких значений
+        не превышает суммы точностей обоих скетчей
+        """
+        if other.count == 0:
+            return
+        if other.relative_accuracy == self.relative_accuracy:
+            for key, count in other.bins.items():
+                self.bins[key] = self.bins.get(key, 0) + count
+        else:
+            for key, count in other.bins.items():
+                target = self._key(other._value(key))
+                self.bins[target] = self.bins.get(target, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Оценка квантиля `q` (0..1) или None для пустого скетча
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return min(max(self._value(key), self.min), self.max)
+        return self.max
+
+    def to_bytes(self) -> bytes:
+        keys = sorted(self.bins)
+        return (
+            _header.pack(self.relative_accuracy, self.count, self.zero_count, self.sum,
+                         self.min if self.count else 0.0, self.max if self.count else 0.0, len(keys))
+            + array("i", keys).tobytes()
+            + array("q", (self.bins[key] for key in keys)).tobytes()
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DDSketch":
+        relative_accuracy, count, zero_count, total, min_value, max_value, bins_count = _header.unpack_from(data)
+        sketch = cls(relative_accuracy)
+        offset = _header.size
+        keys = array("i")
+        keys.frombytes(data[offset:offset + 4 * bins_count])
+        counts = array("q")
+        counts.frombytes(data[offset + 4 * bins_count:offset + 12 * bins_count])
+        sketch.bins = dict(zip(keys, counts))
+        sketch.count = count
+        sketch.zero_count = zero_count
+        sketch.sum = total
+        if count:
+            sketch.min = min_value
+            sketch.max = max_value
+        return sketch
@@ -0,0 +1,72 @@
+# SQL-запросы маршрутов чтения и проверки пользователей.
+# Используются приложением (src/routes/det_operations.py, src/app/utils.py)
+# и замером запросов (benchmarks/bench_queries.py), чтобы замерялось ровно то, что выполняется.
+from sqlalchemy import bindparam, text
+from sqlalchemy.sql.elements import TextClause
+
+verify_user_sql: TextClause = text(
+    "select id, name, email from cv_user where (name = :data or email = :data) and password = :password"
+)
+
+
+def results_sql(where: str = "", with_json: bool = True) -> TextClause:
+    """
+    Запрос /get_results. result_json (в любом формате хранения) читается, только если `with_json`
+
+    Args:
+        where (str, optional): условие отбора (см. utils.date_range_condition)
+        with_json (bool, optional): читать result_json
+    """
+    json_columns = "result_json, result_json_z, result_json_dict" if with_json else "null, null, null"
+    return text(f"""
+        select id,
+            class_id,
+            scrs_timestamp,
+            scrs_path,
+            is_complete,
+            result_conf,
+            {json_columns},
+            speed_ms
+        from cv_activity
+        {where}
+    """)
+
+
+def results_materials_sql(where: str = "") -> TextClause:
+    """
+    Материалы activity, отобранных /get_results по условию `where` (with_materials=true)
+    """
+    return text(f"""
+        select act_id, mat_class_id, conf, x1, y1, x2, y2
+        from cv_activity_mat
+        where act_id in (select id from cv_activity {where})
+        order by act_id, id
+    """)
+
+
+def agr_results_sql(where: str = "") -> TextClause:
+    """
+    Запрос /get_agr_results: количество, сумма и количество заданных speed_ms по дням, пользователям
+    и завершённости. Среднее вычисляется после объединения групп основной БД и шардов
+    """
+    return text(f"""
+        select date(scrs_timestamp) d,
+            username,
+            is_complete,
+            count(*) cnt,
+            sum(speed_ms) speed_sum,
+            count(speed_ms) speed_cnt
+        from cv_activity
+        {where}
+        group by date(scrs_timestamp), username, is_complete
+        order by date(scrs_timestamp), username, is_complete
+    """)
+
+
+def existing_values_sql(column: str) -> TextClause:
+    """
+    Проверка занятости значений `column` (name или email) cv_user для списка :values
+    """
+    return text(f"select {column} from cv_user where {column} in :values").bindparams(
+        bindparam("values", expanding=True)
+    )
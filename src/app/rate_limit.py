@@ -0,0 +1,231 @@
+# Ограничение частоты запросов (token bucket) по пользователю и по адресу клиента.
+# Пользователь берётся из результата (username), а не из реквизитов соединения: станции
+# подключаются под общей учётной записью. По умолчанию выключено (rateLimit.enabled): станции
+# за NAT имеют общий адрес, и лимиты по адресу нужно подбирать под конкретную установку.
+# Лимиты задаются для каждого маршрута в конфиге (rateLimit.routes). Маршруты без лимита не проверяются.
+# Режимы: reject - лишний запрос отклоняется, delay - запрос задерживается до появления токена
+# (не дольше maxDelayMs, иначе отклоняется).
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import HTTPException
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.websockets import WebSocket
+
+import src.app.serialization as serialization
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_limiter = None
+
+
+class RateLimitError(Exception):
+    """
+    Превышен лимит запросов
+    """
+
+    def __init__(self, route: str, key: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {key} on {route}")
+        self.route = route
+        self.key = key
+        self.retry_after = retry_after
+
+
+class RouteLimit:
+    """
+    Параметры лимита маршрута: rate - токенов в секунду, burst - ёмкость корзины
+    """
+
+    def __init__(self, rate: float, burst: float, mode: str = "reject", max_delay_ms: float = 0):
+        self.rate = rate
+        self.burst = burst
+        self.mode = mode
+        self.max_delay = max_delay_ms / 1000
+        self.shed = 0
+        self.delayed = 0
+        self.passed = 0
+
+
+class RateLimiter:
+    """
+    Набор корзин токенов. Корзина хранится как [токены, время последнего пополнения];
+    число корзин ограничено, давно не использовавшиеся вытесняются.
+    Используется только из цикла событий, поэтому блокировки не нужны
+    """
+
+    def __init__(self, routes: dict[str, RouteLimit], max_buckets: int = 100_000):
+        self.routes = routes
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+
+    def _bucket(self, route: str, limit: RouteLimit, key: str, now: float) -> list[float]:
+        """
+        Возвращает корзину `key`, пополненную на момент `now`
+        """
+        bucket = self._buckets.get((route, key))
+        if bucket is None:
+            bucket = [limit.burst, now]
+            self._buckets[(route, key)] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((route, key))
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        return bucket
+
+    def check(self, route: str, address: str = None, username: str = None) -> float:
+        """
+        Проверяет лимиты маршрута для пользователя и адреса клиента.
+        Токены списываются только если запрос проходит по обеим корзинам
+
+        Returns:
+            (float): задержка в секундах перед обработкой запроса
+
+        Raises:
+            RateLimitError: лимит превышен
+        """
+        limit = self.routes.get(route)
+        if limit is None:
+            return 0
+        now = time.monotonic()
+        buckets = [
+            (key, self._bucket(route, limit, key, now))
+            for key in (f"user:{username}" if username else None, f"addr:{address}" if address else None)
+            if key is not None
+        ]
+        delay = 0
+        for key, bucket in buckets:
+            wait = 0 if bucket[0] >= 1 else (1 - bucket[0]) / limit.rate
+            if wait > 0 and (limit.mode != "delay" or wait > limit.max_delay):
+                limit.shed += 1
+                raise RateLimitError(route, key, wait)
+            delay = max(delay, wait)
+        # В режиме delay токен резервируется заранее: корзина уходит в минус на время ожидания
+        for key, bucket in buckets:
+            bucket[0] -= 1
+        if delay > 0:
+            limit.delayed += 1
+        else:
+            limit.passed += 1
+        return delay
+
+    async def acquire(self, route: str, address: str = None, username: str = None) -> None:
+        """
+        Проверяет лимиты и при необходимости ждёт (режим delay)
+        """
+        delay = self.check(route, address, username)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> dict:
+        return {
+            route: {"passed": limit.passed, "delayed": limit.delayed, "shed": limit.shed}
+            for route, limit in self.routes.items()
+        }
+
+
+def create_rate_limiter() -> RateLimiter:
+    """
+    Функция создаёт ограничитель по конфигу (rateLimit)
+    """
+    routes = dict()
+    if utils.prop('rateLimit.enabled', False, utils.config):
+        routes_config: dict = utils.prop('rateLimit.routes', {}, utils.config)
+        for route, route_config in routes_config.items():
+            routes[route] = RouteLimit(
+                rate=float(route_config.get("rate")),
+                burst=float(route_config.get("burst", route_config.get("rate"))),
+                mode=route_config.get("mode", "reject"),
+                max_delay_ms=float(route_config.get("maxDelayMs", 0)),
+            )
+    return RateLimiter(routes, int(utils.prop('rateLimit.maxBuckets', 100_000, utils.config)))
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = create_rate_limiter()
+    return _limiter
+
+
+def client_address(connection) -> str | None:
+    """
+    Адрес клиента HTTP-запроса или websocket-соединения
+    """
+    return connection.client.host if connection.client else None
+
+
+async def _http_username(request: Request) -> str | None:
+    # Проверяемый пользователь: параметр userdata (/verify_user) или поле userdata JSON-тела (/login)
+    username = request.query_params.get("userdata")
+    if username is None and request.method == "POST":
+        try:
+            body = serialization.loads(await request.body())
+            username = body.get("userdata") if isinstance(body, dict) else None
+        except Exception:
+            return None
+    return username
+
+
+async def accept_websocket(websocket: WebSocket, route: str = "/ws/connect") -> bool:
+    """
+    Функция принимает websocket-соединение, если не превышен лимит подключений `route` с адреса клиента.
+    Лимит проверяется до принятия handshake и проверки реквизитов, чтобы подбор пароля через websocket
+    ограничивался так же, как через /login. Отклонённое соединение получает HTTP 429, если сервер
+    поддерживает ответ на handshake, иначе принимается и закрывается с кодом 1013 (Try Again Later)
+
+    Returns:
+        (bool): соединение принято
+    """
+    try:
+        await get_rate_limiter().acquire(route, client_address(websocket))
+    except RateLimitError as e:
+        logger.info(str(e))
+        retry_after = str(max(1, round(e.retry_after)))
+        if "websocket.http.response" in websocket.scope.get("extensions", {}):
+            await websocket.send_denial_response(Response(
+                content=serialization.dumps_bytes(utils.result_error(
+                    data={"retry_after": e.retry_after}, error="Too many requests", error_code=-429
+                )),
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": retry_after},
+                media_type="application/json"
+            ))
+        else:
+            await websocket.accept()
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many requests")
+        return False
+    await websocket.accept()
+    return True
+
+
+def limit_http(route: str, by_user: bool = False) -> Callable:
+    """
+    Функция возвращает зависимость FastAPI, ограничивающую частоту запросов к маршруту `route`.
+    По умолчанию запросы ограничиваются по адресу клиента: станции работают под общей учётной записью
+    Basic-аутентификации, и корзина по ней была бы общей для всех. `by_user` - дополнительно ограничивать
+    по проверяемому пользователю (маршруты входа, защита от подбора пароля)
+    """
+
+    async def dependency(request: Request):
+        try:
+            await get_rate_limiter().acquire(
+                route, client_address(request), await _http_username(request) if by_user else None
+            )
+        except RateLimitError as e:
+            logger.info(str(e))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, round(e.retry_after)))}
+            )
+
+    return dependency
@@ -0,0 +1,82 @@
+# Кэш справочников cv_material_class и cv_activity_class в памяти процесса.
+# Изменение справочников отмечается триггерами в cv_reference_version (см. db_migrations.py);
+# кэш сверяет версию не чаще раза в reference.checkSeconds и перечитывается только при её изменении.
+import threading
+import time
+
+from sqlalchemy import text
+
+import src.app.data_version as data_version
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+reference_tables = ("cv_material_class", "cv_activity_class")
+
+_lock = threading.Lock()
+_version: int | None = None
+_checked: float = 0.0
+_classes: dict[str, dict[int, dict]] = {table: {} for table in reference_tables}
+
+
+def _load(session) -> None:
+    global _classes
+    classes = {}
+    for table in reference_tables:
+        classes[table] = {
+            row.id: {"name": row.name, "description": row.description}
+            for row in session.execute(text(f"select id, name, description from {table}"))
+        }
+    _classes = classes
+
+
+def refresh() -> None:
+    """
+    Перечитывает справочники, если с последней сверки изменилась их версия
+    """
+    global _version, _checked
+    now = time.monotonic()
+    if _version is not None and now - _checked < float(utils.prop('reference.checkSeconds', 5, utils.config)):
+        return
+    with _lock:
+        if _version is not None and now - _checked < float(utils.prop('reference.checkSeconds', 5, utils.config)):
+            return
+        with utils.Session() as session:
+            version = session.execute(text("select version from cv_reference_version where id = 1")).scalar() or 0
+            if version != _version:
+                _load(session)
+                if _version is not None:
+                    logger.info("Reference tables reloaded (version %d)", version)
+                    # Названия классов входят в ответы /get_results - меняется и версия данных
+                    data_version.mark_changed()
+                _version = version
+        _checked = now
+
+
+def get_classes(table: str) -> dict[int, dict]:
+    """
+    Функция возвращает справочник `table` (id -> name, description)
+    """
+    refresh()
+    return _classes[table]
+
+
+def material_class_name(mat_class_id: int | None) -> str | None:
+    item = get_classes("cv_material_class").get(mat_class_id)
+    return item["name"] if item is not None else None
+
+
+def activity_class_name(class_id: int | None) -> str | None:
+    item = get_classes("cv_activity_class").get(class_id)
+    return item["name"] if item is not None else None
+
+
+def invalidate() -> None:
+    """
+    Сбрасывает кэш: справочники будут перечитаны при следующем обращении
+    """
+    global _version
+    with _lock:
+        _version = None
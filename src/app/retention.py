@@ -0,0 +1,394 @@
+# Фоновое обслуживание хранилища: архивирование старых activity и их материалов,
+# перенос/удаление изображений и инкрементальный VACUUM
+import asyncio
+import datetime
+import gzip
+import os
+import re
+import shutil
+import time
+
+from sqlalchemy import text
+
+import src.app.data_version as data_version
+import src.app.serialization as serialization
+import src.app.shards as shards
+import src.app.utils as utils
+from src.app.image_storage import get_image_storage
+from src.app.json_compression import read_result_json
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+# Задача периодического запуска (создаётся на старте приложения)
+_retention_task: asyncio.Task | None = None
+# Файл архива пачки до фиксации её удаления из БД
+_tmp_suffix = ".tmp"
+_tmp_file_re = re.compile(r"^cv_activity_\d{4}-\d{2}-\d{2}_(\d+)\.jsonl\.gz\.tmp$")
+
+
+def get_retention_config() -> dict:
+    """
+    Функция возвращает настройки политики хранения с учётом значений по умолчанию
+
+    Returns:
+        (dict): настройки политики хранения
+    """
+    return {
+        "enabled": utils.prop('retention.enabled', False, utils.config),
+        "interval_minutes": float(utils.prop('retention.intervalMinutes', 60, utils.config)),
+        "max_age_days": float(utils.prop('retention.maxAgeDays', 0, utils.config)),
+        "max_rows": int(utils.prop('retention.maxRows', 0, utils.config)),
+        "batch_size": int(utils.prop('retention.batchSize', 500, utils.config)),
+        "batch_pause_ms": float(utils.prop('retention.batchPauseMs', 50, utils.config)),
+        "archive_folder": utils.prop('retention.archiveFolder', 'archive', utils.config),
+        "images": utils.prop('retention.images', 'archive', utils.config),
+        "vacuum_pages": int(utils.prop('retention.vacuumPages', 1000, utils.config)),
+    }
+
+
+def _archive_path(archive_folder: str, scrs_timestamp: str, first_id: int) -> str:
+    """
+    Функция возвращает имя файла архива пачки activity за день.
+    Архивы разбиты по каталогам год/месяц, каждая пачка - отдельный файл с id первой activity:
+    archive/2024/05/cv_activity_2024-05-09_123.jsonl.gz
+
+    Args:
+        archive_folder (str): корневой каталог архива
+        scrs_timestamp (str): время activity в формате ISO
+        first_id (int): наименьший id activity пачки за этот день
+
+    Returns:
+        (str): путь к файлу архива
+    """
+    day = scrs_timestamp[:10]
+    return os.path.join(archive_folder, day[:4], day[5:7], f'cv_activity_{day}_{first_id}.jsonl.gz')
+
+
+def _select_batch(session, cutoff: str | None, max_id: int | None, batch_size: int) -> list[dict]:
+    """
+    Функция выбирает очередную пачку activity, подлежащих архивированию:
+    старше `cutoff` или с id не больше `max_id` (политика по количеству строк)
+    """
+    conditions = []
+    if cutoff is not None:
+        conditions.append("scrs_timestamp < :cutoff")
+    if max_id is not None:
+        conditions.append("id <= :max_id")
+    sql = text(f"""
+        select id,
+            class_id,
+            scrs_timestamp,
+            scrs_path,
+            is_complete,
+            result_conf,
+            result_json,
+            result_json_z,
+            result_json_dict,
+            speed_ms,
+            comment,
+            username
+        from cv_activity
+        where {" or ".join(conditions)}
+        order by id
+        limit :batch_size
+    """)
+    rows = session.execute(sql, {"cutoff": cutoff, "max_id": max_id, "batch_size": batch_size})
+    activities = []
+    for row in rows:
+        activity = dict(row._mapping)
+        # В архив result_json попадает в исходном (несжатом) виде
+        activity["result_json"] = read_result_json(
+            activity["result_json"], activity.pop("result_json_z"), activity.pop("result_json_dict")
+        )
+        activities.append(activity)
+    return activities
+
+
+def _select_materials(session, act_ids: list[int]) -> dict[int, list[dict]]:
+    """
+    Функция возвращает материалы для набора activity, сгруппированные по act_id
+    """
+    params = {f"id{i}": act_id for i, act_id in enumerate(act_ids)}
+    sql = text(f"""
+        select id, act_id, mat_class_id, coords, x1, y1, x2, y2, conf, comment
+        from cv_activity_mat
+        where act_id in ({", ".join(":" + key for key in params)})
+    """)
+    materials: dict[int, list[dict]] = {}
+    for row in session.execute(sql, params):
+        materials.setdefault(row.act_id, []).append(dict(row._mapping))
+    return materials
+
+
+def _write_archive(archive_folder: str, activities: list[dict], materials: dict[int, list[dict]]) -> list[str]:
+    """
+    Функция записывает пачку activity вместе с материалами во временные файлы архива (gzip, JSON Lines)
+    по дням. Файлы получают окончательные имена (_commit_archive) только после удаления пачки из БД,
+    поэтому прерванный проход не оставляет в архиве повторов
+
+    Returns:
+        (list[str]): окончательные имена файлов
+    """
+    by_day: dict[str, list[dict]] = {}
+    for activity in activities:
+        by_day.setdefault(activity["scrs_timestamp"][:10], []).append(activity)
+
+    filenames = []
+    for day_activities in by_day.values():
+        filename = _archive_path(
+            archive_folder, day_activities[0]["scrs_timestamp"], min(activity["id"] for activity in day_activities)
+        )
+        lines = [
+            serialization.dumps({"activity": activity, "materials": materials.get(activity["id"], [])})
+            for activity in day_activities
+        ]
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with gzip.open(filename + _tmp_suffix, 'wb') as f:
+            f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileobj.fileno())
+        filenames.append(filename)
+    return filenames
+
+
+def _commit_archive(filenames: list[str]) -> None:
+    """
+    Функция присваивает временным файлам архива окончательные имена
+    """
+    for filename in filenames:
+        os.replace(filename + _tmp_suffix, filename)
+
+
+def _recover_archive(session, archive_folder: str) -> None:
+    """
+    Функция завершает пачки прохода, прерванного между записью архива и присвоением имён:
+    если первой activity файла уже нет в БД, пачка удалена и файл получает окончательное имя,
+    иначе удаление не было зафиксировано и файл удаляется (пачка будет заархивирована повторно)
+    """
+    for folder, _, files in os.walk(archive_folder):
+        for name in files:
+            match = _tmp_file_re.match(name)
+            if match is None:
+                continue
+            filename = os.path.join(folder, name[:-len(_tmp_suffix)])
+            exists = session.execute(
+                text("select 1 from cv_activity where id = :id"), {"id": int(match.group(1))}
+            ).first() is not None
+            if exists:
+                os.remove(filename + _tmp_suffix)
+            else:
+                os.replace(filename + _tmp_suffix, filename)
+                logger.info("Retention: archive %s recovered", filename)
+    session.commit()
+
+
+def _delete_batch(session, act_ids: list[int]) -> None:
+    """
+    Функция удаляет пачку activity и их материалы одной короткой транзакцией
+    """
+    params = {f"id{i}": act_id for i, act_id in enumerate(act_ids)}
+    in_clause = ", ".join(":" + key for key in params)
+    session.execute(text(f"delete from cv_activity_mat where act_id in ({in_clause})"), params)
+    session.execute(text(f"delete from cv_activity where id in ({in_clause})"), params)
+    session.commit()
+    data_version.mark_changed()
+
+
+def _process_images(activities: list[dict], archive_folder: str, mode: str) -> int:
+    """
+    Функция переносит в архив или удаляет изображения пачки activity
+
+    Returns:
+        (int): объём обработанных файлов в байтах
+    """
+    processed_bytes = 0
+    if mode not in ('archive', 'delete'):
+        return processed_bytes
+    storage = get_image_storage()
+    for activity in activities:
+        size = storage.size(activity["scrs_path"])
+        if size is None:
+            continue
+        processed_bytes += size
+        if mode == 'archive':
+            day = activity["scrs_timestamp"][:10]
+            images_folder = os.path.join(archive_folder, day[:4], day[5:7], 'images')
+            os.makedirs(images_folder, exist_ok=True)
+            storage.move_to(activity["scrs_path"], os.path.join(images_folder, activity["scrs_path"]))
+        else:
+            storage.delete(activity["scrs_path"])
+    return processed_bytes
+
+
+def _incremental_vacuum(pages: int) -> None:
+    """
+    Функция возвращает ОС до `pages` свободных страниц БД.
+    Работает только для БД в режиме `PRAGMA auto_vacuum = INCREMENTAL` (см. create_db_demo.py);
+    существующая БД переводится в этот режим однократно при старте (db_migrations._enable_incremental_vacuum)
+    """
+    if pages <= 0:
+        return
+    with utils.engine.connect() as connection:
+        auto_vacuum = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if auto_vacuum != 2:
+            logger.warning("Retention: incremental vacuum skipped, database auto_vacuum mode is %s", auto_vacuum)
+            return
+        connection.exec_driver_sql(f"PRAGMA incremental_vacuum({int(pages)})")
+        connection.commit()
+
+
+def _archive_shards(cutoff: str | None, retention_config: dict, stats: dict) -> int:
+    """
+    Функция в режиме секционирования переносит в архив шарды месяцев, целиком предшествующих `cutoff`,
+    и шарды, более новые шарды которых уже содержат maxRows activity (лимит соблюдается с точностью
+    до месяца). Файл шарда переносится как есть, изображения его activity обрабатываются по политике.
+    Шард текущего месяца не переносится
+
+    Returns:
+        (int): количество activity в оставшихся шардах
+    """
+    current_key = shards.shard_key(datetime.datetime.now())
+    kept_rows = 0
+    for key in reversed(shards.list_shard_keys()):
+        engine = shards.get_shard_engine(key, read_only=True)
+        expired = cutoff is not None and key < shards.shard_key(cutoff)
+        over_limit = retention_config["max_rows"] > 0 and kept_rows >= retention_config["max_rows"]
+        if key == current_key or not (expired or over_limit):
+            with engine.connect() as connection:
+                kept_rows += connection.execute(text("select count(*) from cv_activity")).scalar()
+            continue
+        last_id = -1
+        with utils.Session(bind=engine) as session:
+            sql = text("""
+                select id, scrs_timestamp, scrs_path
+                from cv_activity
+                where id > :last_id
+                order by id
+                limit :batch_size
+            """)
+            while True:
+                activities = [dict(row._mapping) for row in session.execute(
+                    sql, {"last_id": last_id, "batch_size": retention_config["batch_size"]}
+                )]
+                if not activities:
+                    break
+                last_id = activities[-1]["id"]
+                stats["activities"] += len(activities)
+                stats["image_bytes"] += _process_images(
+                    activities, retention_config["archive_folder"], retention_config["images"]
+                )
+        shards.release_shard(key)
+
+        archive_folder = os.path.join(retention_config["archive_folder"], key[:4], key[5:7])
+        os.makedirs(archive_folder, exist_ok=True)
+        shutil.move(shards.shard_path(key), os.path.join(archive_folder, os.path.basename(shards.shard_path(key))))
+        data_version.mark_changed()
+        logger.info("Retention: shard %s moved to %s", key, archive_folder)
+    return kept_rows
+
+
+def run_retention_once(retention_config: dict = None) -> dict:
+    """
+    Функция выполняет один проход политики хранения: пачками архивирует и удаляет
+    устаревшие activity, обрабатывает изображения и выполняет инкрементальный VACUUM.
+    Между пачками блокировка записи освобождается, чтобы не задерживать приём результатов.
+
+    Args:
+        retention_config (dict, optional): настройки политики хранения
+
+    Returns:
+        (dict): статистика прохода
+    """
+    if retention_config is None:
+        retention_config = get_retention_config()
+
+    cutoff = None
+    if retention_config["max_age_days"] > 0:
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=retention_config["max_age_days"])
+        ).isoformat()
+
+    stats = {"activities": 0, "materials": 0, "image_bytes": 0, "seconds": 0.0}
+    start = time.monotonic()
+
+    # Activity в шардах новее activity основной БД и учитываются в maxRows первыми
+    shard_rows = 0
+    if shards.partitioning_enabled() and (cutoff is not None or retention_config["max_rows"] > 0):
+        shard_rows = _archive_shards(cutoff, retention_config, stats)
+
+    with utils.Session() as session:
+        _recover_archive(session, retention_config["archive_folder"])
+        max_id = None
+        if retention_config["max_rows"] > 0:
+            keep_rows = retention_config["max_rows"] - shard_rows
+            if keep_rows > 0:
+                sql = text("select id from cv_activity order by id desc limit 1 offset :max_rows")
+                max_id = session.execute(sql, {"max_rows": keep_rows}).scalar()
+            else:
+                max_id = session.execute(text("select max(id) from cv_activity")).scalar()
+        if cutoff is None and max_id is None:
+            return stats
+
+        while True:
+            activities = _select_batch(session, cutoff, max_id, retention_config["batch_size"])
+            # Завершаем читающую транзакцию, чтобы не удерживать снимок БД
+            session.commit()
+            if not activities:
+                break
+
+            act_ids = [activity["id"] for activity in activities]
+            materials = _select_materials(session, act_ids)
+            session.commit()
+
+            # Сначала архив, потом удаление: при сбое данные не теряются.
+            # Окончательные имена файлы архива получают после фиксации удаления (см. _recover_archive)
+            filenames = _write_archive(retention_config["archive_folder"], activities, materials)
+            _delete_batch(session, act_ids)
+            _commit_archive(filenames)
+            stats["image_bytes"] += _process_images(
+                activities, retention_config["archive_folder"], retention_config["images"]
+            )
+
+            stats["activities"] += len(activities)
+            stats["materials"] += sum(len(m) for m in materials.values())
+            elapsed = time.monotonic() - start
+            logger.info(
+                "Retention: %d activities, %d materials, %.1f MB of images processed (%.1f activities/s)",
+                stats["activities"], stats["materials"], stats["image_bytes"] / 1_048_576,
+                stats["activities"] / elapsed if elapsed > 0 else 0.0
+            )
+            time.sleep(retention_config["batch_pause_ms"] / 1000)
+
+    _incremental_vacuum(retention_config["vacuum_pages"])
+    stats["seconds"] = round(time.monotonic() - start, 3)
+    logger.info("Retention finished: %s", stats)
+    return stats
+
+
+async def _retention_loop(retention_config: dict) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(run_retention_once, retention_config)
+        except Exception as e:
+            logger.error(f"Retention error: {str(e)}")
+        await asyncio.sleep(retention_config["interval_minutes"] * 60)
+
+
+async def start_retention() -> None:
+    """
+    Запускает периодическое выполнение политики хранения, если оно разрешено в конфиге
+    """
+    global _retention_task
+    retention_config = get_retention_config()
+    if not retention_config["enabled"] or _retention_task is not None:
+        return
+    _retention_task = asyncio.create_task(_retention_loop(retention_config))
+
+
+async def stop_retention() -> None:
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
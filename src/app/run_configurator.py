@@ -7,7 +7,17 @@ from fastapi import APIRouter  # , Depends
 
 # from src.app.security import authenticate_user_over_http
 from src.app.containers import heavy_bean_init
+from src.app.db_migrations import apply_migrations
+from src.app.image_transform import start_transform_pool, stop_transform_pool
+from src.app.json_compression import start_result_json_migration
+from src.app.latency_stats import start_latency_stats, stop_latency_stats
 from src.app.logger_config import get_log_config
+from src.app.loop_monitor import LoopLagMiddleware, start_loop_monitor, stop_loop_monitor
+from src.app.profiler import ProfilerMiddleware
+from src.app.retention import start_retention, stop_retention
+from src.app.serialization import create_serializer, set_serializer
+from src.app.shards import check_partitioning
+from src.app.upload_spool import start_spool_gc
 from src.routes.det_operations import router as router_ws
 
 
@@ -15,6 +25,9 @@ class RunConfigurator:
     def __init__(self, container):
         self._container = container
 
+        # Выбираем реализацию JSON (используется в ответах, websocket и логах)
+        set_serializer(create_serializer(self._container.config().get("app").get("jsonBackend", "auto")))
+
         # Создаём конфиг логов
         self._log_config = get_log_config()
         logging.config.dictConfig(self._log_config)
@@ -22,6 +35,12 @@ class RunConfigurator:
         # Инициализируем тяжелые бины
         heavy_bean_init()
 
+        # Секционирование нельзя выключить при существующих шардах
+        check_partitioning()
+
+        # Доводим схему БД до актуальной
+        apply_migrations()
+
         # ----------------------
         # Получаем экземпляр приложения
         self._app = self._container.container.app()
@@ -36,6 +55,23 @@ class RunConfigurator:
         # Подключаем базовый роутер
         self._app.include_router(base_router)
 
+        # Отметка запросов для профилировщика (/profiler/start)
+        self._app.add_middleware(ProfilerMiddleware)
+        # Отклонение запросов при перегрузке цикла событий (добавляется последним - выполняется первым)
+        self._app.add_middleware(LoopLagMiddleware)
+
+        # Фоновые задачи обслуживания
+        self._app.on_event("startup")(start_transform_pool)
+        self._app.on_event("startup")(start_retention)
+        self._app.on_event("startup")(start_result_json_migration)
+        self._app.on_event("startup")(start_spool_gc)
+        self._app.on_event("startup")(start_latency_stats)
+        self._app.on_event("startup")(start_loop_monitor)
+        self._app.on_event("shutdown")(stop_retention)
+        self._app.on_event("shutdown")(stop_transform_pool)
+        self._app.on_event("shutdown")(stop_latency_stats)
+        self._app.on_event("shutdown")(stop_loop_monitor)
+
     def overwrite_di_container(self, container: Container | Type[Container]):
         self._container.override(container)
 
@@ -2,19 +2,38 @@ import logging
 import secrets
 from typing import Annotated
 
-from fastapi.security import HTTPBasicCredentials, HTTPBasic
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasicCredentials, HTTPBasic, HTTPBearer
 from fastapi import Depends, HTTPException
 from starlette import status
 from starlette.exceptions import WebSocketException
 
 from src.app.containers import async_prop
+import src.app.session_tokens as session_tokens
 
 logger = logging.getLogger("app_logger")
 
 
 async def authenticate_user_over_http(
-        credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())]
+        credentials: Annotated[HTTPBasicCredentials | None, Depends(HTTPBasic(auto_error=False))],
+        bearer: Annotated[HTTPAuthorizationCredentials | None, Depends(HTTPBearer(auto_error=False))]
 ):
+    # Сессионный токен (Authorization: Bearer) проверяется без обращения к БД
+    if bearer is not None:
+        if session_tokens.get_token_store().check(bearer.credentials) is not None:
+            return
+        logger.info("Http authorization error. Invalid session token")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired session token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Basic"}
+        )
     logger.info("Http authorization attempt. Login: %s", credentials.username)
     if not await check_user_credentials(credentials):
         logger.info("Http authorization error. Login: %s", credentials.username)
@@ -26,9 +45,32 @@ async def authenticate_user_over_http(
         )
 
 
+async def authenticate_admin_over_http(
+        credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())]
+):
+    # Служебные операции (профилирование и т.п.) доступны только по реквизитам ТУЗ, без сессионных токенов
+    logger.info("Http admin authorization attempt. Login: %s", credentials.username)
+    if not await check_user_credentials(credentials):
+        logger.info("Http admin authorization error. Login: %s", credentials.username)
+
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Basic"}
+        )
+
+
 async def authenticate_user_over_ws(
         credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())],
+        token: str = None
 ):
+    # Сессионный токен проверяется без обращения к БД
+    if token:
+        if session_tokens.get_token_store().check(token) is None:
+            logger.info("WebSocket authorization error. Invalid session token")
+            raise WebSocketException(code=1002, reason="Invalid or expired session token")
+        return
+
     logger.info("WebSocket authorization attempt. Login: %s", credentials.username)
     if not await check_user_credentials(credentials):
         logger.info("WebSocket authorization error. Login: %s", credentials.username)
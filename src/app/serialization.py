@@ -0,0 +1,114 @@
+# Единый слой сериализации JSON для HTTP-ответов, сообщений websocket и логов.
+# По умолчанию используется orjson (если установлен), иначе стандартный модуль json.
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JsonSerializer:
+    """
+    Базовый класс сериализатора JSON
+    """
+    name: str = ""
+
+    def dumps(self, obj: Any) -> str:
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: str | bytes) -> Any:
+        raise NotImplementedError
+
+
+class StdlibJsonSerializer(JsonSerializer):
+    """
+    Сериализатор на стандартном модуле json
+    """
+    name = "stdlib"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return self.dumps(obj).encode("utf-8")
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    """
+    Сериализатор на orjson. Типы, не поддерживаемые orjson (например, исключения), приводятся к строке
+    """
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str, option=self._options)
+
+    def loads(self, data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+
+def create_serializer(backend: str = "auto") -> JsonSerializer:
+    """
+    Функция создаёт сериализатор по имени
+
+    Args:
+        backend (str, optional): "orjson", "stdlib" или "auto" (orjson, если установлен)
+
+    Returns:
+        (JsonSerializer): сериализатор
+    """
+    if backend == "stdlib" or (backend == "auto" and orjson is None):
+        return StdlibJsonSerializer()
+    if backend in ("orjson", "auto"):
+        return OrjsonSerializer()
+    raise ValueError(f"Unknown JSON backend: {backend}")
+
+
+_serializer: JsonSerializer = create_serializer()
+
+
+def set_serializer(serializer: JsonSerializer) -> None:
+    """
+    Устанавливает сериализатор, используемый приложением
+    """
+    global _serializer
+    _serializer = serializer
+
+
+def get_serializer() -> JsonSerializer:
+    return _serializer
+
+
+def dumps(obj: Any) -> str:
+    return _serializer.dumps(obj)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    return _serializer.dumps_bytes(obj)
+
+
+def loads(data: str | bytes) -> Any:
+    return _serializer.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse, сериализующий содержимое текущим сериализатором приложения
+    """
+
+    def render(self, content: Any) -> bytes:
+        return _serializer.dumps_bytes(content)
@@ -0,0 +1,120 @@
+# Сессионные токены пользователей: выдаются при входе (/login) и проверяются без обращения к БД.
+# Токен = <id сессии>.<срок действия>.<подпись HMAC>; сами сессии хранятся в памяти процесса
+# (ограниченное число, время жизни, отзыв).
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class TokenStore:
+    """
+    Хранилище сессий в памяти. Сессии упорядочены по времени выдачи, поэтому
+    устаревшие и (при переполнении) самые старые сессии удаляются с начала
+    """
+
+    def __init__(self, secret: bytes, ttl_seconds: float, max_tokens: int):
+        self._secret = secret
+        self.ttl_seconds = ttl_seconds
+        self.max_tokens = max_tokens
+        self._sessions: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self._secret, payload.encode("utf-8"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+    def _purge_expired(self, now: float) -> None:
+        while self._sessions:
+            session_id, (expires, _) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            del self._sessions[session_id]
+
+    def issue(self, data: dict) -> tuple[str, float]:
+        """
+        Выдаёт токен для пользователя `data`
+
+        Returns:
+            (tuple[str, float]): токен и момент окончания действия (unix time)
+        """
+        session_id = secrets.token_urlsafe(16)
+        now = time.time()
+        expires = now + self.ttl_seconds
+        payload = f"{session_id}.{int(expires)}"
+        with self._lock:
+            self._purge_expired(now)
+            while len(self._sessions) >= self.max_tokens:
+                self._sessions.popitem(last=False)
+            self._sessions[session_id] = (expires, data)
+        return f"{payload}.{self._sign(payload)}", expires
+
+    def check(self, token: str) -> dict | None:
+        """
+        Проверяет токен
+
+        Returns:
+            (dict | None): данные пользователя или None, если токен недействителен
+        """
+        try:
+            session_id, expires, signature = token.split(".")
+            if int(expires) < time.time():
+                return None
+        except (AttributeError, ValueError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(f"{session_id}.{expires}")):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or session[0] < time.time():
+            return None
+        return session[1]
+
+    def revoke(self, token: str) -> bool:
+        """
+        Отзывает токен
+
+        Returns:
+            (bool): True, если сессия была активна
+        """
+        if self.check(token) is None:
+            return False
+        with self._lock:
+            return self._sessions.pop(token.split(".")[0], None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def create_token_store() -> TokenStore:
+    """
+    Функция создаёт хранилище сессий по конфигу (auth.sessions).
+    Если секрет не задан, он генерируется при запуске: токены действуют до перезапуска процесса
+    """
+    secret = utils.prop('auth.sessions.secret', '', utils.config)
+    return TokenStore(
+        secret=secret.encode("utf-8") if secret else secrets.token_bytes(32),
+        ttl_seconds=float(utils.prop('auth.sessions.ttlMinutes', 720, utils.config)) * 60,
+        max_tokens=int(utils.prop('auth.sessions.maxTokens', 10000, utils.config)),
+    )
+
+
+def get_token_store() -> TokenStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_token_store()
+    return _store
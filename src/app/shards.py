@@ -0,0 +1,231 @@
+# Секционированное хранение activity: отдельный файл SQLite на каждый месяц.
+# Новые activity пишутся в шард текущего месяца, прошлые шарды открываются только на чтение
+# и могут копироваться или удаляться целиком. Основная БД хранит справочники и данные,
+# записанные до включения секционирования.
+import datetime
+import os
+import re
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+# Таблицы, которые хранятся в шардах
+shard_tables = ("cv_activity", "cv_activity_mat")
+# id в шарде = YYYYMM * id_multiplier + порядковый номер, поэтому id уникальны во всех шардах
+id_multiplier: int = 1_000_000_000
+
+_shard_file_re = re.compile(r"^activity_(\d{4})_(\d{2})\.db$")
+_engines: dict[tuple[str, bool], Engine] = {}
+_lock = threading.Lock()
+
+
+def partitioning_enabled() -> bool:
+    return utils.prop('db.partitioning', 'none', utils.config) == 'monthly'
+
+
+def check_partitioning() -> None:
+    """
+    Функция проверяет, что секционирование не выключено при существующих шардах.
+    Выключать его нельзя: шарды перестают читаться, а id новых записей основной БД меньше id шардов,
+    и клиенты, запрашивающие новые записи по since_id, их бы не получили
+
+    Raises:
+        RuntimeError: секционирование выключено, а шарды есть
+    """
+    if partitioning_enabled():
+        return
+    keys = list_shard_keys()
+    if keys:
+        raise RuntimeError(
+            f"db.partitioning can not be switched off while shards exist in {shards_folder()} "
+            f"({keys[0]} .. {keys[-1]})"
+        )
+
+
+def shards_folder() -> str:
+    return utils.prop('db.shardsFolder', 'db/shards', utils.config)
+
+
+def shard_key(moment: datetime.datetime | str) -> str:
+    """
+    Функция возвращает ключ шарда (YYYY_MM) для момента времени или строки ISO
+    """
+    if isinstance(moment, str):
+        return f"{moment[:4]}_{moment[5:7]}"
+    return moment.strftime("%Y_%m")
+
+
+def shard_path(key: str) -> str:
+    return os.path.join(shards_folder(), f"activity_{key}.db")
+
+
+def id_base(key: str) -> int:
+    """
+    Функция возвращает значение, от которого отсчитываются id activity и материалов в шарде
+    """
+    return int(key.replace("_", "")) * id_multiplier
+
+
+def shard_key_for_id(entity_id: int) -> str | None:
+    """
+    Функция возвращает ключ шарда по id activity или None, если запись хранится в основной БД
+    """
+    if entity_id < id_multiplier:
+        return None
+    year_month = str(entity_id // id_multiplier)
+    return f"{year_month[:4]}_{year_month[4:6]}"
+
+
+def list_shard_keys(date_from: str = None, date_to: str = None) -> list[str]:
+    """
+    Функция возвращает ключи существующих шардов, пересекающихся с периодом, по возрастанию
+
+    Args:
+        date_from (str, optional): начало периода (ISO, включительно)
+        date_to (str, optional): конец периода (ISO, не включительно)
+    """
+    folder = shards_folder()
+    if not os.path.isdir(folder):
+        return []
+    keys = []
+    for filename in os.listdir(folder):
+        match = _shard_file_re.match(filename)
+        if match is None:
+            continue
+        key = f"{match.group(1)}_{match.group(2)}"
+        if date_from and key < shard_key(date_from):
+            continue
+        if date_to and key > shard_key(date_to):
+            continue
+        keys.append(key)
+    return sorted(keys)
+
+
+def copy_json_dictionaries(engine: Engine) -> None:
+    """
+    Функция копирует в шард словари сжатия result_json (cv_json_dict) из основной БД:
+    сжатые result_json шарда, в том числе перенесённого в архив, читаются без основной БД
+    """
+    with utils.engine.connect() as connection:
+        dictionaries = [dict(row._mapping) for row in connection.execute(
+            text("select id, data, created from cv_json_dict")
+        )]
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "create table if not exists cv_json_dict (id integer not null primary key, data blob not null, created text)"
+        )
+        if dictionaries:
+            connection.execute(
+                text("insert or ignore into cv_json_dict (id, data, created) values (:id, :data, :created)"),
+                dictionaries
+            )
+
+
+def _create_shard(key: str) -> None:
+    """
+    Функция создаёт файл шарда со схемой таблиц activity из основной БД (таблицы и индексы)
+    """
+    os.makedirs(shards_folder(), exist_ok=True)
+    with utils.engine.connect() as connection:
+        ddl = [row[0] for row in connection.execute(
+            text("""
+                select sql
+                from sqlite_master
+                where sql is not null and tbl_name in ('cv_activity', 'cv_activity_mat')
+                order by case type when 'table' then 0 else 1 end
+            """)
+        )]
+    engine = create_engine(f'sqlite:///{shard_path(key)}')
+    with engine.begin() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        for sql in ddl:
+            connection.exec_driver_sql(sql)
+    copy_json_dictionaries(engine)
+    engine.dispose()
+    logger.info("Shard %s created", key)
+
+
+def get_shard_engine(key: str, read_only: bool = None, create: bool = False) -> Engine | None:
+    """
+    Функция возвращает (и кэширует) подключение к шарду.
+    По умолчанию на запись открывается только шард текущего месяца
+
+    Args:
+        key (str): ключ шарда
+        read_only (bool, optional): открыть только на чтение
+        create (bool, optional): создать шард, если его нет
+
+    Returns:
+        (Engine | None): подключение или None, если шарда нет
+    """
+    if read_only is None:
+        read_only = key != shard_key(datetime.datetime.now())
+    with _lock:
+        engine = _engines.get((key, read_only))
+        if engine is not None:
+            return engine
+        path = shard_path(key)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            _create_shard(key)
+        if read_only:
+            engine = create_engine(f'sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true')
+        else:
+            engine = create_engine(f'sqlite:///{path}')
+        _engines[(key, read_only)] = engine
+        return engine
+
+
+def write_session(moment: datetime.datetime):
+    """
+    Функция возвращает сессию записи в шард месяца `moment` (шард создаётся при необходимости)
+    """
+    engine = get_shard_engine(shard_key(moment), read_only=False, create=True)
+    return sessionmaker(bind=engine)()
+
+
+def read_engines(date_from: str = None, date_to: str = None, since_id: int = None) -> list[Engine]:
+    """
+    Функция возвращает подключения, по которым нужно выполнить чтение за период:
+    основная БД и, в режиме секционирования, только шарды, пересекающиеся с периодом.
+    При заданном `since_id` пропускаются БД, в которых нет записей с большим id
+    """
+    engines = []
+    if since_id is None or since_id < id_multiplier:
+        engines.append(utils.engine)
+    if partitioning_enabled():
+        engines.extend(
+            get_shard_engine(key) for key in list_shard_keys(date_from, date_to)
+            if since_id is None or id_base(key) + id_multiplier > since_id
+        )
+    return [engine for engine in engines if engine is not None]
+
+
+def engine_for_id(entity_id: int) -> Engine | None:
+    """
+    Функция возвращает подключение к БД, в которой хранится activity с заданным id
+    """
+    key = shard_key_for_id(entity_id)
+    if key is None:
+        return utils.engine
+    return get_shard_engine(key)
+
+
+def release_shard(key: str) -> None:
+    """
+    Функция закрывает подключения к шарду, чтобы файл можно было перенести или удалить
+    """
+    with _lock:
+        for read_only in (True, False):
+            engine = _engines.pop((key, read_only), None)
+            if engine is not None:
+                engine.dispose()
@@ -0,0 +1,132 @@
+# Спул частично принятых изображений для возобновляемой загрузки через /ws/save_result.
+# Каждая загрузка - пара файлов в каталоге спула: <upload_id>.json (результат) и <upload_id>.part (байты).
+import asyncio
+import os
+import time
+import uuid
+
+import src.app.serialization as serialization
+import src.app.utils as utils
+
+import logging
+
+logger = logging.getLogger("app_logger")
+
+_gc_task: asyncio.Task | None = None
+
+
+def spool_folder() -> str:
+    return utils.prop('ingest.spoolFolder', 'spool', utils.config)
+
+
+def _paths(upload_id: str) -> tuple[str, str]:
+    # upload_id приходит от клиента: допускаем только формат uuid, чтобы исключить выход за пределы каталога
+    upload_id = str(uuid.UUID(upload_id))
+    folder = spool_folder()
+    return os.path.join(folder, f"{upload_id}.json"), os.path.join(folder, f"{upload_id}.part")
+
+
+def create_upload(json_result: dict) -> str:
+    """
+    Функция регистрирует новую загрузку и возвращает её id
+
+    Args:
+        json_result (dict): результат, к которому относится изображение
+
+    Returns:
+        (str): id загрузки
+    """
+    upload_id = str(uuid.uuid4())
+    os.makedirs(spool_folder(), exist_ok=True)
+    header_path, part_path = _paths(upload_id)
+    with open(header_path, "w", encoding="utf-8") as f:
+        f.write(serialization.dumps(json_result))
+    open(part_path, "wb").close()
+    return upload_id
+
+
+def get_upload(upload_id: str) -> tuple[dict, int] | None:
+    """
+    Функция возвращает результат и число уже принятых байтов загрузки или None, если загрузки нет
+    """
+    try:
+        header_path, part_path = _paths(upload_id)
+        with open(header_path, "r", encoding="utf-8") as f:
+            json_result = serialization.loads(f.read())
+        return json_result, os.path.getsize(part_path)
+    except (ValueError, OSError):
+        return None
+
+
+def append(upload_id: str, data: bytes) -> int:
+    """
+    Функция дописывает очередную часть изображения на диск
+
+    Returns:
+        (int): число принятых байтов после записи
+    """
+    _, part_path = _paths(upload_id)
+    with open(part_path, "ab") as f:
+        f.write(data)
+        return f.tell()
+
+
+def read_data(upload_id: str) -> bytes:
+    _, part_path = _paths(upload_id)
+    with open(part_path, "rb") as f:
+        return f.read()
+
+
+def discard(upload_id: str) -> None:
+    for path in _paths(upload_id):
+        utils.delete_file(path)
+
+
+def collect_garbage(ttl_seconds: float) -> int:
+    """
+    Функция удаляет незавершённые загрузки, не изменявшиеся дольше `ttl_seconds`
+
+    Returns:
+        (int): количество удалённых загрузок
+    """
+    folder = spool_folder()
+    if not os.path.isdir(folder):
+        return 0
+    removed = 0
+    deadline = time.time() - ttl_seconds
+    for filename in os.listdir(folder):
+        if not filename.endswith(".json"):
+            continue
+        upload_id = filename[:-len(".json")]
+        try:
+            header_path, part_path = _paths(upload_id)
+            last_change = max(os.path.getmtime(header_path),
+                              os.path.getmtime(part_path) if os.path.exists(part_path) else 0)
+        except (ValueError, OSError):
+            continue
+        if last_change < deadline:
+            discard(upload_id)
+            removed += 1
+    if removed:
+        logger.info("Upload spool: %d stale uploads removed", removed)
+    return removed
+
+
+async def _gc_loop(ttl_seconds: float) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(collect_garbage, ttl_seconds)
+        except Exception as e:
+            logger.error(f"Upload spool cleanup error: {str(e)}")
+        await asyncio.sleep(max(ttl_seconds / 4, 1))
+
+
+async def start_spool_gc() -> None:
+    """
+    Запускает периодическое удаление устаревших незавершённых загрузок
+    """
+    global _gc_task
+    if _gc_task is not None:
+        return
+    ttl_seconds = float(utils.prop('ingest.spoolTtlMinutes', 60, utils.config)) * 60
+    _gc_task = asyncio.create_task(_gc_loop(ttl_seconds))
@@ -5,14 +5,26 @@ from datetime import datetime
 from typing import Any
 
 import threading
+import time
 import yaml
 
 import datetime
 import json
 
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 
+import src.app.activity_feed as activity_feed
+import src.app.data_version as data_version
+import src.app.idempotency as idempotency
+import src.app.image_storage as image_storage
+import src.app.json_compression as json_compression
+import src.app.latency_stats as latency_stats
+import src.app.queries as queries
+import src.app.serialization as serialization
+import src.app.shards as shards
+
 import logging
 
 logger = logging.getLogger("app_logger")
@@ -200,103 +212,300 @@ def get_message_id() -> str:
         return ''
 
 
-def save_result(file_content, json_result, message_id):
-    print(json_result)
+def parse_coords(coords: Any) -> list[float] | None:
+    """
+    Функция разбирает координаты рамки материала в список из четырёх чисел.
+    Клиенты присылают координаты строкой вида "[x1, y1, x2, y2]" либо списком.
+
+    Args:
+        coords (Any): координаты в формате клиента
+
+    Returns:
+        (list[float] | None): координаты или None, если разобрать не удалось
+    """
     try:
-        # scrs_timestamp = json_result.get("image_file", {}).get("timestamp")
-        scrs_timestamp = datetime.datetime.now().isoformat()
-        scrs_path = json_result.get("image_file", {}).get("name")
-        scrs_name = os.path.split(scrs_path)[-1]
-        print(scrs_name)
-        is_complete = json_result.get("isComplete")
-        result_conf = json_result.get("confidence")
-        _result_json = json.dumps(json_result)
-        speed_ms = json_result.get("speedMs")
-        materials = json.loads(json_result.get("materials"))
-        username = json_result.get("username")
+        if isinstance(coords, str):
+            coords = coords.strip(" []()").split(",")
+        values = [float(c) for c in coords]
+    except (TypeError, ValueError):
+        return None
+    if len(values) != 4:
+        return None
+    return values
+
+
+def date_range_condition(date_from: str = None, date_to: str = None,
+                         column: str = "scrs_timestamp") -> tuple[str, dict]:
+    """
+    Функция формирует условие where для отбора записей за период
 
-        with Session() as session:
-            sql = text("select ifnull(max(id), 0) + 1 from cv_activity")
-            print(sql)
-            act_id = list(session.execute(sql))[0][0]
-
-            # Формируем команду для создания activity
-            sql = text("""
-                insert into cv_activity (
-                    id, 
-                    class_id, 
-                    scrs_timestamp,
-                    scrs_path, 
-                    is_complete, 
-                    result_conf, 
-                    result_json, 
-                    speed_ms,
-                    username
-                )
-                values (
-                    :id,
-                    0,
-                    :scrs_timestamp,
-                    :scrs_path, 
-                    :is_complete, 
-                    :result_conf, 
-                    :result_json, 
-                    :speed_ms,
-                    :username
-                )
-            """)
-            print(sql)
-            sql_result = session.execute(
-                sql,
-                {
-                    "id": act_id,
-                    "scrs_timestamp": scrs_timestamp,
-                    "scrs_path": scrs_name,
-                    "is_complete": is_complete,
-                    "result_conf": result_conf,
-                    "result_json": _result_json,
-                    "speed_ms": speed_ms,
-                    "username": username
-                }
-            )
-            print(sql_result)
+    Args:
+        date_from (str, optional): начало периода (ISO, включительно)
+        date_to (str, optional): конец периода (ISO, не включительно)
+        column (str, optional): колонка времени
 
-            for m in materials:
-                # Формируем команду для создания activity_mat
-                sql = text("""
-                    insert into cv_activity_mat (
-                        id, 
-                        act_id,
-                        mat_class_id, 
-                        coords,
-                        conf
-                    )
-                    values (
-                        (select ifnull(max(id), 0) + 1 from cv_activity_mat),
-                        :act_id,
-                        :mat_class_id, 
-                        :coords,
-                        :conf
-                    )
-                """)
-                print(sql)
-                sql_result = session.execute(
-                    sql,
-                    {
-                        "act_id": act_id,
-                        "mat_class_id": m.get("mlCode"),
-                        "coords": str(m.get("coords")),
-                        "conf": m.get("conf")
-                    }
-                )
-                print(sql_result)
+    Returns:
+        (tuple[str, dict]): условие (пустая строка, если период не задан) и параметры запроса
+    """
+    conditions = []
+    params = {}
+    if date_from:
+        conditions.append(f"{column} >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append(f"{column} < :date_to")
+        params["date_to"] = date_to
+    if not conditions:
+        return "", params
+    return "where " + " and ".join(conditions), params
+
+
+def _content_size(file_content) -> int | None:
+    # Размер изображения: bytes или файловый объект с произвольным доступом
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        return len(file_content)
+    try:
+        position = file_content.tell()
+        size = file_content.seek(0, os.SEEK_END) - position
+        file_content.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
 
-            session.commit()
 
-        # сохраняем файл
-        file_path = os.path.join(g_runs, scrs_name)
-        file_creation_result = create_file(file_content, file_path)
-        return {"ok": True, "file_name": file_creation_result}
+def _prepare_activity(json_result: dict, scrs_moment: datetime.datetime, image_info: dict = None) -> dict:
+    """
+    Функция разбирает результат клиента в поля cv_activity и список материалов
+
+    Args:
+        json_result (dict): результат клиента
+        scrs_moment (datetime.datetime): время приёма результата
+        image_info (dict, optional): сведения о перекодировании изображения
+            (original_size, size, ext - см. image_transform.transform_image)
+
+    Returns:
+        (dict): поля activity
+    """
+    # scrs_timestamp = json_result.get("image_file", {}).get("timestamp")
+    scrs_path = json_result.get("image_file", {}).get("name")
+    scrs_name = os.path.split(scrs_path)[-1]
+    image_info = image_info or {}
+    if image_info.get("ext"):
+        # Изображение перекодировано - расширение файла соответствует новому формату
+        scrs_name = os.path.splitext(scrs_name)[0] + image_info["ext"]
+    print(scrs_name)
+    _result_json = serialization.dumps(json_result)
+    _result_json_z, _result_json_dict = None, None
+    if prop('db.compressResultJson', False, config):
+        _result_json_z, _result_json_dict = json_compression.compress_json(_result_json)
+        _result_json = None
+    return {
+        "scrs_moment": scrs_moment,
+        "scrs_timestamp": scrs_moment.isoformat(),
+        "scrs_name": scrs_name,
+        "is_complete": json_result.get("isComplete"),
+        "result_conf": json_result.get("confidence"),
+        "result_json": _result_json,
+        "result_json_z": _result_json_z,
+        "result_json_dict": _result_json_dict,
+        "speed_ms": json_result.get("speedMs"),
+        "materials": serialization.loads(json_result.get("materials")),
+        "username": json_result.get("username"),
+        "image_size_orig": image_info.get("original_size"),
+        "image_size": image_info.get("size"),
+        "idempotency_key": idempotency.get_key(json_result),
+    }
+
+
+def _activity_session(scrs_moment: datetime.datetime) -> tuple[Any, int]:
+    """
+    Функция возвращает фабрику сессий для записи activity и значение, от которого отсчитываются id.
+    В режиме секционирования activity пишется в шард месяца `scrs_moment`
+    """
+    if shards.partitioning_enabled():
+        return (lambda: shards.write_session(scrs_moment)), shards.id_base(shards.shard_key(scrs_moment))
+    return Session, 0
+
+
+def _insert_activity(session, activity: dict, id_base: int) -> int:
+    """
+    Функция добавляет activity и её материалы в рамках текущей транзакции `session`
+
+    Returns:
+        (int): id activity
+    """
+    sql = text("select ifnull(max(id), :id_base) + 1 from cv_activity")
+    print(sql)
+    act_id = list(session.execute(sql, {"id_base": id_base}))[0][0]
+
+    # Формируем команду для создания activity
+    sql = text("""
+        insert into cv_activity (
+            id, 
+            class_id, 
+            scrs_timestamp,
+            scrs_path, 
+            is_complete, 
+            result_conf, 
+            result_json, 
+            result_json_z,
+            result_json_dict,
+            speed_ms,
+            username,
+            image_size_orig,
+            image_size,
+            idempotency_key
+        )
+        values (
+            :id,
+            0,
+            :scrs_timestamp,
+            :scrs_path, 
+            :is_complete, 
+            :result_conf, 
+            :result_json, 
+            :result_json_z,
+            :result_json_dict,
+            :speed_ms,
+            :username,
+            :image_size_orig,
+            :image_size,
+            :idempotency_key
+        )
+    """)
+    print(sql)
+    sql_result = session.execute(
+        sql,
+        {
+            "id": act_id,
+            "scrs_timestamp": activity["scrs_timestamp"],
+            "scrs_path": activity["scrs_name"],
+            "is_complete": activity["is_complete"],
+            "result_conf": activity["result_conf"],
+            "result_json": activity["result_json"],
+            "result_json_z": activity["result_json_z"],
+            "result_json_dict": activity["result_json_dict"],
+            "speed_ms": activity["speed_ms"],
+            "username": activity["username"],
+            "image_size_orig": activity["image_size_orig"],
+            "image_size": activity["image_size"],
+            "idempotency_key": activity["idempotency_key"]
+        }
+    )
+    print(sql_result)
+
+    for m in activity["materials"]:
+        # Формируем команду для создания activity_mat
+        sql = text("""
+            insert into cv_activity_mat (
+                id, 
+                act_id,
+                mat_class_id, 
+                coords,
+                x1,
+                y1,
+                x2,
+                y2,
+                conf
+            )
+            values (
+                (select ifnull(max(id), :id_base) + 1 from cv_activity_mat),
+                :act_id,
+                :mat_class_id, 
+                :coords,
+                :x1,
+                :y1,
+                :x2,
+                :y2,
+                :conf
+            )
+        """)
+        print(sql)
+        x1, y1, x2, y2 = parse_coords(m.get("coords")) or (None, None, None, None)
+        sql_result = session.execute(
+            sql,
+            {
+                "id_base": id_base,
+                "act_id": act_id,
+                "mat_class_id": m.get("mlCode"),
+                "coords": str(m.get("coords")),
+                "x1": x1,
+                "y1": y1,
+                "x2": x2,
+                "y2": y2,
+                "conf": m.get("conf")
+            }
+        )
+        print(sql_result)
+    return act_id
+
+
+def _feed_row(activity: dict, act_id: int) -> dict:
+    # Запись ленты activity (поля /get_results без result_json)
+    return {
+        "id": act_id,
+        "class_id": 0,
+        "scrs_timestamp": activity["scrs_timestamp"],
+        "scrs_path": activity["scrs_name"],
+        "is_complete": activity["is_complete"],
+        "result_conf": activity["result_conf"],
+        "speed_ms": activity["speed_ms"],
+        "username": activity["username"],
+    }
+
+
+def save_result(file_content, json_result, message_id, image_info: dict = None, started: float = None):
+    """
+    Функция сохраняет результат клиента и изображение
+
+    Args:
+        file_content: изображение (bytes или файловый объект)
+        json_result (dict): результат клиента
+        message_id (str): id сообщения
+        image_info (dict, optional): сведения о перекодировании изображения
+        started (float, optional): момент начала обработки (time.perf_counter) для учёта времени приёма
+    """
+    if started is None:
+        started = time.perf_counter()
+    print(json_result)
+    # Повторная отправка уже сохранённого результата: возвращаем исходный ответ
+    replay = idempotency.find(idempotency.get_key(json_result))
+    if replay is not None:
+        return replay
+    try:
+        if image_info is None:
+            size = _content_size(file_content)
+            image_info = {"original_size": size, "size": size}
+        activity = _prepare_activity(json_result, datetime.datetime.now(), image_info)
+        session_factory, id_base = _activity_session(activity["scrs_moment"])
+
+        with session_factory() as session:
+            act_id = _insert_activity(session, activity, id_base)
+            session.commit()
+        data_version.mark_changed()
+        activity_feed.publish([_feed_row(activity, act_id)])
+
+        # сохраняем файл (локально или в объектное хранилище, см. images.storage)
+        try:
+            location = image_storage.get_image_storage().save(activity["scrs_name"], file_content)
+            file_creation_result = result_ok({"filename": location})
+        except Exception as e:
+            file_creation_result = result_error(error=str(e))
+        result = {"ok": True, "file_name": file_creation_result}
+        if activity["idempotency_key"] is not None:
+            idempotency.remember(activity["idempotency_key"], result)
+        latency_stats.record(activity["scrs_timestamp"], activity["username"], activity["speed_ms"],
+                             (time.perf_counter() - started) * 1000)
+        return result
+
+    except IntegrityError as e:
+        # Результат с тем же ключом идемпотентности сохранён параллельным запросом
+        replay = idempotency.find(idempotency.get_key(json_result))
+        if replay is not None:
+            return replay
+        logger.debug(f'Error: {e}')
+        print(f'Error: {e}')
+        return {"ok": False}
 
     except Exception as e:
         logger.debug(f'Error: {e}')
@@ -304,84 +513,173 @@ def save_result(file_content, json_result, message_id):
         return {"ok": False}
 
 
+def save_results_bulk(items: list, message_id) -> list[dict]:
+    """
+    Функция сохраняет пакет результатов: изображения записываются в хранилище,
+    все activity пакета - одной транзакцией. При ошибке транзакции записанные изображения удаляются.
+
+    Args:
+        items (list): тройки (изображение - bytes или файловый объект, результат клиента - dict,
+            сведения о перекодировании изображения - dict или None)
+        message_id (str): id сообщения
+
+    Returns:
+        (list[dict]): результаты по каждому элементу в формате ответа save_result
+    """
+    started = time.perf_counter()
+    storage = image_storage.get_image_storage()
+    # Все activity пакета попадают в один шард, поэтому время приёма у пакета общее
+    scrs_moment = datetime.datetime.now()
+    results: list[dict] = [{"ok": False} for _ in items]
+    prepared: list[tuple[int, dict]] = []
+
+    # Повторы: ключ уже сохранён ранее или встречается в пакете повторно
+    replays: dict[int, int] = {}
+    batch_keys: dict[str, int] = {}
+
+    for index, (file_content, json_result, image_info) in enumerate(items):
+        key = idempotency.get_key(json_result)
+        if key is not None:
+            replay = idempotency.find(key)
+            if replay is not None:
+                results[index] = replay
+                continue
+            if key in batch_keys:
+                replays[index] = batch_keys[key]
+                continue
+            batch_keys[key] = index
+        try:
+            if image_info is None:
+                size = _content_size(file_content)
+                image_info = {"original_size": size, "size": size}
+            activity = _prepare_activity(json_result, scrs_moment, image_info)
+            location = storage.save(activity["scrs_name"], file_content)
+            results[index] = {"ok": True, "file_name": result_ok({"filename": location})}
+            prepared.append((index, activity))
+        except Exception as e:
+            logger.debug(f'Error: {e}')
+            results[index] = {"ok": False, "error": str(e)}
+
+    if not prepared:
+        return results
+
+    try:
+        session_factory, id_base = _activity_session(scrs_moment)
+        with session_factory() as session:
+            feed_rows = [_feed_row(activity, _insert_activity(session, activity, id_base)) for _, activity in prepared]
+            session.commit()
+        data_version.mark_changed()
+        activity_feed.publish(feed_rows)
+    except Exception as e:
+        logger.debug(f'Error: {e}')
+        for index, activity in prepared:
+            try:
+                storage.delete(activity["scrs_name"])
+            except Exception as delete_error:
+                logger.warning(f'save_results_bulk: {delete_error}')
+            results[index] = {"ok": False, "error": str(e)}
+    else:
+        # Время приёма пакета распределяется поровну между его результатами
+        ingest_ms = (time.perf_counter() - started) * 1000 / len(prepared)
+        for index, activity in prepared:
+            if activity["idempotency_key"] is not None:
+                idempotency.remember(activity["idempotency_key"], results[index])
+            latency_stats.record(activity["scrs_timestamp"], activity["username"], activity["speed_ms"], ingest_ms)
+    for index, original_index in replays.items():
+        results[index] = results[original_index]
+    return results
+
+
 def create_user(json_result, message_id):
     print(json_result)
-    try:
-        user_name = json_result.get("username")
-        user_email = json_result.get("useremail")
-        user_password = json_result.get("userpassword")
+    return create_users_bulk([json_result], message_id)[0]
 
-        with Session() as session:
-            ##########################################################
-            # Проверка на дубликаты
-            sql = text("select id from cv_user where name = :name")
 
-            print(sql)
-            sql_result = session.execute(
-                sql,
-                {
-                    "name": user_name
-                }
-            )
-            sql_result_list = list(sql_result)
-            if len(sql_result_list) > 0:
-                print(f'Error: Пользователь с таким именем уже существует')
-                return result_error(error="Пользователь с таким именем уже существует", error_code=-501)
+def _existing_values(session, column: str, values: set) -> set:
+    """
+    Функция возвращает значения `column` таблицы cv_user, которые уже заняты (проверка пачками)
+    """
+    existing = set()
+    values = list(values)
+    # Ограничение SQLite на число параметров запроса
+    for i in range(0, len(values), 500):
+        sql = queries.existing_values_sql(column)
+        existing.update(row[0] for row in session.execute(sql, {"values": values[i:i + 500]}))
+    return existing
 
-            sql = text("select id from cv_user where email = :email")
 
-            print(sql)
-            sql_result = session.execute(
-                sql,
-                {
-                    "email": user_email
-                }
-            )
-            sql_result_list = list(sql_result)
-            if len(sql_result_list) > 0:
-                print(f'Error: Пользователь с таким e-mail уже существует')
-                return result_error(error="Пользователь с таким e-mail уже существует", error_code=-502)
+def create_users_bulk(users: list[dict], message_id) -> list[dict]:
+    """
+    Функция создаёт пользователей пачкой в одной транзакции.
+    Уникальность имени и e-mail проверяется сразу для всей пачки (внутри пачки и по таблице)
 
-            ##########################################################
+    Args:
+        users (list[dict]): пользователи (username, useremail, userpassword)
+        message_id: id сообщения
 
-            sql = text("select ifnull(max(id), 0) + 1 from cv_user")
-            print(sql)
-            user_id = list(session.execute(sql))[0][0]
-
-            # Формируем команду для создания user
-            sql = text("""
-                insert into cv_user (
-                    id, 
-                    name,
-                    email,
-                    password
-                )
-                values (
-                    :id,
-                    :user_name,
-                    :user_email,
-                    :user_password
-                )
-            """)
-            print(sql)
-            sql_result = session.execute(
-                sql,
-                {
-                    "id": user_id,
+    Returns:
+        (list[dict]): результат для каждого пользователя в порядке `users`
+            (как у create_user: ok, либо ошибка -501/-502/-500)
+    """
+    try:
+        results: list[dict | None] = [None] * len(users)
+        with Session() as session:
+            ##########################################################
+            # Проверка на дубликаты
+            taken_names = _existing_values(session, "name", {user.get("username") for user in users})
+            taken_emails = _existing_values(session, "email", {user.get("useremail") for user in users})
+
+            rows = list()
+            for i, user in enumerate(users):
+                user_name = user.get("username")
+                user_email = user.get("useremail")
+                if user_name in taken_names:
+                    results[i] = result_error(error="Пользователь с таким именем уже существует", error_code=-501)
+                    continue
+                if user_email in taken_emails:
+                    results[i] = result_error(error="Пользователь с таким e-mail уже существует", error_code=-502)
+                    continue
+                taken_names.add(user_name)
+                taken_emails.add(user_email)
+                rows.append((i, {
                     "user_name": user_name,
                     "user_email": user_email,
-                    "user_password": user_password
-                }
-            )
-            print(sql_result)
+                    "user_password": user.get("userpassword")
+                }))
 
-            session.commit()
-        return result_ok(data={})
+            ##########################################################
+
+            if rows:
+                sql = text("select ifnull(max(id), 0) + 1 from cv_user")
+                user_id = list(session.execute(sql))[0][0]
+                for offset, (_, row) in enumerate(rows):
+                    row["id"] = user_id + offset
+
+                # Формируем команду для создания user
+                sql = text("""
+                    insert into cv_user (
+                        id, 
+                        name,
+                        email,
+                        password
+                    )
+                    values (
+                        :id,
+                        :user_name,
+                        :user_email,
+                        :user_password
+                    )
+                """)
+                session.execute(sql, [row for _, row in rows])
+                session.commit()
+                for i, _ in rows:
+                    results[i] = result_ok(data={})
+        return results
 
     except Exception as e:
         logger.debug(f'Error: {e}')
         print(f'Error: {e}')
-        return result_error(error=str(e), error_code=-500)
+        return [result_error(error=str(e), error_code=-500) for _ in users]
 
 
 def verify_user(json_result):
@@ -392,7 +690,7 @@ def verify_user(json_result):
 
         with Session() as session:
             ##########################################################
-            sql = text("select id, name, email from cv_user where (name = :data or email = :data) and password = :password")
+            sql = queries.verify_user_sql
 
             print(sql)
             sql_result = session.execute(
@@ -1,21 +1,43 @@
-import json
+import asyncio
 
 from io import BytesIO
+import time
 import uuid
 
 from dependency_injector.wiring import inject, Provide
 
 from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Form
-from fastapi.security import HTTPBasicCredentials
-from fastapi.responses import JSONResponse
-from starlette.websockets import WebSocket, WebSocketDisconnect
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasicCredentials, HTTPBearer
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
 
-from src.app.security import authenticate_user_over_ws, authenticate_user_over_http
+from src.app.security import authenticate_admin_over_http, authenticate_user_over_ws, authenticate_user_over_http
 
 from sqlalchemy import create_engine, text, event
 from sqlalchemy.orm import sessionmaker
 
+import src.app.activity_feed as activity_feed
+import src.app.data_version as data_version
+import src.app.export as export
+import src.app.idempotency as idempotency
+import src.app.image_transform as image_transform
+import src.app.latency_stats as latency_stats
+import src.app.loop_monitor as loop_monitor
+import src.app.profiler as profiler
+import src.app.queries as queries
+import src.app.rate_limit as rate_limit
+import src.app.reference_cache as reference_cache
+import src.app.serialization as serialization
+import src.app.session_tokens as session_tokens
+import src.app.shards as shards
+import src.app.upload_spool as upload_spool
 import src.app.utils as utils
+from src.app.detection_stats import get_detection_stats
+from src.app.json_compression import read_result_json
+from src.app.mux_session import MuxLimitError, MuxSession
+from src.app.serialization import FastJSONResponse
 
 import logging
 
@@ -30,7 +52,7 @@ response_on_auth_failed: dict = {
     "error": 'Authentication failed. Incorrect username or password',
     "ok": False
 }
-response_on_auth_failed_text: str = json.dumps(response_on_auth_failed)
+response_on_auth_failed_text: str = serialization.dumps(response_on_auth_failed)
 
 # База данных
 database = utils.g_db_path  # "db/data.db"
@@ -43,22 +65,37 @@ Session = sessionmaker(bind=engine)
 @router.get("/health")
 @inject
 async def status():
-    content = {"data": {"message": "Detector Services Test"}, "errorCode": 0, "ok": True}
-    return JSONResponse(content=content)
+    # Готовность к приёму: при перегрузке цикла событий (health.loopLag) отвечаем 503
+    loop_status = loop_monitor.get_status()
+    content = {"data": {"message": "Detector Services Test", **loop_status}, "errorCode": 0, "ok": True}
+    status_code = 503 if loop_status["state"] == loop_monitor.STATE_OVERLOADED else 200
+    return FastJSONResponse(content=content, status_code=status_code)
+
+
+async def _drain_image(websocket: WebSocket) -> None:
+    """
+    Пропускает части изображения до признака конца файла
+    """
+    while True:
+        message = await websocket.receive_bytes()
+        if message == b'' or message == b"{'eof' : 1}":
+            return
 
 
 @router.websocket("/ws/save_result")
 @inject
 async def save_result(websocket: WebSocket):
-    await websocket.accept()
+    if not await rate_limit.accept_websocket(websocket):
+        return
 
     # Проверка реквизитов
     credentials: dict = await websocket.receive_json()
     await authenticate_user_over_ws(
         HTTPBasicCredentials(
-            username=credentials.get("username"),
-            password=credentials.get("password")
-        )
+            username=credentials.get("username") or "",
+            password=credentials.get("password") or ""
+        ),
+        token=credentials.get("token")
     )
 
     try:
@@ -67,19 +104,64 @@ async def save_result(websocket: WebSocket):
             res_json = {}
             try:
                 message = await websocket.receive_text()
-                res_json = json.loads(message)
+                res_json = serialization.loads(message)
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"Error on result receiving: {str(e)}")
 
+            # Ограничение частоты по пользователю результата и адресу клиента
+            try:
+                await rate_limit.get_rate_limiter().acquire(
+                    "/ws/save_result",
+                    rate_limit.client_address(websocket),
+                    res_json.get("username")
+                )
+            except rate_limit.RateLimitError as e:
+                logger.info(str(e))
+                # Клиент уже передаёт изображение (кроме возобновляемой загрузки, которая ждёт ответа):
+                # дочитываем его до конца, чтобы ответ и код закрытия дошли до клиента
+                if not (res_json.get("upload_id") or res_json.get("resumable")):
+                    await _drain_image(websocket)
+                await websocket.send_text(serialization.dumps(
+                    utils.result_error(data={"retry_after": e.retry_after}, error="Too many requests", error_code=-429)
+                ))
+                await websocket.close(code=1013, reason="Too many requests")
+                break
+
+            # Возобновляемая загрузка: клиент передаёт "resumable": true (новая загрузка)
+            # или "upload_id" (продолжение), получает id загрузки и число уже принятых байтов,
+            # после чего досылает изображение с этого смещения. Принятые части копятся в спуле
+            upload_id = None
+            if res_json.get("upload_id") or res_json.get("resumable"):
+                if res_json.get("upload_id"):
+                    upload = upload_spool.get_upload(res_json.get("upload_id"))
+                    if upload is None:
+                        await websocket.send_text(serialization.dumps(utils.result_error(error="Upload not found")))
+                        break
+                    upload_id = res_json.get("upload_id")
+                    res_json, offset = upload
+                else:
+                    upload_id = upload_spool.create_upload(res_json)
+                    offset = 0
+                await websocket.send_text(
+                    serialization.dumps(utils.result_ok({"upload_id": upload_id, "offset": offset}))
+                )
+
             # Принимаем файл по частям
             file_content = BytesIO()
+            is_eof = False
             while True:
                 try:
                     message = await websocket.receive_bytes()
                     if message == b'':
+                        is_eof = True
                         break
                     elif message == b"{'eof' : 1}":
+                        is_eof = True
                         break
+                    elif upload_id is not None:
+                        upload_spool.append(upload_id, message)
                     else:
                         file_content.write(message)
                 except WebSocketDisconnect:
@@ -88,34 +170,287 @@ async def save_result(websocket: WebSocket):
                     logger.error(f"Error on file receiving: {str(e)}")
                     break
 
+            if upload_id is not None:
+                if not is_eof:
+                    # Соединение оборвалось: принятая часть остаётся в спуле до повторного подключения
+                    logger.warning(f"Upload {upload_id} interrupted")
+                    break
+                file_bytes = upload_spool.read_data(upload_id)
+            else:
+                file_bytes = file_content.getvalue()
+
             # Id сообщения (контекст процесса)
             message_id = str(uuid.uuid4())
 
             # Отдаём данные на обработку
-            if len(file_content.getvalue()) > 0:
-                r = utils.save_result(file_content.getvalue(), res_json, message_id)
-                rt = json.dumps(r, ensure_ascii=False)
-                if websocket.client_state.CONNECTED:
+            if len(file_bytes) > 0:
+                # Повтор уже сохранённого результата не перекодируется и не записывается
+                r = idempotency.find(idempotency.get_key(res_json))
+                if r is None:
+                    started = time.perf_counter()
+                    file_bytes, image_info = await image_transform.transform_image(file_bytes)
+                    r = utils.save_result(file_bytes, res_json, message_id, image_info, started)
+                if upload_id is not None:
+                    # Ответ из find() может быть закэширован - дополняем копию
+                    r = {**r, "upload_id": upload_id}
+                    if r.get("ok"):
+                        upload_spool.discard(upload_id)
+                rt = serialization.dumps(r)
+                if websocket.client_state == WebSocketState.CONNECTED:
                     await websocket.send_text(rt)
 
-            if websocket.client_state.DISCONNECTED:
+            if websocket.client_state == WebSocketState.DISCONNECTED:
+                break
+    except WebSocketDisconnect as e:
+        logger.warning(f"Websocket disconnected: {str(e)}")
+
+
+@router.websocket("/ws/save_result_mux")
+@inject
+async def save_result_mux(websocket: WebSocket):
+    """
+    Мультиплексированный приём результатов: несколько изображений в одном соединении.
+    Текстовый кадр {"stream": id, "result": {...}} открывает поток, бинарные кадры
+    (4 байта id потока + данные) несут части изображения, кадр без данных завершает поток.
+    На каждый поток отправляется отдельный ответ {"stream": id, ...}
+    """
+    if not await rate_limit.accept_websocket(websocket):
+        return
+
+    # Проверка реквизитов
+    credentials: dict = await websocket.receive_json()
+    await authenticate_user_over_ws(
+        HTTPBasicCredentials(
+            username=credentials.get("username") or "",
+            password=credentials.get("password") or ""
+        ),
+        token=credentials.get("token")
+    )
+
+    session = MuxSession()
+
+    async def reply(stream_id, r: dict):
+        await websocket.send_text(serialization.dumps({"stream": stream_id, **r}))
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
                 break
+
+            # Заголовок потока
+            if message.get("text") is not None:
+                stream_id = None
+                try:
+                    header = serialization.loads(message["text"])
+                    stream_id = int(header["stream"])
+                    await rate_limit.get_rate_limiter().acquire(
+                        "/ws/save_result_mux",
+                        rate_limit.client_address(websocket),
+                        (header.get("result") or {}).get("username")
+                    )
+                    session.open(stream_id, header.get("result") or {})
+                except rate_limit.RateLimitError as e:
+                    logger.info(str(e))
+                    session.reject(stream_id)
+                    await reply(stream_id, utils.result_error(
+                        data={"retry_after": e.retry_after}, error="Too many requests", error_code=-429
+                    ))
+                except MuxLimitError as e:
+                    session.reject(stream_id)
+                    await reply(stream_id, utils.result_error(error=str(e), error_code=-413))
+                except Exception as e:
+                    logger.error(f"Error on stream header receiving: {str(e)}")
+                    if stream_id is not None:
+                        session.reject(stream_id)
+                    await reply(stream_id, utils.result_error(error=f"Invalid stream header: {e}"))
+                continue
+
+            # Часть изображения
+            frame = message.get("bytes") or b""
+            try:
+                stream_id = session.feed(frame)
+            except MuxLimitError as e:
+                await reply(MuxSession.stream_id_of(frame), utils.result_error(error=str(e), error_code=-413))
+                continue
+            except (KeyError, ValueError) as e:
+                await reply(MuxSession.stream_id_of(frame), utils.result_error(error=f"Unknown stream: {e}"))
+                continue
+            if stream_id is None:
+                continue
+
+            # Поток завершён - отдаём данные на обработку
+            json_result, file_bytes = session.finish(stream_id)
+            if len(file_bytes) == 0:
+                await reply(stream_id, utils.result_error(error="Empty image"))
+                continue
+            message_id = str(uuid.uuid4())
+            r = idempotency.find(idempotency.get_key(json_result))
+            if r is None:
+                started = time.perf_counter()
+                file_bytes, image_info = await image_transform.transform_image(file_bytes)
+                r = utils.save_result(file_bytes, json_result, message_id, image_info, started)
+            await reply(stream_id, r)
     except WebSocketDisconnect as e:
         logger.warning(f"Websocket disconnected: {str(e)}")
 
 
+@router.websocket("/ws/activity_feed")
+@inject
+async def activity_feed_ws(websocket: WebSocket):
+    """
+    Лента новых activity. Первое сообщение - реквизиты и необязательные параметры подписки:
+    {"username": ..., "password": ... | "token": ..., "filter": {"username": ..., "is_complete": ...},
+    "policy": "drop" | "coalesce"}.
+    Далее сервер присылает {"type": "activity", "data": {...}} по мере сохранения результатов
+    """
+    if not await rate_limit.accept_websocket(websocket):
+        return
+
+    # Проверка реквизитов
+    credentials: dict = await websocket.receive_json()
+    await authenticate_user_over_ws(
+        HTTPBasicCredentials(
+            username=credentials.get("username") or "",
+            password=credentials.get("password") or ""
+        ),
+        token=credentials.get("token")
+    )
+
+    feed_filter: dict = credentials.get("filter") or {}
+    try:
+        subscriber = activity_feed.Subscriber(
+            username=feed_filter.get("username"),
+            is_complete=feed_filter.get("is_complete"),
+            policy=credentials.get("policy", "drop")
+        )
+    except ValueError as e:
+        await websocket.send_text(serialization.dumps(utils.result_error(error=str(e))))
+        await websocket.close()
+        return
+    activity_feed.subscribe(subscriber)
+
+    async def watch_disconnect():
+        # Клиент ничего не присылает, ждём только закрытия соединения
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await websocket.send_text(serialization.dumps(utils.result_ok({"subscribed": True})))
+        while not watcher.done():
+            get_message = asyncio.create_task(subscriber.get())
+            await asyncio.wait((get_message, watcher), return_when=asyncio.FIRST_COMPLETED)
+            if not get_message.done():
+                get_message.cancel()
+                break
+            await websocket.send_text(get_message.result())
+    except (WebSocketDisconnect, RuntimeError) as e:
+        logger.warning(f"Websocket disconnected: {str(e)}")
+    finally:
+        activity_feed.unsubscribe(subscriber)
+        watcher.cancel()
+        if subscriber.dropped:
+            logger.info(f"Activity feed subscriber dropped {subscriber.dropped} messages")
+
+
+@router.post("/save_results_bulk", dependencies=[Depends(rate_limit.limit_http("/save_results_bulk"))])
+@inject
+async def save_results_bulk(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)
+):
+    """
+    Пакетный приём результатов (например, выгрузка накопленного офлайн).
+    multipart/form-data: пары полей result_<n> (JSON результата) и image_<n> (файл изображения).
+    Части формы сохраняются во временные файлы на диске, пакет записывается в БД одной транзакцией
+    """
+    max_items = int(utils.prop('ingest.bulk.maxItems', 1000, utils.config))
+    form = await request.form(max_files=max_items, max_fields=max_items)
+    try:
+        indexes = sorted(
+            int(key[len("result_"):]) for key in form.keys() if key.startswith("result_")
+        )
+        items = list()
+        errors = dict()
+        for index in indexes:
+            image = form.get(f"image_{index}")
+            if not isinstance(image, StarletteUploadFile):
+                errors[index] = {"ok": False, "error": f"image_{index} is missing"}
+                continue
+            try:
+                json_result = serialization.loads(form.get(f"result_{index}"))
+            except Exception as e:
+                errors[index] = {"ok": False, "error": f"result_{index}: {e}"}
+                continue
+            image.file.seek(0)
+            items.append((index, image.file, json_result, None))
+
+        # Перекодирование изображений (images.transform) - в пуле процессов, не больше частей одновременно,
+        # чем процессов в пуле. Результат записывается обратно во временный файл части,
+        # чтобы в памяти не копились изображения всего пакета
+        transform_config = image_transform.get_transform_config()
+        if transform_config is not None:
+            semaphore = asyncio.Semaphore(transform_config["workers"])
+
+            def rewrite(file, data: bytes) -> None:
+                file.seek(0)
+                file.truncate()
+                file.write(data)
+                file.seek(0)
+
+            async def transform(file) -> dict:
+                async with semaphore:
+                    data, image_info = await image_transform.transform_image(await asyncio.to_thread(file.read))
+                    await asyncio.to_thread(rewrite, file, data)
+                    return image_info
+
+            image_infos = await asyncio.gather(*(transform(file) for _, file, _, _ in items))
+            items = [(index, file, json_result, image_info)
+                     for (index, file, json_result, _), image_info in zip(items, image_infos)]
+
+        # Id сообщения (контекст процесса)
+        message_id = str(uuid.uuid4())
+
+        # Запись файлов и транзакция выполняются вне цикла событий
+        saved = await asyncio.to_thread(
+            utils.save_results_bulk, [item[1:] for item in items], message_id
+        )
+        results = dict(errors)
+        for (index, _, _, _), r in zip(items, saved):
+            results[index] = r
+        content = utils.result_ok({"results": [{"index": index, **results[index]} for index in indexes]})
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    finally:
+        await form.close()
+    return FastJSONResponse(content=content)
+
+
+@router.get("/upload_offset")
+@inject
+async def upload_offset(upload_id: str, credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)):
+    upload = upload_spool.get_upload(upload_id)
+    if upload is None:
+        return FastJSONResponse(content=utils.result_error(error="Upload not found"))
+    return FastJSONResponse(content=utils.result_ok({"upload_id": upload_id, "offset": upload[1]}))
+
+
 @router.websocket("/ws/create_user")
 @inject
 async def create_user(websocket: WebSocket):
-    await websocket.accept()
+    if not await rate_limit.accept_websocket(websocket):
+        return
 
     # Проверка реквизитов
     credentials: dict = await websocket.receive_json()
     await authenticate_user_over_ws(
         HTTPBasicCredentials(
-            username=credentials.get("username"),
-            password=credentials.get("password")
-        )
+            username=credentials.get("username") or "",
+            password=credentials.get("password") or ""
+        ),
+        token=credentials.get("token")
     )
 
     try:
@@ -124,7 +459,9 @@ async def create_user(websocket: WebSocket):
             res_json = {}
             try:
                 message = await websocket.receive_text()
-                res_json = json.loads(message)
+                res_json = serialization.loads(message)
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"Error on result receiving: {str(e)}")
 
@@ -134,58 +471,113 @@ async def create_user(websocket: WebSocket):
             # Отдаём данные на обработку
             if len(res_json) > 0:
                 r = utils.create_user(res_json, message_id)
-                rt = json.dumps(r, ensure_ascii=False)
-                if websocket.client_state.CONNECTED:
+                rt = serialization.dumps(r)
+                if websocket.client_state == WebSocketState.CONNECTED:
                     await websocket.send_text(rt)
 
-            if websocket.client_state.DISCONNECTED:
+            if websocket.client_state == WebSocketState.DISCONNECTED:
                 break
     except WebSocketDisconnect as e:
         logger.warning(f"Websocket disconnected: {str(e)}")
 
 
-@router.get("/get_results")
+@router.post("/create_users", dependencies=[Depends(rate_limit.limit_http("/create_users"))])
 @inject
-async def get_results(credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)):
+async def create_users(
+        request: Request,
+        credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)
+):
+    """
+    Пакетное создание пользователей. Тело запроса - JSON-список пользователей
+    (username, useremail, userpassword, как у /ws/create_user).
+    Возвращает результаты в порядке списка
+    """
     try:
-        with Session() as session:
-            # Получаем записи
-            sql = text("""
-                select id, 
-                    class_id, 
-                    scrs_timestamp,
-                    scrs_path, 
-                    is_complete, 
-                    result_conf, 
-                    result_json, 
-                    speed_ms 
-                from cv_activity
-            """)
-            sql_result = session.execute(
-                sql,
-                {
-                }
-            )
-            rows = list(sql_result)
-            result = list()
-            for row in rows:
-                obj = dict()
-                obj["id"], \
-                    obj["class_id"], \
-                    obj["scrs_timestamp"], \
-                    obj["scrs_path"], \
-                    obj["is_complete"], \
-                    obj["result_conf"], \
-                    obj["result_json"], \
-                    obj["speed_ms"] = row
-                result.append(obj)
-
-            # Формируем результат для передачи
-            content = {
-                "data": result,
-                "errorCode": 0,
-                "ok": True
-            }
+        users = serialization.loads(await request.body())
+        if not isinstance(users, list):
+            raise ValueError("A list of users is expected")
+
+        # Id сообщения (контекст процесса)
+        message_id = str(uuid.uuid4())
+
+        results = await asyncio.to_thread(utils.create_users_bulk, users, message_id)
+        content = utils.result_ok({"results": results})
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content)
+
+
+@router.get("/get_results", dependencies=[Depends(rate_limit.limit_http("/get_results"))])
+@inject
+async def get_results(
+        request: Request,
+        with_json: bool = True,
+        date_from: str = None,
+        date_to: str = None,
+        since_id: int = None,
+        with_materials: bool = False,
+        credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)
+):
+    if with_materials:
+        reference_cache.refresh()
+    # Данные не менялись с версии, известной клиенту (ETag)
+    if data_version.not_modified(request):
+        return Response(status_code=304, headers=data_version.cache_headers(request))
+    headers = data_version.cache_headers(request)
+    try:
+        # Получаем записи. result_json распаковывается, только если клиент его запросил
+        where, params = utils.date_range_condition(date_from, date_to)
+        if since_id is not None:
+            # Только записи новее последней полученной клиентом (id растут и между шардами)
+            where = f"{where} and id > :since_id" if where else "where id > :since_id"
+            params["since_id"] = since_id
+        sql = queries.results_sql(where, with_json)
+        # Материалы отбираются одним запросом на БД по тому же условию
+        materials_sql = queries.results_materials_sql(where)
+        # Основная БД и шарды, попадающие в период
+        rows = list()
+        materials = dict()
+        for engine in shards.read_engines(date_from, date_to, since_id):
+            with Session(bind=engine) as session:
+                rows.extend(session.execute(sql, params))
+                if with_materials:
+                    for act_id, mat_class_id, conf, x1, y1, x2, y2 in session.execute(materials_sql, params):
+                        materials.setdefault(act_id, []).append({
+                            "mat_class_id": mat_class_id,
+                            "mat_class_name": reference_cache.material_class_name(mat_class_id),
+                            "conf": conf,
+                            "coords": [x1, y1, x2, y2] if x1 is not None else None
+                        })
+        if since_id is not None:
+            rows.sort(key=lambda r: r[0])
+        result = list()
+        for row in rows:
+            obj = dict()
+            obj["id"], \
+                obj["class_id"], \
+                obj["scrs_timestamp"], \
+                obj["scrs_path"], \
+                obj["is_complete"], \
+                obj["result_conf"], \
+                result_json, \
+                result_json_z, \
+                result_json_dict, \
+                obj["speed_ms"] = row
+            if with_json:
+                obj["result_json"] = read_result_json(result_json, result_json_z, result_json_dict)
+            if with_materials:
+                # Названия классов - из кэша справочников, без соединения таблиц в запросе
+                obj["class_name"] = reference_cache.activity_class_name(obj["class_id"])
+                obj["materials"] = materials.get(obj["id"], [])
+            result.append(obj)
+
+        # Формируем результат для передачи
+        content = {
+            "data": result,
+            "errorCode": 0,
+            "ok": True
+        }
     except Exception as e:
         content = {
             "data": {},
@@ -193,48 +585,84 @@ async def get_results(credentials: HTTPBasicCredentials = Depends(authenticate_u
             "error": e,
             "ok": False
         }
+        headers = None
         logger.debug(f'Error: {e}')
-    return JSONResponse(content=content)
+    return FastJSONResponse(content=content, headers=headers)
+
+
+@router.get("/get_reference")
+@inject
+async def get_reference(credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)):
+    """
+    Справочники классов материалов и activity (из кэша)
+    """
+    try:
+        content = utils.result_ok({
+            table: [{"id": class_id, **item} for class_id, item in sorted(reference_cache.get_classes(table).items())]
+            for table in reference_cache.reference_tables
+        })
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content)
+
+
+@router.get("/get_result_json")
+@inject
+async def get_result_json(id: int, credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)):
+    try:
+        engine = shards.engine_for_id(id)
+        if engine is None:
+            return FastJSONResponse(content=utils.result_error(error="Activity not found"))
+        with Session(bind=engine) as session:
+            sql = text("select result_json, result_json_z, result_json_dict from cv_activity where id = :id")
+            rows = list(session.execute(sql, {"id": id}))
+            if len(rows) == 0:
+                return FastJSONResponse(content=utils.result_error(error="Activity not found"))
+            content = utils.result_ok({"id": id, "result_json": read_result_json(*rows[0])})
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content)
 
 
 @router.get("/get_agr_results")
 @inject
-async def get_agr_results():
+async def get_agr_results(request: Request, date_from: str = None, date_to: str = None):
+    # Данные не менялись с версии, известной клиенту (ETag)
+    if data_version.not_modified(request):
+        return Response(status_code=304, headers=data_version.cache_headers(request))
+    headers = data_version.cache_headers(request)
     try:
-        with Session() as session:
-            # Получаем записи
-            sql = text("""
-                select date(scrs_timestamp) d,
-                    username, 
-                    is_complete,
-                    count(*) cnt,
-                    avg(speed_ms) speed_ms
-                from cv_activity
-                group by date(scrs_timestamp), username, is_complete
-                order by date(scrs_timestamp), username, is_complete
-            """)
-            sql_result = session.execute(
-                sql,
-                {
-                }
-            )
-            rows = list(sql_result)
-            result = list()
-            for row in rows:
-                obj = dict()
-                obj["d"], \
-                    obj["username"], \
-                    obj["is_complete"], \
-                    obj["cnt"], \
-                    obj["speed_ms"] = row
-                result.append(obj)
-
-            # Формируем результат для передачи
-            content = {
-                "data": result,
-                "errorCode": 0,
-                "ok": True
-            }
+        # Получаем записи
+        where, params = utils.date_range_condition(date_from, date_to)
+        sql = queries.agr_results_sql(where)
+        # Группы по дате не пересекаются между шардами, кроме основной БД:
+        # при совпадении ключа группы складываем количество и сумму speed_ms (avg не учитывает null)
+        groups = dict()
+        for engine in shards.read_engines(date_from, date_to):
+            with Session(bind=engine) as session:
+                for d, username, is_complete, cnt, speed_sum, speed_cnt in session.execute(sql, params):
+                    key = (d, username, is_complete)
+                    prev_cnt, prev_sum, prev_speed_cnt = groups.get(key, (0, 0, 0))
+                    groups[key] = (prev_cnt + cnt, prev_sum + (speed_sum or 0), prev_speed_cnt + speed_cnt)
+        result = list()
+        for key in sorted(groups, key=lambda k: tuple((v is not None, v) for v in k)):
+            cnt, speed_sum, speed_cnt = groups[key]
+            obj = dict()
+            obj["d"], \
+                obj["username"], \
+                obj["is_complete"] = key
+            obj["cnt"] = cnt
+            obj["speed_ms"] = speed_sum / speed_cnt if speed_cnt else None
+            result.append(obj)
+
+        # Формируем результат для передачи
+        content = {
+            "data": result,
+            "errorCode": 0,
+            "ok": True
+        }
     except Exception as e:
         content = {
             "data": {},
@@ -242,12 +670,197 @@ async def get_agr_results():
             "error": e,
             "ok": False
         }
+        headers = None
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content, headers=headers)
+
+
+@router.get("/get_latency_percentiles")
+@inject
+async def latency_percentiles(
+        date_from: str = None,
+        date_to: str = None,
+        username: str = None,
+        group_by: str = "day_user",
+        credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)
+):
+    """
+    Перцентили (p50/p90/p99, max) времени распознавания клиента (speed_ms)
+    и времени приёма результата сервером (ingest_ms) за период с точностью до дня.
+    group_by: day_user, day, user или total
+    """
+    try:
+        result = await asyncio.to_thread(latency_stats.get_percentiles, date_from, date_to, username, group_by)
+
+        # Формируем результат для передачи
+        content = {
+            "data": result,
+            "errorCode": 0,
+            "ok": True
+        }
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content)
+
+
+@router.get("/export_archive", dependencies=[Depends(rate_limit.limit_http("/export_archive"))])
+@inject
+async def export_archive(
+        date_from: str = None,
+        date_to: str = None,
+        username: str = None,
+        archive_format: str = "tar",
+        credentials: HTTPBasicCredentials = Depends(authenticate_admin_over_http)
+):
+    """
+    Выгрузка activity за период для аудита потоковым архивом (archive_format: tar или zip):
+    manifest/NNNNNN.jsonl - строки cv_activity с материалами cv_activity_mat, images/ - изображения.
+    Архив формируется на лету, не накапливаясь в памяти
+    """
+    if archive_format not in export.export_formats:
+        return FastJSONResponse(content=utils.result_error(error=f"Unknown archive format: {archive_format}"))
+    media_type, extension = export.export_formats[archive_format]
+    filename = "activities" + "".join(f"_{part[:10]}" for part in (date_from, date_to) if part) + extension
+    return StreamingResponse(
+        export.stream_export(archive_format, date_from, date_to, username),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.get("/get_detection_stats")
+@inject
+async def detection_stats(
+        date_from: str = None,
+        date_to: str = None,
+        mat_class_id: int = None,
+        bins: int = 20,
+        credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)
+):
+    try:
+        if not 1 <= bins <= 200:
+            raise ValueError("bins must be between 1 and 200")
+        # Расчёт выполняется вне цикла событий, чтобы не задерживать приём результатов
+        result = await asyncio.to_thread(get_detection_stats, date_from, date_to, mat_class_id, bins)
+
+        # Формируем результат для передачи
+        content = {
+            "data": result,
+            "errorCode": 0,
+            "ok": True
+        }
+    except Exception as e:
+        content = {
+            "data": {},
+            "errorCode": -1,
+            "error": str(e),
+            "ok": False
+        }
         logger.debug(f'Error: {e}')
-    return JSONResponse(content=content)
+    return FastJSONResponse(content=content)
+
+
+@router.get("/rate_limit_stats")
+@inject
+async def rate_limit_stats(credentials: HTTPBasicCredentials = Depends(authenticate_user_over_http)):
+    """
+    Счётчики ограничителя частоты по маршрутам: пропущено, задержано, отклонено
+    """
+    return FastJSONResponse(content=utils.result_ok(rate_limit.get_rate_limiter().get_stats()))
+
+
+@router.post("/profiler/start")
+@inject
+async def profiler_start(
+        duration: float = 30,
+        interval_ms: float = 10,
+        routes: str = None,
+        fraction: float = 1.0,
+        credentials: HTTPBasicCredentials = Depends(authenticate_admin_over_http)
+):
+    """
+    Запуск сэмплирующего профилировщика на `duration` секунд.
+    routes - маршруты через запятую (например, /ws/save_result,/get_results),
+    fraction - доля профилируемых запросов этих маршрутов
+    """
+    try:
+        route_set = {route.strip() for route in routes.split(",") if route.strip()} if routes else None
+        session = profiler.start(duration, interval_ms, route_set, fraction)
+        content = utils.result_ok(session.status())
+    except (ValueError, RuntimeError) as e:
+        content = utils.result_error(error=str(e))
+    return FastJSONResponse(content=content)
+
+
+@router.post("/profiler/stop")
+@inject
+async def profiler_stop(credentials: HTTPBasicCredentials = Depends(authenticate_admin_over_http)):
+    await asyncio.to_thread(profiler.stop)
+    return FastJSONResponse(content=utils.result_ok({}))
+
+
+@router.get("/profiler/status")
+@inject
+async def profiler_status(credentials: HTTPBasicCredentials = Depends(authenticate_admin_over_http)):
+    session = profiler.get_session()
+    return FastJSONResponse(content=utils.result_ok(session.status() if session is not None else {"running": False}))
+
+
+@router.get("/profiler/stacks")
+@inject
+async def profiler_stacks(credentials: HTTPBasicCredentials = Depends(authenticate_admin_over_http)):
+    """
+    Стеки последнего завершённого сеанса в формате collapsed stacks (flamegraph.pl, speedscope)
+    """
+    return PlainTextResponse(
+        profiler.collapsed_stacks(),
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
+
+
+@router.post("/login", dependencies=[Depends(rate_limit.limit_http("/login", by_user=True))])
+@inject
+async def login(request: Request):
+    """
+    Вход пользователя: реквизиты передаются в теле запроса (userdata, userpassword).
+    Возвращает данные пользователя и сессионный токен, который далее передаётся
+    в заголовке Authorization: Bearer (HTTP) или в поле token первого сообщения (websocket)
+    """
+    try:
+        json_result = serialization.loads(await request.body())
+        content = await asyncio.to_thread(utils.verify_user, json_result)
+        if content.get("ok"):
+            token, expires = session_tokens.get_token_store().issue(content["data"])
+            content["data"] = {**content["data"], "token": token, "expires": int(expires)}
+    except Exception as e:
+        content = utils.result_error(error=str(e))
+        logger.debug(f'Error: {e}')
+    return FastJSONResponse(content=content)
+
+
+@router.post("/logout")
+@inject
+async def logout(bearer: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    if not session_tokens.get_token_store().revoke(bearer.credentials):
+        return FastJSONResponse(content=utils.result_error(error="Session not found", error_code=-503))
+    return FastJSONResponse(content=utils.result_ok({}))
+
+
+@router.get("/verify_session")
+@inject
+async def verify_session(bearer: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    """
+    Проверка сессионного токена (без обращения к БД). Возвращает данные пользователя
+    """
+    data = session_tokens.get_token_store().check(bearer.credentials)
+    if data is None:
+        return FastJSONResponse(content=utils.result_error(error="Пользователь не найден", error_code=-503))
+    return FastJSONResponse(content=utils.result_ok(data))
 
 
-@router.get("/verify_user")
+@router.get("/verify_user", dependencies=[Depends(rate_limit.limit_http("/verify_user", by_user=True))])
 @inject
 async def verify_user(userdata, userpassword):
     print(userdata, userpassword)
-    return JSONResponse(content=utils.verify_user({"userdata": userdata, "userpassword": userpassword}))
+    return FastJSONResponse(content=utils.verify_user({"userdata": userdata, "userpassword": userpassword}))